@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the rheofit hot paths
+-----------------------------------
+
+Times loading, tidying and fitting and records for every benchmark the wall
+time (min and median of the repeats), the number of model evaluations of the
+fits (nfev) and the peak Python memory allocated (tracemalloc).
+
+Results are saved as json in benchmarks/results, named after the date and
+the git commit, so that two runs can be compared.
+
+Example:
+
+        python benchmarks/run_benchmarks.py
+        python benchmarks/run_benchmarks.py -k fit_FC --repeat 20
+        python benchmarks/run_benchmarks.py --compare benchmarks/results/<baseline>.json
+
+With --compare the script exits with status 1 when a benchmark median time
+(or its nfev or peak memory) grew by more than --threshold.
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATA_DIR = os.path.join(ROOT, 'notebooks', 'data')
+RHEOML_FILE = os.path.join(ROOT, 'docs', 'source', '_static',
+                           'Flow_curve_example.xml')
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'results')
+
+# import time measured in a fresh interpreter
+IMPORT_SCRIPT = '''
+import json, sys, time, tracemalloc
+sys.path.insert(0, {root!r})
+if {trace}:
+    tracemalloc.start()
+start = time.perf_counter()
+import rheofit.models
+wall = time.perf_counter() - start
+peak = tracemalloc.get_traced_memory()[1] if {trace} else None
+print(json.dumps({{'wall': wall, 'peak_memory': peak}}))
+'''
+
+
+def xls_files():
+    '''Bundled TRIOS multitab exports used by the loading benchmarks'''
+    return sorted(glob.glob(os.path.join(DATA_DIR, '*.xls')))
+
+
+def bench_import():
+    '''import rheofit.models in a new interpreter'''
+    def run(trace=False):
+        output = subprocess.run(
+            [sys.executable, '-c', IMPORT_SCRIPT.format(root=ROOT, trace=trace)],
+            check=True, capture_output=True, text=True).stdout
+        return json.loads(output)
+    return run
+
+
+def call(func, *args, **kwargs):
+    '''Function to time calling func, its result is discarded'''
+    def run():
+        func(*args, **kwargs)
+    return run
+
+
+def make_benchmarks():
+    '''List of (name, setup) pairs
+
+    setup() prepares the input data and returns the function to time, that
+    function may return a dictionary of extra metrics (e.g. nfev).
+    '''
+    import rheofit
+    from rheofit import models, rheodata
+
+    benchmarks = []
+
+    for filename in xls_files():
+        def setup(filename=filename):
+            return call(rheodata.rheology_data, filename)
+        benchmarks.append(('load[' + os.path.basename(filename) + ']', setup))
+
+    def setup_tidy():
+        data = rheodata.rheology_data(max(xls_files(), key=os.path.getsize))
+        return call(lambda: data.tidy)
+    benchmarks.append(('tidy', setup_tidy))
+
+    def setup_tidy_categorical():
+        data = rheodata.rheology_data(max(xls_files(), key=os.path.getsize))
+        return call(data.tidy_table, categorical=True)
+    benchmarks.append(('tidy_table[categorical]', setup_tidy_categorical))
+
+    def setup_dicttopanda():
+        data_dict = rheodata.get_data_dict(RHEOML_FILE)
+        return call(rheodata.dicttopanda, data_dict)
+    benchmarks.append(('dicttopanda', setup_dicttopanda))
+
+    def setup_read_rheoml():
+        return call(rheodata.read_rheoml, RHEOML_FILE)
+    benchmarks.append(('read_rheoml', setup_read_rheoml))
+
+    benchmarks.append(('example_emulsion',
+                       lambda: call(rheodata.example_emulsion)))
+
+    for name in models.available_models():
+        def setup(name=name):
+            model = models.get_model(name)
+            data = rheodata.example_emulsion()
+
+            def run():
+                return {'nfev': models.fit_FC(model, data).nfev}
+            return run
+        benchmarks.append(('fit_FC[' + name + ']', setup))
+
+        def setup_log(name=name):
+            model = models.get_model(name)
+            data = rheodata.example_emulsion()
+
+            def run():
+                return {'nfev': models.fit_FC(model, data, residual='log').nfev}
+            return run
+        benchmarks.append(('fit_FC_log[' + name + ']', setup_log))
+
+        if models.get_model(name).basis is not None:
+            def setup_varpro(name=name):
+                model = models.get_model(name)
+                data = rheodata.example_emulsion()
+
+                def run():
+                    result = models.fit_FC(model, data, method='varpro')
+                    return {'nfev': result.nfev
+                            + getattr(result, 'varpro_nfev', 0)}
+                return run
+            benchmarks.append(('fit_FC_varpro[' + name + ']', setup_varpro))
+
+    for name in rheofit.kernels.available_kernels():
+        for backend in rheofit.kernels.available_backends():
+            def setup_fused(name=name, backend=backend):
+                model = models.get_model(name, backend=backend)
+                data = rheodata.example_emulsion()
+
+                def run():
+                    return {'nfev': models.fit_FC(model, data).nfev}
+                return run
+            benchmarks.append(('fit_FC_' + backend + '[' + name + ']',
+                               setup_fused))
+
+    def setup_bands():
+        import numpy
+        results = [models.fit_FC(models.HB_model, rheodata.example_emulsion())
+                   for _ in range(20)]
+        grid = numpy.logspace(-2, 3, 1000)
+
+        def run():
+            for result in results:
+                result.__dict__.pop('_bands_cache', None)
+            rheofit.bands.confidence_bands(results, x=grid, sigma=3)
+        return run
+    benchmarks.append(('confidence_bands[HB_model]', setup_bands))
+
+    def setup_bootstrap():
+        data = rheodata.example_emulsion()
+        return call(rheofit.bootstrap.bootstrap_FC, models.HB_model, data,
+                    n_replicates=1000, seed=0, n_workers=1)
+    benchmarks.append(('bootstrap_FC[HB_model]', setup_bootstrap))
+
+    def setup_batch():
+        curves = [rheodata._select_step(rheodata.rheology_data(filename))[1]
+                  for filename in xls_files()]
+
+        def run():
+            result = rheofit.batch.fit_FC_batch(models.HB_model, curves)
+            return {'nfev': int(result['nfev'].sum())}
+        return run
+    benchmarks.append(('fit_FC_batch[HB_model]', setup_batch))
+
+    def setup_global():
+        curves = [rheodata._select_step(rheodata.rheology_data(filename))[1]
+                  for filename in xls_files()]
+
+        def run():
+            result = rheofit.batch.fit_FC_global(models.HB_model, curves,
+                                                 shared=['n'])
+            return {'nfev': int(result.nfev)}
+        return run
+    benchmarks.append(('fit_FC_global[HB_model]', setup_global))
+
+    return benchmarks
+
+
+def measure(run, repeat):
+    '''Time run() repeat times, then once more under tracemalloc'''
+    times = []
+    extra = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extra = run() or {}
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    record = {'wall_min': min(times), 'wall_median': statistics.median(times),
+              'repeat': repeat, 'peak_memory': peak}
+    record.update(extra)
+    return record
+
+
+def measure_import(run, repeat):
+    '''Same record as measure, timed inside the child interpreter'''
+    times = [run()['wall'] for _ in range(repeat)]
+    return {'wall_min': min(times), 'wall_median': statistics.median(times),
+            'repeat': repeat, 'peak_memory': run(trace=True)['peak_memory']}
+
+
+def environment():
+    '''Commit and library versions stored with the results'''
+    def git(*args):
+        try:
+            return subprocess.run(['git', '-C', ROOT] + list(args), check=True,
+                                  capture_output=True, text=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    import lmfit
+    import numpy
+    import pandas
+    return {'commit': git('rev-parse', '--short', 'HEAD'),
+            'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': numpy.__version__,
+            'pandas': pandas.__version__,
+            'lmfit': lmfit.__version__}
+
+
+def run_benchmarks(select=None, repeat=5):
+    '''Run the benchmarks whose name contains one of the select strings'''
+    results = {}
+    if not select or any(key in 'import' for key in select):
+        results['import'] = measure_import(bench_import(), repeat)
+        print_record('import', results['import'])
+    for name, setup in make_benchmarks():
+        if select and not any(key in name for key in select):
+            continue
+        try:
+            results[name] = measure(setup(), repeat)
+        except Exception as error:
+            print(name, 'failed:', repr(error))
+            continue
+        print_record(name, results[name])
+    return results
+
+
+def print_record(name, record):
+    nfev = ' nfev {:6d}'.format(record['nfev']) if 'nfev' in record else ''
+    print('{:45s} {:10.2f} ms  (min {:8.2f} ms)  peak {:8.1f} kB{}'.format(
+        name, 1e3 * record['wall_median'], 1e3 * record['wall_min'],
+        record['peak_memory'] / 1024, nfev))
+
+
+def compare(baseline, results, threshold=0.25):
+    '''Print the ratio new/baseline, return the names of the regressions'''
+    regressions = []
+    print('\n{:45s} {:>8s} {:>8s} {:>8s}'.format('benchmark', 'time', 'memory', 'nfev'))
+    for name, record in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        ratios = {'time': record['wall_median'] / old['wall_median'],
+                  'memory': record['peak_memory'] / max(old['peak_memory'], 1)}
+        if 'nfev' in record and 'nfev' in old:
+            ratios['nfev'] = record['nfev'] / max(old['nfev'], 1)
+        regression = any(ratio > 1 + threshold for ratio in ratios.values())
+        print('{:45s} {:8.2f} {:8.2f} {:>8s}{}'.format(
+            name, ratios['time'], ratios['memory'],
+            '{:.2f}'.format(ratios['nfev']) if 'nfev' in ratios else '-',
+            '  <- regression' if regression else ''))
+        if regression:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='rheofit benchmarks')
+    parser.add_argument('-k', dest='select', action='append',
+                        help='run only benchmarks containing this string')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=RESULTS_DIR,
+                        help='folder of the result files')
+    parser.add_argument('--no-save', action='store_true')
+    parser.add_argument('--compare', help='result file used as baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='relative increase reported as regression')
+    args = parser.parse_args(argv)
+
+    env = environment()
+    results = run_benchmarks(args.select, args.repeat)
+
+    if not args.no_save:
+        os.makedirs(args.output, exist_ok=True)
+        path = os.path.join(args.output, '{}_{}.json'.format(
+            env['date'].replace(':', '').replace('-', ''), env['commit']))
+        with open(path, 'w') as file:
+            json.dump({'environment': env, 'results': results}, file, indent=1)
+        print('\nresults saved in', path)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+        if compare(baseline, results, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,8 @@
 import pandas as pd
-import yaml
 import numpy as np
 from plot_function import *
 from scipy.optimize import curve_fit
-import glob
+from rheofit.rheodata import read_digitized
 
 # define TC model
 def TC(x, tauy, gamma_dotc, etas):
@@ -53,40 +52,18 @@ def fit_TC(df):
         except RuntimeError:
             print('No fit TC possible')
 
-csv_files = glob.glob('*.csv')
-
-
-papers_info = yaml.safe_load(open(glob.glob('data*.yml')[0]))
-for file in csv_files:
-    name = file.replace('.csv', '')
-
-    df_raw = pd.read_csv( name + '.csv')
-
-    df = pd.DataFrame(columns=['ID', 'solvent_viscosity', 'phi', 'shear_rate', 'stress'])
-    ID = name
-    solvent_viscosity = papers_info[name]['solvent_viscosity']
-    for i, column_name in enumerate(df_raw.columns):
-        if i%2 == 0:
-            phi = float(column_name)
-            if papers_info[name]['unit_x'] == 's-1':
-                shear_rate = np.array(df_raw[column_name], dtype=float)
-            elif papers_info[name]['unit_x'] == '0.158s-1':
-                shear_rate = np.array(df_raw[column_name], dtype=float) / 0.158
-            shear_rate = shear_rate[~np.isnan(shear_rate)]
-        else:
-            if papers_info[name]['unit_y'] == 'Pa':
-                stress =  np.array(df_raw[column_name])
-            elif papers_info[name]['unit_y'] == 'dynes/cm2':
-                stress = 0.1* np.array(df_raw[column_name])
-            elif papers_info[name]['unit_y'] == '0.0825Pa':
-                stress =  np.array(df_raw[column_name]) * 0.0825
-            stress = stress[~np.isnan(stress)]
-
-
-
-            df = df.append(dict(zip(df.columns,
-                                    [ID, solvent_viscosity, phi, shear_rate, stress])),
-                                    ignore_index=True)
+# every csv of the folder, units converted with data_from_litterature.yml
+data = read_digitized('.', recursive=False)
+curves = data.flow_curves()
+
+for name, dataset in data.datasets.iterrows():
+    df = pd.DataFrame([{'ID': name,
+                        'solvent_viscosity': dataset['solvent_viscosity'],
+                        'phi': float(label),
+                        'shear_rate': curve.shear_rate,
+                        'stress': curve.stress}
+                       for (ID, label), curve in curves.items() if ID == name],
+                      columns=['ID', 'solvent_viscosity', 'phi', 'shear_rate', 'stress'])
 
     fit_TC(df)
     df.to_pickle('df_' + name + '.pkl')
@@ -7,6 +7,7 @@ import pandas as pd
 import yaml
 from math import log10, floor
 import matplotlib.pyplot as plt
+from rheofit.store import results_store
 mpl.rcParams['text.latex.preamble'] = r'\usepackage{amsmath}'
 
 
@@ -46,15 +47,8 @@ def fit_TC_HB(df, sample_ID, T, plot=True, replace=False):
                 'tauc_TC', 'err_taucTC', 'etas', 'err_etas', 'gamma_dotc',
                 'err_gammadotc', 'gammac', 'err_gammac']
 
-    try :
-        df_fit_pkl = pd.read_pickle('df_fit.pkl')
-    except FileNotFoundError :
-        print('new pickle file')
-        df_fit_pkl = pd.DataFrame(columns=columns)
-
-    if replace:
-        print('data will be replaced')
-        df_fit_pkl = pd.DataFrame(columns=columns)
+    # one part file per fit, several processes can append at the same time
+    store = results_store('df_fit')
 
     # Select data of interest in the dataframe
     dfh = df[(df.temperature == T) &
@@ -198,11 +192,14 @@ def fit_TC_HB(df, sample_ID, T, plot=True, replace=False):
     print(dict_fits)
 
 
-    df_fit_pkl = df_fit_pkl.append(dict(zip(df_fit_pkl.columns,[int(sample_ID), w_pourcent, solvant, microgel_type,
-                                                        T, tauc_HB, err_taucHB, K, err_K, n, err_n,
-                                                        tauc_TC, err_taucTC, etas, err_etas,
-                                                        gamma_dotc, err_gammadotc, gammac, err_gammac])), ignore_index=True)
+    if replace:
+        # only the previous results of this sample and temperature
+        print('data will be replaced')
+        store.delete(sample_ID=int(sample_ID), temperature=T)
 
-    df_fit_pkl.to_pickle('df_fit.pkl', compression='infer', protocol=5, storage_options=None)
+    store.append(dict(zip(columns, [int(sample_ID), w_pourcent, solvant, microgel_type,
+                                    T, tauc_HB, err_taucHB, K, err_K, n, err_n,
+                                    tauc_TC, err_taucTC, etas, err_etas,
+                                    gamma_dotc, err_gammadotc, gammac, err_gammac])))
 
     return dict_fits
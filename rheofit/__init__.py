@@ -5,5 +5,19 @@ Import and analyze rheological data
 __version__ = "0.1.3"
 
 from . import models
-from . import rheodata
-from . import visualization
+
+# imported on first access (rheofit.<name>), so that importing the package
+# does not import xlrd, sqlite3, scipy or matplotlib (slow to import)
+_SUBMODULES = ("rheodata", "batch", "cache", "varpro", "kernels", "bands",
+               "bootstrap", "catalog", "store", "visualization")
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        import importlib
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES))
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+lmfit model class of :mod:`rheofit.models`
+
+Kept apart from :mod:`rheofit.models` so that lmfit (and scipy) are only
+imported when the first model object is built.
+"""
+import copy
+import functools
+
+import lmfit
+import numpy as np
+
+
+def _lmfit_residual_sign():
+    """Return +1 if lmfit defines residuals as (model - data) * weights,
+    -1 if it uses (data - model) * weights (lmfit >= 1.2)"""
+    global _LMFIT_RESIDUAL_SIGN
+    if _LMFIT_RESIDUAL_SIGN is None:
+        probe = lmfit.Model(lambda x, a=1.0: a * x)
+        residual = probe._residual(probe.make_params(), np.zeros(1), None,
+                                   x=np.ones(1))
+        _LMFIT_RESIDUAL_SIGN = float(np.sign(residual[0]))
+    return _LMFIT_RESIDUAL_SIGN
+
+
+_LMFIT_RESIDUAL_SIGN = None
+
+# floor of the model values in log residuals (log(0) is not finite)
+_TINY = np.finfo("float").tiny
+
+
+def _log_residual(model, params, data, weights, **kwargs):
+    """Residual (log(model) - log(data)) * weights of any lmfit model
+
+    Same call signature as lmfit.Model._residual, the sign follows the
+    residual definition of the installed lmfit.
+    """
+    values = np.asarray(model.eval(params, **kwargs), dtype="float")
+    if model.nan_policy == "raise" and not np.all(np.isfinite(values)):
+        raise ValueError("The model function generated NaN values and the "
+                         "fit aborted!")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        residual = (np.log(np.maximum(values, _TINY))
+                    - np.log(np.asarray(data, dtype="float")))
+    if weights is not None:
+        residual = residual * np.asarray(weights, dtype="float")
+    return residual.ravel() * _lmfit_residual_sign()
+
+
+def _log_residual_jacobian(model, params, data, weights, **kwargs):
+    """Jacobian of :meth:`_log_residual` for models with a jac function"""
+    values = np.asarray(model.eval(params, **kwargs), dtype="float")
+    jacobian = model._residual_jacobian(params, None, weights, **kwargs)
+    return jacobian / np.maximum(values, _TINY).reshape(-1, 1)
+
+
+def _jacobian_fit_kws(model, method, fit_kws, params, dfun):
+    """fit_kws of lmfit.Model.fit with Dfun set to the analytic jacobian
+
+    Only when the model has derivatives, the method uses Dfun ('leastsq' or
+    'least_squares'), fit_kws do not already give a jacobian and no
+    parameter is constrained by an expression.
+
+    Args:
+        dfun: jacobian function with the signature of lmfit Dfun
+    """
+    fit_kws = dict(fit_kws or {})
+    check_params = params if params is not None else model.make_params()
+    if (getattr(model, "jac", None) is not None
+            and method in ("leastsq", "least_squares")
+            and "Dfun" not in fit_kws and "jac" not in fit_kws
+            and all(par.expr is None for par in check_params.values())):
+        fit_kws["Dfun"] = dfun
+    return fit_kws
+
+
+def fit_log_residual(model, data, params=None, weights=None, method="leastsq",
+                     fit_kws=None, **kwargs):
+    """Fit any lmfit model minimizing the residual log(model) - log(data)
+
+    A flow curve spanning several decades is then fitted with the same
+    relative precision everywhere, with a well conditioned least squares
+    problem. The closed-form derivatives of a rheology_model are divided by
+    the model values, as the derivative of log(model).
+
+    Same arguments as lmfit.Model.fit, the result has the attribute
+    residual_mode = 'log' (its residual and chisqr are in log units).
+    """
+    fit_kws = _jacobian_fit_kws(
+        model, method, fit_kws, params,
+        functools.partial(_log_residual_jacobian, model))
+    # lmfit builds the minimizer from model._residual: a shallow copy of the
+    # model carries the log residual, the model itself (shared by the fits
+    # running in other threads) is never modified. The result keeps the copy
+    log_model = copy.copy(model)
+    log_model._residual = functools.partial(_log_residual, model)
+    result = lmfit.Model.fit(log_model, data, params=params, weights=weights,
+                             method=method, fit_kws=fit_kws, **kwargs)
+    result.residual_mode = "log"
+    return result
+
+
+class rheology_model(lmfit.Model):
+    """lmfit.Model with closed-form partial derivatives of the model function
+
+    When a jacobian function is provided, it is used automatically by
+    :meth:`fit` for the 'leastsq' and 'least_squares' methods instead of
+    finite differences.
+
+    Args:
+        func: model function, first argument is the shear rate
+
+        jac: function with the same signature of func returning a dictionary
+             {parameter name: partial derivative of the stress}
+
+        guess: function (shear rate, stress, transforms=None) returning a
+               dictionary {parameter name: starting value estimated from
+               the data}
+
+        basis: function (shear rate, nonlinear parameters) returning a
+               dictionary {linear parameter name: stress per unit of the
+               parameter}, see :mod:`rheofit.varpro`
+
+        expression: LaTeX string of the model equation
+
+        **kwargs: passed to lmfit.Model (e.g. prefix)
+    """
+
+    def __init__(self, func, jac=None, guess=None, basis=None,
+                 expression=None, **kwargs):
+        super().__init__(func, **kwargs)
+        self.jac = jac
+        self.guess_func = guess
+        self.basis = basis
+        self.expression = expression
+
+    @property
+    def model_expression(self):
+        """IPython Math object of the model equation (built on access)"""
+        if self.expression is None:
+            return None
+        from IPython.display import Math
+        return Math(self.expression)
+
+    @model_expression.setter
+    def model_expression(self, value):
+        # accept both a LaTeX string and an IPython Math object
+        self.expression = getattr(value, "data", value)
+
+    def guess(self, data, x, transforms=None, **kwargs):
+        """Estimate starting values of the parameters from the data
+
+        Parameters fixed or constrained by the hints, and estimates that are
+        not finite or outside the bounds, keep the value of the hints. The
+        defaults are returned when the curve has too few valid points.
+
+        Args:
+            data: stress
+
+            x: shear rate
+
+            transforms: :meth:`rheofit.models.curve_transforms` of the data
+                when already computed
+
+            **kwargs: parameter values overriding the estimates (root names)
+
+        Returns:
+            lmfit.Parameters
+        """
+        if self.guess_func is None:
+            return super().guess(data, x, **kwargs)
+        params = self.make_params()
+        try:
+            if transforms is None:
+                estimates = self.guess_func(x, data)
+            else:
+                estimates = self.guess_func(x, data, transforms=transforms)
+        except (ValueError, np.linalg.LinAlgError):
+            estimates = {}
+        for name, value in estimates.items():
+            par = params[self.prefix + name]
+            if (par.vary and par.expr is None and np.isfinite(value)
+                    and par.min < value < par.max):
+                par.set(value=float(value))
+        return lmfit.models.update_param_vals(params, self.prefix, **kwargs)
+
+    def eval_jacobian(self, params=None, **kwargs):
+        """Evaluate the partial derivatives of the model
+
+        Args:
+            params: lmfit.Parameters
+
+            x: shear rate
+
+        Returns:
+            dictionary {parameter name (with prefix): partial derivative}
+        """
+        x = np.asarray(kwargs.pop("x"), dtype="float")
+        values = {name: params[self.prefix + name].value
+                  for name in self._param_root_names}
+        values.update(kwargs)
+        return {self.prefix + name: np.broadcast_to(derivative, x.shape)
+                for name, derivative in self.jac(x, **values).items()}
+
+    def _residual_jacobian(self, params, data, weights, **kwargs):
+        """Jacobian of the residual (model - data) * weights
+
+        Same call signature as lmfit.Model._residual, columns ordered as the
+        varying parameters (format expected by the Dfun option of leastsq).
+        The sign follows the residual definition of the installed lmfit.
+        """
+        jacobian = self.eval_jacobian(params, **kwargs)
+        columns = [jacobian[name] for name, par in params.items() if par.vary]
+        jac = np.stack(columns, axis=1)
+        if weights is not None:
+            jac = jac * np.asarray(weights, dtype="float").reshape(-1, 1)
+        return jac * _lmfit_residual_sign()
+
+    def fit(self, data, params=None, weights=None, method="leastsq",
+            fit_kws=None, **kwargs):
+        """Fit the model to the data (see lmfit.Model.fit)
+
+        The analytic jacobian is passed to the minimizer when available,
+        unless one is already given in fit_kws or some parameter is
+        constrained by an expression.
+        """
+        fit_kws = _jacobian_fit_kws(self, method, fit_kws, params,
+                                    self._residual_jacobian)
+        return super().fit(data, params=params, weights=weights,
+                           method=method, fit_kws=fit_kws, **kwargs)
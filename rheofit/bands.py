@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Module for confidence and prediction bands of fitted models
+-----------------------------------------------------------
+
+The uncertainty of the model prediction at shear rate x follows from the
+covariance matrix C of the fitted parameters and the partial derivatives
+J(x) of the model:
+
+        var(x) = J(x) C J(x)^T
+
+lmfit's ModelResult.eval_uncertainty computes J by finite differences, two
+model evaluations per parameter and per call. Here J comes from the closed
+form derivatives of the models (see :meth:`rheofit.models.HB_jac`) evaluated
+for all shear rates, and for all the results of the same model, in one
+vectorized call. Models without derivatives (e.g. composite models) use
+central differences, also vectorized.
+
+Bands are cached on the fit result, so plotting them again is free.
+
+Example:
+
+        dely, dely_predicted = rheofit.bands.confidence_band(result, sigma=3)
+
+        bands = rheofit.bands.confidence_bands(list_of_results, x=grid)
+
+"""
+import numpy as np
+
+# relative step of the finite difference derivatives (as lmfit)
+_DSCALE = 0.01
+
+
+def _scale(result, sigma):
+    """Student t quantile of the confidence level (as eval_uncertainty)"""
+    from scipy.special import erf
+    from scipy.stats import t
+
+    prob = sigma if sigma < 1 else erf(sigma / np.sqrt(2))
+    return t.ppf((prob + 1) / 2, result.ndata - result.nvarys)
+
+
+def _noise_scale(result, x):
+    """Standard deviation of the data at x relative to the reduced chi square
+
+    The inverse of the fit weights, interpolated log-log in the shear rate
+    when x differs from the fitted shear rates. Log residuals are relative
+    errors of the model.
+    """
+    if getattr(result, "residual_mode", "linear") == "log":
+        return np.abs(np.broadcast_to(result.eval(x=x), x.shape))
+    if result.weights is None:
+        return np.ones_like(x)
+    fit_x = np.asarray(result.userkws["x"], dtype="float")
+    inverse = 1 / np.broadcast_to(np.asarray(result.weights, dtype="float"),
+                                  fit_x.shape)
+    if fit_x.shape == x.shape and np.array_equal(fit_x, x):
+        return inverse
+    order = np.argsort(fit_x)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.exp(np.interp(np.log(x), np.log(fit_x[order]),
+                                np.log(np.abs(inverse[order]))))
+
+
+def _jacobians(model, results, x):
+    """ Derivatives of the model for several results of the same model
+
+        Args:
+
+        model: rheology model
+
+        results: list of lmfit.fitresult with the same varying parameters
+
+        x: shear rate, shape (number of results, number of points)
+
+        Returns:
+
+        array (number of results, number of varying parameters, number of points)
+    """
+    from .batch import _eval_vectorized
+
+    var_names = results[0].var_names
+    values = {name: np.array([[result.params[name].value] for result in results])
+              for name in model.param_names}
+    if getattr(model, "jac", None) is not None:
+        derivatives = model.jac(x, **{name[len(model.prefix):]: value
+                                      for name, value in values.items()})
+        return np.stack([np.broadcast_to(derivatives[name[len(model.prefix):]],
+                                         x.shape)
+                         for name in var_names], axis=1)
+
+    jacobian = np.empty((len(results), len(var_names), x.shape[1]))
+    for i, name in enumerate(var_names):
+        step = np.array([[(result.params[name].stderr or 0) * _DSCALE]
+                         for result in results])
+        # parameters without uncertainty get a step relative to their value
+        step = np.where(step > 0, step, 1e-8 * np.maximum(np.abs(values[name]), 1))
+        shifted = dict(values)
+        shifted[name] = values[name] + step
+        upper = _eval_vectorized(model, shifted, x)
+        shifted[name] = values[name] - step
+        lower = _eval_vectorized(model, shifted, x)
+        jacobian[:, i] = (upper - lower) / (2 * step)
+    return jacobian
+
+
+def _cache_key(result, x, sigma):
+    values = tuple(par.value for par in result.params.values())
+    return (sigma, None if x is None else (x.shape, x.tobytes()), values)
+
+
+def confidence_bands(results, x=None, sigma=1):
+    """ Confidence and prediction bands of several fit results
+
+        Results of the same model with the same number of points are
+        computed together. The bands are cached on each result (and set as
+        its dely and dely_predicted attributes, as eval_uncertainty does).
+
+        Args:
+
+        results: list (or dict) of lmfit.fitresult
+
+        x: shear rates of the bands (default the fitted shear rates)
+
+        sigma: confidence level in number of standard deviations, values
+        below 1 are the probability itself (as eval_uncertainty)
+
+        Returns:
+
+        list (dict if results is a dict) of (dely, dely_predicted) arrays,
+        the half widths of the confidence band of the model and of the
+        prediction band of new data
+    """
+    keys = list(results) if isinstance(results, dict) else None
+    results = [results[key] for key in keys] if keys is not None else list(results)
+    if x is not None:
+        x = np.asarray(x, dtype="float")
+
+    bands = [None] * len(results)
+    groups = {}
+    for index, result in enumerate(results):
+        cache = result.__dict__.setdefault("_bands_cache", {})
+        key = _cache_key(result, x, sigma)
+        if key in cache:
+            bands[index] = cache[key]
+            continue
+        if any(par.expr is not None for par in result.params.values()):
+            # parameters constrained by expressions: lmfit differentiates
+            # through the constraints
+            kwargs = {} if x is None else {"x": x}
+            dely = result.eval_uncertainty(sigma=sigma, **kwargs)
+            bands[index] = cache[key] = (dely, result.dely_predicted)
+            continue
+        result_x = x if x is not None else np.asarray(result.userkws["x"],
+                                                      dtype="float")
+        group = (id(result.model), tuple(result.var_names), result_x.shape)
+        groups.setdefault(group, []).append((index, result, result_x))
+
+    for members in groups.values():
+        model = members[0][1].model
+        group_results = [result for _, result, _ in members]
+        xs = np.stack([result_x.reshape(-1) for _, _, result_x in members])
+        jacobian = _jacobians(model, group_results, xs)
+        covar = np.stack([result.covar if result.covar is not None
+                          else np.full((result.nvarys, result.nvarys), np.nan)
+                          for result in group_results])
+        variance = np.einsum("rim,rij,rjm->rm", jacobian, covar, jacobian)
+        for (index, result, result_x), var in zip(members, variance):
+            if result.covar is None:
+                # no uncertainty estimate (as eval_uncertainty)
+                var = np.zeros_like(var)
+            scale = _scale(result, sigma)
+            var = np.maximum(var, 0).reshape(result_x.shape)
+            noise = result.redchi * _noise_scale(result, result_x) ** 2
+            band = (scale * np.sqrt(var), scale * np.sqrt(var + noise))
+            result._bands_cache[_cache_key(result, x, sigma)] = band
+            bands[index] = band
+
+    for result, band in zip(results, bands):
+        result.dely, result.dely_predicted = band
+    return dict(zip(keys, bands)) if keys is not None else bands
+
+
+def confidence_band(result, x=None, sigma=1):
+    """ Confidence and prediction band of a fit result
+
+        Same as lmfit ModelResult.eval_uncertainty with analytic derivatives
+        (see :meth:`confidence_bands`). The prediction band uses the weights
+        of the fit as standard deviation of the data (scaled by the reduced
+        chi square).
+
+        Args:
+
+        result: lmfit.fitresult
+
+        x: shear rates of the band (default the fitted shear rates)
+
+        sigma: confidence level in number of standard deviations
+
+        Returns:
+
+        (dely, dely_predicted) half widths of the confidence band of the
+        model and of the prediction band of new data
+    """
+    return confidence_bands([result], x=x, sigma=sigma)[0]
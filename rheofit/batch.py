@@ -0,0 +1,754 @@
+# -*- coding: utf-8 -*-
+"""
+Module for fitting many flow curves at once
+-------------------------------------------
+
+:meth:`rheofit.models.fit_FC` fits a single flow curve with one lmfit fit.
+When thousands of curves have to be fitted with the same model, most of the
+time goes into the per-call Python and lmfit setup rather than into the
+model itself.
+
+The functions in this module stack all curves into one least squares
+problem. The model is evaluated once for all data points with per-point
+parameter arrays. Since the parameters of one curve only affect the
+residuals of that curve, the Levenberg-Marquardt normal equations are block
+diagonal and are solved for all curves at once, so the number of model
+evaluations per iteration does not grow with the number of curves.
+
+:meth:`fit_FC_global` fits a series of curves with some parameters shared
+by all the curves (e.g. the flow index of a concentration series), the
+Jacobian is then block sparse instead of block diagonal.
+
+Example:
+
+        rheofit.batch.fit_FC_batch(rheofit.models.HB_model, list_of_dataframes)
+
+        rheofit.batch.fit_FC_global(rheofit.models.HB_model,
+                                    list_of_dataframes, shared=['n']).table
+
+"""
+import collections
+
+import numpy as np
+import pandas as pd
+
+
+def _collect_curves(curves, by=None):
+    """ Normalize the different flow curve containers to ragged arrays
+
+        Args:
+
+        curves: one of
+            - list of pandas DataFrame with column 'Shear rate' and 'Stress'
+            - dict of pandas DataFrame (keys are used as curve labels)
+            - tidy pandas DataFrame, split in curves by the columns in `by`
+            - tuple (list of shear rate arrays, list of stress arrays)
+
+        by: column name or list of column names used to split a tidy DataFrame
+
+        Returns:
+
+        keys, list of shear rate arrays, list of stress arrays
+    """
+    if isinstance(curves, pd.DataFrame):
+        if by is None:
+            frames = [(0, curves)]
+        else:
+            frames = list(curves.groupby(by, sort=False))
+    elif isinstance(curves, dict):
+        frames = list(curves.items())
+    elif (isinstance(curves, tuple) and len(curves) == 2
+          and not isinstance(curves[0], pd.DataFrame)):
+        keys = list(range(len(curves[0])))
+        return (keys,
+                [np.asarray(x, dtype='float') for x in curves[0]],
+                [np.asarray(y, dtype='float') for y in curves[1]])
+    else:
+        frames = list(enumerate(curves))
+
+    keys = [key for key, _ in frames]
+    xs = [np.asarray(frame['Shear rate'], dtype='float') for _, frame in frames]
+    ys = [np.asarray(frame['Stress'], dtype='float') for _, frame in frames]
+    return keys, xs, ys
+
+
+# stacked data of a batch fit, see _prepare_batch
+_batch_data = collections.namedtuple('_batch_data', [
+    'keys', 'xs', 'ys', 'sizes', 'x', 'y', 'weights', 'log_y', 'segment',
+    'params', 'var_names', 'fixed'])
+
+
+def _prepare_batch(model, curves, by, params, residual):
+    """ Stacked data and parameters shared by fit_FC_batch and fit_FC_global
+
+        Args:
+
+        model, curves, by, params, residual: as in :meth:`fit_FC_batch`
+
+        Returns:
+
+        _batch_data with the curve keys, the masked shear rate and stress
+        arrays of every curve (xs, ys) and concatenated (x, y), the number
+        of points of every curve (sizes), the weights 1/Stress, log(Stress)
+        for log residuals (else None), the curve index of every point
+        (segment), the parameters (default model.make_params()), the names
+        of the varying parameters and the values of the fixed ones
+    """
+    if residual not in ('linear', 'log'):
+        raise ValueError("unknown residual {!r}, use 'linear' or 'log'".format(
+            residual))
+    keys, xs, ys = _collect_curves(curves, by)
+
+    masks = [np.isfinite(x) & np.isfinite(y)
+             & ((y > 0) if residual == 'log' else (y != 0))
+             for x, y in zip(xs, ys)]
+    xs = [x[mask] for x, mask in zip(xs, masks)]
+    ys = [y[mask] for y, mask in zip(ys, masks)]
+
+    sizes = np.array([len(x) for x in xs])
+    x = np.concatenate(xs)
+    y = np.concatenate(ys)
+    segment = np.repeat(np.arange(len(sizes)), sizes)
+
+    if params is None:
+        params = model.make_params()
+    if any(par.expr is not None for par in params.values()):
+        raise NotImplementedError("constrained parameters are not supported")
+    var_names = [name for name, par in params.items() if par.vary]
+    fixed = {name: par.value for name, par in params.items()
+             if name not in var_names}
+
+    return _batch_data(keys, xs, ys, sizes, x, y, 1 / y,
+                       np.log(y) if residual == 'log' else None, segment,
+                       params, var_names, fixed)
+
+
+def _curve_index(keys, by):
+    """Index of the result tables, one entry per curve"""
+    if isinstance(by, (list, tuple)):
+        return pd.MultiIndex.from_tuples(keys, names=by)
+    return pd.Index(keys, name=by if isinstance(by, str) else None)
+
+
+def _eval_vectorized(model, values, x):
+    """ Evaluate a (possibly composite) lmfit model with array valued parameters
+
+        Args:
+
+        model: lmfit.Model or lmfit.CompositeModel
+
+        values: dict {prefixed parameter name: scalar or array like x}
+
+        x: shear rate
+
+        Returns:
+
+        model prediction with the same shape as x
+    """
+    import lmfit
+
+    if isinstance(model, lmfit.model.CompositeModel):
+        return model.op(_eval_vectorized(model.left, values, x),
+                        _eval_vectorized(model.right, values, x))
+
+    kwargs = {name[len(model.prefix):]: values[name]
+              for name in model.param_names}
+    return np.broadcast_to(model.func(x, **kwargs), x.shape)
+
+
+def _to_internal(value, lower, upper):
+    """ Minuit-style transformation of bounded values to unbounded ones
+
+        Same transformation used by lmfit (see lmfit.Parameter.setup_bounds),
+        applied column-wise to arrays of parameter values.
+    """
+    with np.errstate(invalid='ignore'):
+        return np.select(
+            [np.isinf(lower) & np.isinf(upper), np.isinf(upper), np.isinf(lower)],
+            [value,
+             np.sqrt((value - lower + 1) ** 2 - 1),
+             np.sqrt((upper - value + 1) ** 2 - 1)],
+            np.arcsin(np.clip(2 * (value - lower) / (upper - lower) - 1, -1, 1)))
+
+
+def _from_internal(internal, lower, upper):
+    """ Inverse of :meth:`_to_internal`"""
+    with np.errstate(invalid='ignore'):
+        return np.select(
+            [np.isinf(lower) & np.isinf(upper), np.isinf(upper), np.isinf(lower)],
+            [internal,
+             lower - 1 + np.sqrt(internal ** 2 + 1),
+             upper + 1 - np.sqrt(internal ** 2 + 1)],
+            lower + (np.sin(internal) + 1) * (upper - lower) / 2)
+
+
+def _scale_gradient(internal, lower, upper):
+    """ Derivative of :meth:`_from_internal` with respect to the internal value"""
+    return np.select(
+        [np.isinf(lower) & np.isinf(upper), np.isinf(upper), np.isinf(lower)],
+        [np.ones_like(internal),
+         internal / np.sqrt(internal ** 2 + 1),
+         -internal / np.sqrt(internal ** 2 + 1)],
+        np.cos(internal) * (upper - lower) / 2)
+
+
+def _fit_statistics(chisqr, ndata, nvarys):
+    """ Fit quality metrics with the same definition used by lmfit"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nfree = ndata - nvarys
+        redchi = np.where(nfree > 0, chisqr / np.maximum(nfree, 1), np.nan)
+        _neg2_log_likel = ndata * np.log(np.maximum(chisqr, 1e-250) / ndata)
+        aic = _neg2_log_likel + 2 * nvarys
+        bic = _neg2_log_likel + np.log(ndata) * nvarys
+    return redchi, aic, bic
+
+
+def _levenberg_marquardt(residual, start, lower, upper, segment, ncurves,
+                         jacobian=None, max_iter=200, tol=1e-7):
+    """ Levenberg-Marquardt iterations run in lockstep on many independent curves
+
+        Every curve keeps its own damping factor and convergence flag, the
+        residual is evaluated for all the curves still iterating with a single
+        call. Bounds are handled with the same Minuit-style transformation
+        used by lmfit.
+
+        Args:
+
+        residual: function (values, selected) -> weighted residual of the
+            points in `selected` given `values` (ncurves x nvarys array)
+
+        start, lower, upper: (ncurves x nvarys) arrays
+
+        segment: curve index of every data point
+
+        jacobian: optional function (values, selected) -> derivatives of the
+            residual with respect to the parameters (one column per
+            parameter), finite differences are used when None
+
+        Returns:
+
+        values, residual at the solution, number of function evaluations
+        per curve, convergence flag per curve
+    """
+    nvarys = start.shape[1]
+    internal = _to_internal(start, lower, upper)
+    internal[np.abs(internal) < 1e-12] = 0.0
+    damping = np.full(ncurves, 1e-3)
+    scale = np.zeros((ncurves, nvarys))
+    done = np.zeros(ncurves, dtype=bool)
+    nfev = np.zeros(ncurves, dtype=int)
+    eps = np.sqrt(np.finfo(float).eps)
+
+    everything = np.ones(len(segment), dtype=bool)
+    resid = residual(_from_internal(internal, lower, upper), everything)
+    cost = np.bincount(segment, weights=resid ** 2, minlength=ncurves)
+    nfev += 1
+
+    for _ in range(max_iter):
+        active = ~done
+        if not active.any():
+            break
+        selected = active[segment]
+        seg = segment[selected]
+        r = resid[selected]
+
+        if jacobian is not None:
+            jac = (jacobian(_from_internal(internal, lower, upper), selected)
+                   * _scale_gradient(internal, lower, upper)[seg])
+        else:
+            # forward difference jacobian in internal coordinates, one
+            # vectorized model evaluation per free parameter
+            jac = np.empty((len(seg), nvarys))
+            for j in range(nvarys):
+                step = eps * np.where(internal[:, j] == 0, 1,
+                                      np.abs(internal[:, j]))
+                shifted = internal.copy()
+                shifted[:, j] += step
+                r_step = residual(_from_internal(shifted, lower, upper),
+                                  selected)
+                jac[:, j] = (r_step - r) / step[seg]
+            nfev[active] += nvarys
+
+        jtj = np.zeros((ncurves, nvarys, nvarys))
+        for j in range(nvarys):
+            for k in range(j, nvarys):
+                jtj[:, j, k] = jtj[:, k, j] = np.bincount(
+                    seg, weights=jac[:, j] * jac[:, k], minlength=ncurves)
+        gradient = np.stack([np.bincount(seg, weights=jac[:, j] * r,
+                                         minlength=ncurves)
+                             for j in range(nvarys)], axis=1)
+
+        # as in MINPACK, the damping is scaled by the largest column norms
+        # seen so far, so parameters sitting on a bound can not run away
+        scale = np.maximum(scale, np.diagonal(jtj, axis1=1, axis2=2))
+        damped = jtj + damping[:, None, None] * \
+            np.maximum(scale, 1e-30)[:, :, None] * np.eye(nvarys)
+        damped[done] = np.eye(nvarys)
+        delta = -np.linalg.solve(damped, gradient[:, :, None])[:, :, 0]
+        delta[done] = 0
+
+        trial = internal + delta
+        trial_resid = resid.copy()
+        trial_resid[selected] = residual(
+            _from_internal(trial, lower, upper), selected)
+        trial_cost = np.bincount(segment, weights=trial_resid ** 2,
+                                 minlength=ncurves)
+        nfev[active] += 1
+
+        # reduction of the sum of squares predicted by the linearized model
+        # for the damped step and for the full Gauss-Newton step
+        predicted = -np.einsum('ij,ij->i', delta, 2 * gradient + np.einsum(
+            'ijk,ik->ij', jtj, delta))
+        optimal = np.einsum('ij,ij->i', gradient, np.einsum(
+            'ijk,ik->ij', np.linalg.pinv(jtj), gradient))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = (cost - trial_cost) / predicted
+        better = active & np.isfinite(trial_cost) & (trial_cost < cost)
+
+        done |= active & (optimal <= tol * cost)
+        internal[better] = trial[better]
+        resid[better[segment]] = trial_resid[better[segment]]
+        cost = np.where(better, trial_cost, cost)
+        damping = np.where(
+            better,
+            damping * np.maximum(1 / 3, 1 - (2 * np.clip(ratio, 0, 1) - 1) ** 3),
+            damping * 4)
+        done |= damping > 1e16
+
+    return _from_internal(internal, lower, upper), resid, nfev, done
+
+
+def fit_FC_batch(model, curves, by=None, params=None, max_iter=200, tol=1e-7,
+                 guess=True, residual='linear'):
+    """ Fit the same model to many flow curves in a single least squares problem
+
+        Each curve gets its own set of parameters, the residuals are weighted
+        with 1/Stress as in :meth:`rheofit.models.fit_FC`.
+
+        Args:
+
+        model: rheology model (e.g. HB_model)
+
+        curves: flow curves, list or dict of pandas DataFrame with column
+            'Shear rate' and 'Stress', a tidy DataFrame (see `by`) or a tuple
+            (list of shear rate arrays, list of stress arrays)
+
+        by: column(s) used to split a tidy DataFrame in curves
+            (e.g. ['filename', 'stepname'])
+
+        params: lmfit.Parameters with starting values and bounds
+            (default model.make_params()), parameters constrained by an
+            expression raise NotImplementedError
+
+        max_iter: maximum number of Levenberg-Marquardt iterations
+
+        tol: relative tolerance on the decrease of the sum of squares that a
+            full Gauss-Newton step could still achieve
+
+        guess: when params is None, every curve starts from the values
+            estimated from its data by model.guess (if the model implements
+            it) instead of the parameter hints
+
+        residual: 'linear' for (model - Stress) / Stress, 'log' for
+            log(model) - log(Stress) (see :meth:`rheofit.models.fit_FC`),
+            points with non positive stress are dropped for 'log'
+
+        Returns:
+
+        Pandas dataframe with one row per curve, estimated parameters and
+        the same quality of fit metrics as :meth:`rheofit.models.show_parameter_table`,
+        plus the number of function evaluations and the convergence flag
+    """
+    from ._rheology_model import _TINY
+
+    guess = guess and params is None
+    data = _prepare_batch(model, curves, by, params, residual)
+    x, y, weights, log_y, segment = (data.x, data.y, data.weights, data.log_y,
+                                     data.segment)
+    params, var_names, fixed = data.params, data.var_names, data.fixed
+    ncurves = len(data.sizes)
+    nvarys = len(var_names)
+
+    guesses = None
+    if guess:
+        try:
+            guesses = [model.guess(y_curve, x=x_curve)
+                       for x_curve, y_curve in zip(data.xs, data.ys)]
+        except NotImplementedError:
+            guesses = None
+
+    lower = np.tile([params[name].min for name in var_names], (ncurves, 1))
+    upper = np.tile([params[name].max for name in var_names], (ncurves, 1))
+    if guesses is not None:
+        start = np.array([[curve_params[name].value for name in var_names]
+                          for curve_params in guesses]).reshape(ncurves, nvarys)
+    else:
+        start = np.tile([params[name].value for name in var_names],
+                        (ncurves, 1))
+    start = np.clip(start, lower, upper)
+
+    def residuals(values, selected):
+        point_values = values[segment[selected]]
+        kwargs = dict(fixed)
+        kwargs.update({name: point_values[:, j]
+                       for j, name in enumerate(var_names)})
+        prediction = _eval_vectorized(model, kwargs, x[selected])
+        if residual == 'log':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return (np.log(np.maximum(prediction, _TINY))
+                        - log_y[selected])
+        return (prediction - y[selected]) * weights[selected]
+
+    jacobian = None
+    if getattr(model, 'jac', None) is not None:
+        root_names = [name[len(model.prefix):] for name in var_names]
+
+        def jacobian(values, selected):
+            point_values = values[segment[selected]]
+            kwargs = {name[len(model.prefix):]: value
+                      for name, value in fixed.items()}
+            kwargs.update({root: point_values[:, j]
+                           for j, root in enumerate(root_names)})
+            x_selected = x[selected]
+            derivatives = model.jac(x_selected, **kwargs)
+            columns = [np.broadcast_to(derivatives[root], x_selected.shape)
+                       for root in root_names]
+            if residual == 'log':
+                # d log(model) = d model / model
+                prediction = _eval_vectorized(
+                    model, {model.prefix + name: value
+                            for name, value in kwargs.items()}, x_selected)
+                scale = 1 / np.maximum(prediction, _TINY)
+            else:
+                scale = weights[selected]
+            return np.stack(columns, axis=1) * scale[:, None]
+
+    values, resid, nfev, converged = _levenberg_marquardt(
+        residuals, start, lower, upper, segment, ncurves, jacobian=jacobian,
+        max_iter=max_iter, tol=tol)
+
+    chisqr = np.bincount(segment, weights=resid ** 2, minlength=ncurves)
+    redchi, aic, bic = _fit_statistics(chisqr, data.sizes, nvarys)
+
+    table = pd.DataFrame(values, columns=var_names)
+    for name, value in fixed.items():
+        table[name] = value
+    table = table[list(params.keys())]
+    table['bic'] = bic
+    table['redchi'] = redchi
+    table['model'] = model.name
+
+    table.index = _curve_index(data.keys, by)
+
+    table['nfev'] = nfev
+    table['success'] = converged
+    return table
+
+
+def _shared_names(model, params, var_names, shared):
+    """ Names of the shared varying parameters, in the order of params
+
+        shared is a list of parameter names or a dict name -> 'shared' or
+        'per-curve', names can be given without the model prefix
+    """
+    if isinstance(shared, str):
+        shared = [shared]
+    if isinstance(shared, dict):
+        for name, flag in shared.items():
+            if flag not in ('shared', 'per-curve'):
+                raise ValueError("unknown flag {!r} for {}, use 'shared' or "
+                                 "'per-curve'".format(flag, name))
+        shared = [name for name, flag in shared.items() if flag == 'shared']
+
+    names = set()
+    for name in shared:
+        if name not in params:
+            name = getattr(model, 'prefix', '') + name
+        if name not in params:
+            raise ValueError('unknown parameter ' + repr(name))
+        if name not in var_names:
+            raise ValueError('parameter ' + name + ' is not varying')
+        names.add(name)
+    return [name for name in var_names if name in names]
+
+
+def _guess_values(model, params, xs, ys, names):
+    """ Starting values of the parameters names estimated from every curve
+
+        Same rules as :meth:`rheofit._rheology_model.rheology_model.guess`
+        (estimates that are not finite or outside the bounds keep the value
+        of params), calling the guess function of the model directly rather
+        than building lmfit.Parameters for every curve.
+
+        Returns:
+
+        array (number of curves, number of names)
+    """
+    guess_func = getattr(model, 'guess_func', None)
+    if guess_func is None:
+        return np.array([[curve_params[name].value for name in names]
+                         for curve_params in (model.guess(y, x=x)
+                                              for x, y in zip(xs, ys))]
+                        ).reshape(len(xs), len(names))
+
+    values = np.tile([params[name].value for name in names], (len(xs), 1))
+    roots = [name[len(model.prefix):] for name in names]
+    for i, (x, y) in enumerate(zip(xs, ys)):
+        try:
+            estimates = guess_func(x, y)
+        except (ValueError, np.linalg.LinAlgError):
+            continue
+        for j, (name, root) in enumerate(zip(names, roots)):
+            value = estimates.get(root)
+            if (value is not None and np.isfinite(value)
+                    and params[name].min < value < params[name].max):
+                values[i, j] = value
+    return values
+
+
+def _block_variances(dense, segment, ncurves, nshared):
+    """ Diagonal of the inverse of J^T J for the global fit Jacobian
+
+        The normal matrix has a dense block for the shared parameters, a
+        block per curve for its own parameters and the coupling between
+        them (arrowhead matrix). The diagonal of the inverse follows from
+        the Schur complement of the curve blocks, with a cost linear in the
+        number of curves.
+
+        Args:
+
+        dense: (points, nshared + nlocal) non zero entries of every row of
+            the Jacobian, shared parameters first
+
+        segment: curve index of every point
+
+        Returns:
+
+        variances of the shared parameters (nshared) and of the per curve
+        parameters (ncurves x nlocal), without the reduced chi square
+    """
+    shared, local = dense[:, :nshared], dense[:, nshared:]
+    nlocal = local.shape[1]
+    coupling = np.zeros((ncurves, nshared, nlocal))
+    np.add.at(coupling, segment, np.einsum('ij,ik->ijk', shared, local))
+    blocks = np.zeros((ncurves, nlocal, nlocal))
+    np.add.at(blocks, segment, np.einsum('ij,ik->ijk', local, local))
+
+    inverse_blocks = (np.linalg.pinv(blocks) if nlocal
+                      else np.zeros((ncurves, 0, 0)))
+    if not nshared:
+        return (np.zeros(0),
+                np.diagonal(inverse_blocks, axis1=1, axis2=2).copy())
+
+    # B D^-1 for every curve, then the Schur complement of the curve blocks
+    coupled = np.einsum('cij,cjk->cik', coupling, inverse_blocks)
+    schur = shared.T @ shared - np.einsum('cij,ckj->ik', coupled, coupling)
+    inverse_schur = np.linalg.pinv(schur)
+    local_variances = (
+        np.diagonal(inverse_blocks, axis1=1, axis2=2)
+        + np.einsum('cji,jk,cki->ci', coupled, inverse_schur, coupled))
+    return np.diagonal(inverse_schur).copy(), local_variances
+
+
+class global_fit_result(object):
+    """Result of :meth:`fit_FC_global`
+
+    Attributes:
+        table: pandas DataFrame with one row per curve, the parameter values
+            (shared values repeated), their standard errors (<name>_stderr),
+            the number of points and the chi square of the curve
+
+        shared: list of the shared parameter names
+
+        chisqr, redchi, aic, bic: statistics of the global fit (same
+            definitions as lmfit)
+
+        ndata, nvarys: number of points and of fitted parameters
+
+        nfev, success, message: from scipy.optimize.least_squares
+    """
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+    def __repr__(self):
+        return "<global fit of {} ({} curves, shared {}, redchi {:.4g})>".format(
+            self.model, len(self.table), ", ".join(self.shared) or "none",
+            self.redchi)
+
+
+def fit_FC_global(model, curves, shared, by=None, params=None, guess=True,
+                  residual='linear', max_nfev=None, tol=1e-8):
+    """ Fit several flow curves together, some parameters shared by all curves
+
+        For example one flow index n for a concentration series while the
+        yield stress changes with every curve. The residuals of a curve only
+        depend on the shared parameters and on the parameters of that curve,
+        so the Jacobian is block sparse: it is built (analytic derivatives
+        when the model has them, grouped finite differences otherwise) and
+        solved as a scipy sparse matrix with the trust region reflective
+        method, and the cost grows linearly with the number of curves.
+
+        Args:
+
+        model: rheology model (e.g. HB_model)
+
+        curves: flow curves, in any of the forms accepted by
+            :meth:`fit_FC_batch`
+
+        shared: names of the parameters shared by all the curves (with or
+            without the model prefix), or dict name -> 'shared' or
+            'per-curve'; the other varying parameters are fitted per curve
+
+        by: column(s) used to split a tidy DataFrame in curves
+
+        params: lmfit.Parameters with starting values and bounds
+            (default model.make_params()), parameters constrained by an
+            expression raise NotImplementedError
+
+        guess: when params is None, start every curve from the values
+            estimated by model.guess (the shared parameters from the median
+            of the estimates)
+
+        residual: 'linear' for (model - Stress) / Stress, 'log' for
+            log(model) - log(Stress) (see :meth:`rheofit.models.fit_FC`)
+
+        max_nfev: maximum number of function evaluations (default of
+            scipy.optimize.least_squares)
+
+        tol: ftol, xtol and gtol of scipy.optimize.least_squares
+
+        Returns:
+
+        global_fit_result
+    """
+    from scipy import sparse
+    from scipy.optimize import least_squares
+
+    from ._rheology_model import _TINY
+
+    guess = guess and params is None
+    data = _prepare_batch(model, curves, by, params, residual)
+    x, y, weights, log_y, segment = (data.x, data.y, data.weights, data.log_y,
+                                     data.segment)
+    params, var_names, fixed = data.params, data.var_names, data.fixed
+    ncurves = len(data.sizes)
+
+    guessed = None
+    if guess:
+        try:
+            guessed = _guess_values(model, params, data.xs, data.ys, var_names)
+        except NotImplementedError:
+            guessed = None
+    shared_names = _shared_names(model, params, var_names, shared)
+    local_names = [name for name in var_names if name not in shared_names]
+    nshared, nlocal = len(shared_names), len(local_names)
+
+    def start_values(names):
+        lower = np.array([params[name].min for name in names])
+        upper = np.array([params[name].max for name in names])
+        if guessed is not None:
+            values = guessed[:, [var_names.index(name) for name in names]]
+        else:
+            values = np.tile([params[name].value for name in names],
+                             (ncurves, 1))
+        return np.clip(values.reshape(ncurves, len(names)), lower, upper)
+
+    # parameter vector: shared parameters, then the parameters of each curve
+    start = np.concatenate([np.median(start_values(shared_names), axis=0),
+                            start_values(local_names).ravel()])
+    lower = np.concatenate([[params[name].min for name in shared_names],
+                            np.tile([params[name].min for name in local_names],
+                                    ncurves)])
+    upper = np.concatenate([[params[name].max for name in shared_names],
+                            np.tile([params[name].max for name in local_names],
+                                    ncurves)])
+
+    def point_values(values):
+        kwargs = dict(fixed)
+        kwargs.update(zip(shared_names, values[:nshared]))
+        local = values[nshared:].reshape(ncurves, nlocal)[segment]
+        kwargs.update({name: local[:, j] for j, name in enumerate(local_names)})
+        return kwargs
+
+    def residuals(values):
+        prediction = _eval_vectorized(model, point_values(values), x)
+        if residual == 'log':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.log(np.maximum(prediction, _TINY)) - log_y
+        return (prediction - y) * weights
+
+    # every row has the shared columns and the columns of its curve
+    width = nshared + nlocal
+    columns = np.empty((len(x), width), dtype=int)
+    columns[:, :nshared] = np.arange(nshared)
+    columns[:, nshared:] = (nshared + segment[:, None] * nlocal
+                            + np.arange(nlocal))
+    indptr = np.arange(0, columns.size + 1, width)
+    shape = (len(x), len(start))
+
+    if getattr(model, 'jac', None) is not None:
+        def jacobian(values):
+            kwargs = point_values(values)
+            derivatives = model.jac(x, **{name[len(model.prefix):]: value
+                                          for name, value in kwargs.items()})
+            if residual == 'log':
+                # d log(model) = d model / model
+                scale = 1 / np.maximum(_eval_vectorized(model, kwargs, x),
+                                       _TINY)
+            else:
+                scale = weights
+            dense = np.stack([np.broadcast_to(
+                derivatives[name[len(model.prefix):]], x.shape)
+                for name in shared_names + local_names], axis=1)
+            return sparse.csr_matrix(
+                ((dense * scale[:, None]).ravel(), columns.ravel(), indptr),
+                shape=shape)
+        jac_kwargs = {'jac': jacobian}
+    else:
+        jac_kwargs = {'jac': '2-point', 'jac_sparsity': sparse.csr_matrix(
+            (np.ones(columns.size), columns.ravel(), indptr), shape=shape)}
+
+    solution = least_squares(residuals, start, bounds=(lower, upper),
+                             method='trf', tr_solver='lsmr', x_scale='jac',
+                             ftol=tol, xtol=tol, gtol=tol, max_nfev=max_nfev,
+                             **jac_kwargs)
+
+    resid = solution.fun
+    chisqr = float(resid @ resid)
+    ndata, nvarys = len(x), len(start)
+    redchi, aic, bic = (float(value) for value in
+                        _fit_statistics(chisqr, ndata, nvarys))
+
+    dense = sparse.csr_matrix(solution.jac)[
+        np.arange(len(x))[:, None], columns].toarray()
+    shared_variances, local_variances = _block_variances(
+        dense, segment, ncurves, nshared)
+    with np.errstate(invalid='ignore'):
+        shared_stderr = np.sqrt(shared_variances * redchi)
+        local_stderr = np.sqrt(local_variances * redchi)
+
+    values = point_values(solution.x)
+    local = solution.x[nshared:].reshape(ncurves, nlocal)
+    table = pd.DataFrame(index=range(ncurves))
+    for name in params:
+        if name in local_names:
+            table[name] = local[:, local_names.index(name)]
+        else:
+            table[name] = values[name]
+    for j, name in enumerate(shared_names):
+        table[name + '_stderr'] = shared_stderr[j]
+    for j, name in enumerate(local_names):
+        table[name + '_stderr'] = local_stderr[:, j]
+    table['ndata'] = data.sizes
+    table['chisqr'] = np.bincount(segment, weights=resid ** 2,
+                                  minlength=ncurves)
+
+    table.index = _curve_index(data.keys, by)
+
+    return global_fit_result(
+        model=model.name, table=table, shared=shared_names, chisqr=chisqr,
+        redchi=redchi, aic=aic, bic=bic, ndata=ndata, nvarys=nvarys,
+        nfev=solution.nfev, success=bool(solution.success),
+        message=solution.message)
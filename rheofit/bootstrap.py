@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Module for bootstrap estimates of the parameter uncertainty
+-----------------------------------------------------------
+
+The standard errors of lmfit come from the covariance matrix of the linear
+approximation of the model at the best fit. Near the limits of a model
+(n close to 1, ystress close to 0) or for badly determined parameters the
+distribution of the parameters is far from normal and the covariance is a
+poor summary.
+
+The bootstrap refits many synthetic replicates of the flow curve and
+reports the distribution of the fitted parameters:
+
+- 'residuals': best fit plus resampled relative residuals
+- 'pairs': resampled (shear rate, stress) points
+- 'normal': best fit plus normal relative noise with the standard deviation
+  of the residuals (Monte Carlo)
+
+All replicates are generated up front from the seed, so the result does not
+depend on the number of processes. Replicates are fitted in chunks with
+:meth:`rheofit.batch.fit_FC_batch`, starting from the best fit parameters,
+and the chunks run in parallel processes.
+
+Example:
+
+        boot = rheofit.bootstrap.bootstrap_FC(rheofit.models.HB_model, data,
+                                              n_replicates=2000, seed=0)
+        boot.intervals(ci=0.95)
+        boot.correlation()
+
+"""
+import numpy as np
+import pandas as pd
+
+
+def _fit_chunk(model, params, xs, ys):
+    """Worker of bootstrap_FC, fits a chunk of replicates"""
+    from .batch import fit_FC_batch
+    return fit_FC_batch(model, (xs, ys), params=params)
+
+
+class bootstrap_result(object):
+    """Parameter distribution of a bootstrapped flow curve fit
+
+    Args:
+        result: lmfit.fitresult of the original data
+
+        samples: pandas DataFrame with one row per replicate, the fitted
+            parameters, redchi, nfev and the convergence flag success
+
+        method: resampling method
+
+        seed: seed of the random generator
+    """
+
+    def __init__(self, result, samples, method, seed):
+        self.result = result
+        self.samples = samples
+        self.method = method
+        self.seed = seed
+        self.var_names = list(result.var_names)
+
+    def __repr__(self):
+        return "<bootstrap of {} ({}, {} replicates, {} converged)>".format(
+            self.result.model.name, self.method, len(self.samples),
+            int(self.samples["success"].sum()))
+
+    @property
+    def converged(self):
+        """Parameters of the replicates whose fit converged"""
+        return self.samples.loc[self.samples["success"], self.var_names]
+
+    def intervals(self, ci=0.95):
+        """ Percentile intervals of the varying parameters
+
+            Args:
+
+            ci: probability covered by the interval
+
+            Returns:
+
+            Pandas dataframe with one row per parameter: best fit value, lmfit
+            standard error, mean, median and standard deviation of the
+            replicates, lower and upper bound of the interval
+        """
+        samples = self.converged
+        return pd.DataFrame({
+            "best": [self.result.params[name].value for name in self.var_names],
+            "stderr": [self.result.params[name].stderr for name in self.var_names],
+            "mean": samples.mean(),
+            "median": samples.median(),
+            "std": samples.std(),
+            "lower": samples.quantile((1 - ci) / 2),
+            "upper": samples.quantile((1 + ci) / 2)},
+            index=self.var_names)
+
+    def correlation(self):
+        """Correlation matrix of the varying parameters over the replicates"""
+        return self.converged.corr()
+
+
+def _replicates(x, stress, best_fit, method, n_replicates, nvarys, rng):
+    """Shear rate and stress arrays of the replicates, (n_replicates, npoints)"""
+    npoints = len(x)
+    if method == "pairs":
+        index = rng.integers(0, npoints, size=(n_replicates, npoints))
+        return x[index], stress[index]
+
+    relative = (stress - best_fit) / best_fit
+    if method == "residuals":
+        # centered residuals, inflated for the degrees of freedom of the fit
+        relative = ((relative - relative.mean())
+                    * np.sqrt(npoints / max(npoints - nvarys, 1)))
+        noise = relative[rng.integers(0, npoints, size=(n_replicates, npoints))]
+    elif method == "normal":
+        noise = rng.normal(0, np.sqrt(np.sum(relative ** 2)
+                                      / max(npoints - nvarys, 1)),
+                           size=(n_replicates, npoints))
+    else:
+        raise ValueError("unknown bootstrap method {!r}, use 'residuals', "
+                         "'pairs' or 'normal'".format(method))
+    return np.broadcast_to(x, noise.shape), best_fit * (1 + noise)
+
+
+def bootstrap_FC(model, data, n_replicates=1000, method="residuals", seed=None,
+                 params=None, n_workers=None, chunk_size=250):
+    """ Bootstrap distribution of the parameters of a flow curve fit
+
+        Args:
+
+        model: rheology model (e.g. HB_model)
+
+        data: pandas DataFrame with column 'Shear rate' and 'Stress'
+
+        n_replicates: number of synthetic data sets
+
+        method: 'residuals', 'pairs' or 'normal' (see module description)
+
+        seed: seed of the random generator (int), None for a random seed
+
+        params: lmfit.Parameters with the starting values of the fit of the
+        original data (default the estimates of model.guess), fixed
+        parameters and bounds also apply to the replicates
+
+        n_workers: number of processes, default is the number of cpu, 1
+        fits everything in the current process
+
+        chunk_size: number of replicates fitted together by each process job
+
+        Returns:
+
+        bootstrap_result with the fit of the original data (result), the
+        parameters of each replicate (samples), intervals() and
+        correlation()
+    """
+    import concurrent.futures
+    from .models import fit_FC, warm_start_params
+
+    x = np.asarray(data["Shear rate"], dtype="float")
+    stress = np.asarray(data["Stress"], dtype="float")
+    mask = np.isfinite(x) & np.isfinite(stress) & (stress != 0)
+    x, stress = x[mask], stress[mask]
+
+    result = fit_FC(model, {"Shear rate": x, "Stress": stress}, params=params)
+    best_fit = np.asarray(result.best_fit, dtype="float")
+    # keep fixed parameters, bounds and expressions of the caller
+    start = warm_start_params(model, result, params=params)
+
+    rng = np.random.default_rng(seed)
+    xs, ys = _replicates(x, stress, best_fit, method, n_replicates,
+                         result.nvarys, rng)
+
+    jobs = [(model, start, list(xs[first:first + chunk_size]),
+             list(ys[first:first + chunk_size]))
+            for first in range(0, n_replicates, chunk_size)]
+    if n_workers == 1 or len(jobs) == 1:
+        tables = [_fit_chunk(*job) for job in jobs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(n_workers) as executor:
+            tables = list(executor.map(_fit_chunk, *zip(*jobs)))
+
+    samples = pd.concat(tables, ignore_index=True)
+    samples = samples[list(start.keys()) + ["redchi", "nfev", "success"]]
+    samples.index.name = "replicate"
+    return bootstrap_result(result, samples, method, seed)
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+Module for caching parsed data on disk
+--------------------------------------
+
+Parsing a multitab Excel export is by far the slowest part of loading
+rheology data. :class:`rheofit.cache.data_cache` stores the parsed step
+tables and Details metadata of a file, keyed by the hash of the file
+content and the loader source, so reopening the same experiment skips the
+Excel parsing entirely.
+
+:class:`rheofit.cache.fit_cache` does the same for flow curve fits: the
+result of a fit is stored under the hash of the data arrays, the model, its
+parameter hints, the starting parameters and the solver settings, so
+fitting the same curves again (a notebook run twice, a file added to a
+data_package, a step added to a rheology_data) only fits the new curves.
+
+Example:
+
+        cache = rheofit.cache.data_cache(max_size=200 * 2**20)
+        data = rheofit.rheodata.rheology_data('experiment.xls', cache=cache)
+
+        fits = rheofit.cache.fit_cache(disk=True)
+        result = rheofit.models.fit_FC(rheofit.models.HB_model, table,
+                                       cache=fits)
+
+"""
+import collections
+import hashlib
+import os
+import pickle
+import tempfile
+
+import numpy as np
+
+# bump when the content of the cached objects changes
+_CACHE_VERSION = '2'
+
+
+def default_cache_dir():
+    """ Directory used when no cache directory is given
+
+        RHEOFIT_CACHE_DIR environment variable if set, ~/.cache/rheofit otherwise
+    """
+    return os.environ.get(
+        'RHEOFIT_CACHE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cache', 'rheofit'))
+
+
+def content_hash(file_or_buffer, chunk_size=2**20):
+    """ sha256 hex digest of the content of a file path or file-like object
+
+        File-like objects are rewound to their initial position.
+    """
+    digest = hashlib.sha256()
+    if hasattr(file_or_buffer, 'read'):
+        position = file_or_buffer.tell()
+        for chunk in iter(lambda: file_or_buffer.read(chunk_size), b''):
+            digest.update(chunk)
+        file_or_buffer.seek(position)
+    else:
+        with open(file_or_buffer, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class data_cache(object):
+    '''On-disk cache of parsed data files with size cap and LRU eviction
+
+    Every entry is a pickle file named after the key. Reading an entry
+    updates its modification time, the least recently used entries are
+    removed when the total size exceeds max_size.
+
+    Attributes:
+        directory (str): folder containing the cache entries
+        max_size (int): maximum total size of the entries in bytes
+    '''
+
+    def __init__(self, directory=None, max_size=512 * 2**20):
+        '''
+        Args:
+            directory (str): cache folder, default :meth:`default_cache_dir`
+            max_size (int): maximum total size in bytes (default 512 MB)
+        '''
+        self.directory = str(directory or default_cache_dir())
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, file_or_buffer, source):
+        '''Cache key of a data file for a given loader source'''
+        return hashlib.sha256(
+            (content_hash(file_or_buffer) + source + _CACHE_VERSION).encode()
+        ).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        '''Return the cached object or None if the key is not in the cache'''
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                value = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        '''Store an object in the cache and evict old entries if needed'''
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.evict()
+
+    def entries(self):
+        '''List of (path, size, last access time) of the cache entries'''
+        entries = []
+        for item in os.listdir(self.directory):
+            if item.endswith('.pkl'):
+                path = os.path.join(self.directory, item)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    @property
+    def size(self):
+        '''Total size of the cache entries in bytes'''
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        '''Remove least recently used entries until size <= max_size'''
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def invalidate(self, file_or_buffer, source='trios_multitab_xls'):
+        '''Remove the entry of a data file, return True if it was cached'''
+        path = self._path(self.key(file_or_buffer, source))
+        if os.path.exists(path):
+            os.remove(path)
+            return True
+        return False
+
+    def clear(self):
+        '''Remove all the entries'''
+        for path, _, _ in self.entries():
+            os.remove(path)
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def __repr__(self):
+        return 'data_cache(' + self.directory + ')'
+
+
+def fit_key(model, x, stress, params=None, **settings):
+    """ Cache key of a flow curve fit
+
+        Args:
+
+        model: rheology model, identified by its name (function and
+        prefix), the function module and its parameter hints
+
+        x, stress: shear rate and stress arrays
+
+        params: lmfit.Parameters with the starting values or None
+
+        settings: solver settings (e.g. method, residual)
+
+        Returns:
+
+        sha256 hex digest
+    """
+    func = model.func
+    digest = hashlib.sha256()
+    digest.update(repr((
+        _CACHE_VERSION, model.name, getattr(func, '__module__', ''),
+        getattr(func, 'backend', ''),
+        sorted((name, sorted(hints.items()))
+               for name, hints in model.param_hints.items()),
+        None if params is None else [
+            (name, par.value, par.min, par.max, par.vary, par.expr)
+            for name, par in params.items()],
+        sorted(settings.items()))).encode())
+    for values in (x, stress):
+        values = np.ascontiguousarray(values, dtype='float')
+        digest.update(repr(values.shape).encode())
+        digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+class fit_cache(object):
+    '''Cache of fit results, in memory (LRU) and optionally on disk
+
+    Cached results are returned as they are: the same object for every hit
+    in memory, do not modify them.
+
+    Attributes:
+        max_entries (int): maximum number of results kept in memory
+        disk: data_cache storing the results on disk or None
+        hits (int), misses (int): lookup counters
+    '''
+
+    def __init__(self, max_entries=256, disk=None):
+        '''
+        Args:
+            max_entries (int): maximum number of results kept in memory
+            disk: None (default, memory only), True for a data_cache in the
+                'fits' subfolder of :meth:`default_cache_dir` or a
+                data_cache instance
+        '''
+        if disk is True:
+            disk = data_cache(os.path.join(default_cache_dir(), 'fits'))
+        elif disk is False:
+            disk = None
+        self.max_entries = max_entries
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def get(self, key):
+        '''Return the cached fit result or None'''
+        result = self._entries.get(key)
+        if result is None and self.disk is not None:
+            result = self.disk.get(key)
+            if result is not None:
+                self._remember(key, result)
+        if result is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        '''Store a fit result'''
+        self._remember(key, result)
+        if self.disk is not None:
+            self.disk.put(key, result)
+
+    def _remember(self, key, result):
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        '''Remove the results from memory and disk'''
+        self._entries.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def __getstate__(self):
+        # worker processes only share the disk entries
+        state = dict(self.__dict__)
+        state['_entries'] = collections.OrderedDict()
+        return state
+
+    def __contains__(self, key):
+        return key in self._entries or (self.disk is not None
+                                        and key in self.disk)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return 'fit_cache({} in memory, disk={})'.format(len(self), self.disk)
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""
+Module for a persistent metadata catalog of data files
+------------------------------------------------------
+
+Questions like "all the runs on geometry X after date Y" otherwise require
+opening every workbook. :class:`rheofit.catalog.data_catalog` indexes in a
+SQLite file the Details sheet (run date, instrument, geometry, sample notes
+and every other key) and the step names and sizes of each file. The index
+is updated incrementally: files whose size and modification time did not
+change are skipped, files that were only touched are recognized by their
+content hash and are not parsed again.
+
+Example:
+
+        catalog = rheofit.catalog.data_catalog()
+        catalog.update('experiments/', recursive=True)
+        catalog.select(geometry_name='cone', after='2020-01-01')
+
+        package = rheofit.rheodata.data_package('experiments/')
+        package.select(geometry_name='cone', step='Flow')
+
+"""
+import contextlib
+import datetime
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from .cache import content_hash, default_cache_dir
+
+# bump when the content of the index changes, files are then indexed again
+_CATALOG_VERSION = 2
+
+# Details fields stored as columns of the files table: {column: Details keys}
+_FIELDS = {
+    'run_date': ('Run date', 'rundate'),
+    'instrument_serial': ('Instrument serial number',),
+    'instrument_name': ('Instrument name',),
+    'instrument_type': ('Instrument type',),
+    'geometry_name': ('Geometry name',),
+    'sample_name': ('Sample name',),
+    'procedure_name': ('Procedure name',),
+}
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, filename TEXT, directory TEXT, size INTEGER,
+    mtime REAL, hash TEXT, version INTEGER, indexed_at REAL,
+    run_date TEXT, instrument_serial TEXT, instrument_name TEXT,
+    instrument_type TEXT, geometry_name TEXT, sample_name TEXT,
+    procedure_name TEXT, sample_notes TEXT, error TEXT);
+CREATE TABLE IF NOT EXISTS steps (
+    path TEXT, position INTEGER, name TEXT, rows INTEGER, columns TEXT,
+    PRIMARY KEY (path, position));
+CREATE TABLE IF NOT EXISTS details (path TEXT, key TEXT, value TEXT);
+CREATE INDEX IF NOT EXISTS files_geometry ON files (geometry_name);
+CREATE INDEX IF NOT EXISTS files_run_date ON files (run_date);
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+CREATE INDEX IF NOT EXISTS steps_name ON steps (name);
+CREATE INDEX IF NOT EXISTS details_path ON details (path);
+'''
+
+
+def default_catalog_path():
+    """Catalog file used when none is given, in :meth:`rheofit.cache.default_cache_dir`"""
+    return os.path.join(default_cache_dir(), 'catalog.sqlite')
+
+
+def find_files(paths, recursive=True, extensions=('.xls', '.xlsx')):
+    """ Absolute paths of the data files in directories
+
+        Args:
+
+        paths: directory, file path or list of them
+
+        recursive: search the subdirectories
+
+        extensions: file name endings of the data files
+
+        Returns:
+
+        sorted list of absolute paths
+    """
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    found = set()
+    for path in paths:
+        path = os.path.abspath(os.fspath(path))
+        if not os.path.isdir(path):
+            found.add(path)
+            continue
+        for directory, subdirectories, filenames in os.walk(path):
+            if not recursive:
+                subdirectories[:] = []
+            found.update(os.path.join(directory, filename)
+                         for filename in filenames
+                         if filename.lower().endswith(extensions)
+                         and not filename.startswith('~$'))
+    return sorted(found)
+
+
+def _text(value):
+    """Value of the Details sheet as text (dates in ISO format), None for NaN"""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, (datetime.datetime, datetime.date, pd.Timestamp)):
+        return pd.Timestamp(value).isoformat()
+    return str(value)
+
+
+def _sample_notes(details):
+    """Sample notes of a Details table, as read by rheology_data"""
+    try:
+        notes = [details.loc['Sample notes'].value]
+        start = details.index.get_loc('Sample notes') + 1
+        stop = details.index.get_loc('Geometry name')
+        notes.extend(details.index[start:stop])
+        return '\n'.join(str(note) for note in notes if str(note) != 'nan')
+    except (KeyError, TypeError):
+        return None
+
+
+def _sheet_shapes(excel_file, names):
+    """(number of data rows, column names) of trios multitab sheets
+
+    Read from the workbook opened by pandas (xlrd or openpyxl), without
+    parsing the sheets into DataFrames. Trios sheets have the step name,
+    the column names and the units before the data.
+    """
+    book = excel_file.book
+    shapes = []
+    for name in names:
+        if hasattr(book, 'sheet_by_name'):
+            sheet = book.sheet_by_name(name)
+            nrows = sheet.nrows
+            header = sheet.row_values(1) if nrows > 1 else []
+        else:
+            sheet = book[name]
+            nrows = sheet.max_row
+            header = ([cell.value for cell in next(
+                sheet.iter_rows(min_row=2, max_row=2))] if nrows > 1 else [])
+        columns = [str(column) for column in header if column not in ('', None)]
+        shapes.append((max(nrows - 3, 0), columns))
+    return shapes
+
+
+def read_metadata(path):
+    """ Metadata of a trios multitab file without parsing the step tables
+
+        Returns:
+
+        (dictionary of the files table columns, list of (position, step
+        name, rows, columns) of the steps, list of (key, value) of the
+        Details sheet)
+    """
+    excel_file = pd.ExcelFile(path)
+    names = [name for name in excel_file.sheet_names if name != 'Details']
+    fields = {}
+    details = []
+    if 'Details' in excel_file.sheet_names:
+        table = pd.read_excel(excel_file, sheet_name='Details', header=None,
+                              names=['key', 'value']).set_index('key')
+        details = [(_text(key), _text(value))
+                   for key, value in zip(table.index, table['value'])
+                   if _text(key) is not None]
+        keys = dict(reversed(details))
+        for column, candidates in _FIELDS.items():
+            fields[column] = next((keys[key] for key in candidates
+                                   if keys.get(key) is not None), None)
+        fields['sample_notes'] = _sample_notes(table)
+    # empty sheets (e.g. Sheet1) are not steps, as in rheology_data
+    shapes = [(name, rows, columns) for name, (rows, columns)
+              in zip(names, _sheet_shapes(excel_file, names)) if columns]
+    steps = [(position, name, rows, ','.join(columns))
+             for position, (name, rows, columns) in enumerate(shapes)]
+    return fields, steps, details
+
+
+class data_catalog(object):
+    '''Persistent SQLite index of the metadata of rheology data files
+
+    Attributes:
+        path (str): SQLite file of the catalog
+    '''
+
+    def __init__(self, path=None):
+        '''
+        Args:
+            path (str): SQLite file, default :meth:`default_catalog_path`,
+                ':memory:' is not supported (every call opens the file)
+        '''
+        self.path = str(path or default_catalog_path())
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def update(self, paths, recursive=True, extensions=('.xls', '.xlsx'),
+               prune=True):
+        '''Index new and modified files
+
+        Args:
+            paths: directory, file path or list of them
+            recursive (bool): search the subdirectories
+            extensions: file name endings of the data files
+            prune (bool): remove the entries of files that no longer exist
+                in the indexed directories
+
+        Returns:
+            number of files parsed
+        '''
+        files = find_files(paths, recursive=recursive, extensions=extensions)
+        with self._connect() as connection:
+            known = {row[0]: row[1:] for row in connection.execute(
+                'SELECT path, size, mtime, hash, version FROM files')}
+
+        parsed = 0
+        for path in files:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entry = known.get(path)
+            if (entry is not None and entry[0] == stat.st_size
+                    and entry[1] == stat.st_mtime
+                    and entry[3] == _CATALOG_VERSION):
+                continue
+            digest = content_hash(path)
+            if (entry is not None and entry[2] == digest
+                    and entry[3] == _CATALOG_VERSION):
+                # touched but not modified
+                with self._connect() as connection:
+                    connection.execute(
+                        'UPDATE files SET size = ?, mtime = ? WHERE path = ?',
+                        (stat.st_size, stat.st_mtime, path))
+                continue
+            self._index(path, stat, digest)
+            parsed += 1
+
+        if prune:
+            self.prune(paths, recursive=recursive)
+        return parsed
+
+    def _index(self, path, stat, digest):
+        '''Parse the metadata of a file and replace its entries'''
+        try:
+            fields, steps, details = read_metadata(path)
+            fields['error'] = None
+        except Exception as error:
+            print('file ' + path + ' not indexed: ' + repr(error))
+            fields, steps, details = {'error': repr(error)}, [], []
+        fields.update(path=path, filename=os.path.basename(path),
+                      directory=os.path.dirname(path), size=stat.st_size,
+                      mtime=stat.st_mtime, hash=digest,
+                      version=_CATALOG_VERSION, indexed_at=time.time())
+        columns = list(fields)
+        with self._connect() as connection:
+            for table in ('files', 'steps', 'details'):
+                connection.execute(
+                    'DELETE FROM ' + table + ' WHERE path = ?', (path,))
+            connection.execute(
+                'INSERT INTO files (' + ', '.join(columns) + ') VALUES ('
+                + ', '.join('?' * len(columns)) + ')',
+                [fields[column] for column in columns])
+            connection.executemany(
+                'INSERT INTO steps VALUES (?, ?, ?, ?, ?)',
+                [(path,) + step for step in steps])
+            connection.executemany(
+                'INSERT INTO details VALUES (?, ?, ?)',
+                [(path,) + item for item in details])
+
+    def prune(self, paths=None, recursive=True):
+        '''Remove the entries of missing files (below paths if given)
+
+        Returns:
+            number of entries removed
+        '''
+        with self._connect() as connection:
+            indexed = [row[0] for row in
+                       connection.execute('SELECT path FROM files')]
+        if paths is not None:
+            if isinstance(paths, (str, os.PathLike)):
+                paths = [paths]
+            roots = [os.path.abspath(os.fspath(path)) for path in paths]
+            indexed = [path for path in indexed
+                       if any(path == root
+                              or (path.startswith(root.rstrip(os.sep) + os.sep)
+                                  and (recursive or os.path.dirname(path) == root))
+                              for root in roots)]
+        missing = [path for path in indexed if not os.path.exists(path)]
+        with self._connect() as connection:
+            for table in ('files', 'steps', 'details'):
+                connection.executemany(
+                    'DELETE FROM ' + table + ' WHERE path = ?',
+                    [(path,) for path in missing])
+        return len(missing)
+
+    def query(self, sql, parameters=()):
+        '''Run an SQL query on the catalog, return a pandas DataFrame'''
+        with self._connect() as connection:
+            return pd.read_sql_query(sql, connection, params=parameters)
+
+    def select(self, paths=None, after=None, before=None, step=None,
+               sample_notes=None, details=None, **fields):
+        '''Files matching all the given conditions
+
+        Args:
+            paths: list of file paths (or directory) the selection is
+                restricted to
+            after, before: run date bounds (date string or datetime)
+            step (str): substring of a step name (case insensitive)
+            sample_notes (str): substring of the sample notes
+            details (dict): {Details key: value} exact matches on any field
+                of the Details sheet
+            **fields: exact value of the files columns (e.g.
+                geometry_name, instrument_serial, instrument_type)
+
+        Returns:
+            pandas DataFrame of the files table, one row per file
+        '''
+        conditions = []
+        parameters = []
+        for column, value in fields.items():
+            if column not in _FIELDS and column not in ('filename', 'directory'):
+                raise ValueError('unknown field ' + repr(column))
+            conditions.append(column + ' = ?')
+            parameters.append(_text(value))
+        if after is not None:
+            conditions.append('run_date >= ?')
+            parameters.append(pd.Timestamp(after).isoformat())
+        if before is not None:
+            conditions.append('run_date <= ?')
+            parameters.append(pd.Timestamp(before).isoformat())
+        if sample_notes is not None:
+            conditions.append('sample_notes LIKE ?')
+            parameters.append('%' + sample_notes + '%')
+        if step is not None:
+            conditions.append('path IN (SELECT path FROM steps '
+                              'WHERE name LIKE ?)')
+            parameters.append('%' + step + '%')
+        for key, value in (details or {}).items():
+            conditions.append('path IN (SELECT path FROM details '
+                              'WHERE key = ? AND value = ?)')
+            parameters.extend([key, _text(value)])
+
+        table = self.query(
+            'SELECT * FROM files'
+            + (' WHERE ' + ' AND '.join(conditions) if conditions else '')
+            + ' ORDER BY path', parameters)
+        if paths is not None:
+            selected = set(find_files(paths, recursive=True))
+            table = table[table['path'].isin(selected)]
+        return table.reset_index(drop=True)
+
+    def steps(self, paths=None):
+        '''Steps table (path, position, name, rows, columns)'''
+        table = self.query('SELECT * FROM steps ORDER BY path, position')
+        if paths is not None:
+            table = table[table['path'].isin(set(find_files(paths)))]
+        return table.reset_index(drop=True)
+
+    def details(self, path):
+        '''Details sheet of a file as a pandas Series key -> value'''
+        table = self.query('SELECT key, value FROM details WHERE path = ?',
+                           (os.path.abspath(path),))
+        return table.set_index('key')['value']
+
+    def __len__(self):
+        with self._connect() as connection:
+            return connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def __repr__(self):
+        return 'data_catalog(' + self.path + ')'
@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+"""
+Module of fused evaluation kernels
+----------------------------------
+
+The model functions of :mod:`rheofit.models` are written as plain numpy
+expressions: every operation of e.g.
+``ystress + ystress * (x / gammadot_crit) ** n + eta_bg * x`` allocates a
+temporary array, and lmfit calls the model (and its jacobian) hundreds of
+times per fit.
+
+This module provides fused versions of the model functions and of their
+partial derivatives, computed in a single pass over the shear rates:
+
+- 'numba': loops compiled with numba (optional dependency), no temporary
+  arrays, the jacobian is filled in one pass
+- 'numpy': in-place numpy operations on the output array, used when numba
+  is not installed. TC and TCn, with two terms depending on the shear
+  rate, still allocate one temporary array for the viscous term. The
+  jacobian is the one of :mod:`rheofit.models`: written in place with
+  shared subexpressions it was not faster (more ufunc calls on curves of a
+  few tens of points), so only the numba backend fuses the jacobian
+
+Every model of :mod:`rheofit.models` has both backends. Parameters given
+as arrays (e.g. by :mod:`rheofit.batch`) are always evaluated with the
+numpy backend, and a kernel registered without numba loops runs with the
+numpy backend (with a warning when 'numba' was requested explicitly).
+
+The results agree with the reference functions within rounding (the
+kernels use pow where numpy may use sqrt or square).
+
+The fused model is selected per model, the reference models are unchanged:
+
+Example:
+
+        model = rheofit.models.get_model('TCn_model', backend='auto')
+        rheofit.models.fit_FC(model, data)
+
+        rheofit.kernels.available_kernels()
+        rheofit.kernels.available_backends()
+"""
+import importlib.util
+import inspect
+import warnings
+
+import numpy as np
+
+# registered kernels: {model function name: (numpy function, numba loop of
+# the model, numba loop of the jacobian)}
+_KERNELS = {}
+
+# compiled numba loops: {python function: numba dispatcher}
+_COMPILED = {}
+
+# parameter values passed to the numba loops (np.ndim is slow on scalars)
+_SCALARS = (float, int, np.generic)
+
+
+def numba_available():
+    """True if numba can be imported (it is only imported when first used)"""
+    return importlib.util.find_spec("numba") is not None
+
+
+def available_backends():
+    """Backends usable in this environment"""
+    return (["numba"] if numba_available() else []) + ["numpy"]
+
+
+def register_kernel(name, numpy_func, kernel=None, jac_kernel=None):
+    """Register the fused evaluation of a registered model
+
+    Args:
+        name: model function name (e.g. 'HB') or model name ('HB_model')
+
+        numpy_func: function with the signature of the model function,
+            evaluating it with in-place numpy operations (see :meth:`HB_numpy`)
+
+        kernel: loop (x, parameters..., out) writing the model in out,
+            compiled with numba (see :meth:`HB_kernel`)
+
+        jac_kernel: loop (x, parameters..., out) writing the partial
+            derivative of each parameter in a row of out, in the order of
+            the function arguments (see :meth:`HB_jac_kernel`)
+    """
+    if name.endswith("_model"):
+        name = name[:-len("_model")]
+    _KERNELS[name] = (numpy_func, kernel, jac_kernel)
+
+
+def available_kernels():
+    """Names of the models with fused kernels"""
+    return [name + "_model" for name in _KERNELS]
+
+
+def _compiled(loop):
+    """numba compiled version of a loop, compiled on first use"""
+    if loop not in _COMPILED:
+        import numba
+        _COMPILED[loop] = numba.njit(cache=True)(loop)
+    return _COMPILED[loop]
+
+
+class fused_function:
+    """Fused model function (or jacobian) with the signature of the
+    registered model function, usable as the func of an lmfit.Model
+
+    Parameters given as arrays (e.g. by :mod:`rheofit.batch`) are evaluated
+    with the numpy kernel, or by the reference jacobian for jacobian=True.
+
+    Args:
+        name: model function name (e.g. 'HB')
+
+        backend: 'numba', 'numpy' or 'auto' (numba when installed)
+
+        jacobian: evaluate the partial derivatives instead of the model
+    """
+
+    def __init__(self, name, backend="auto", jacobian=False):
+        from . import models
+
+        if name not in _KERNELS:
+            raise KeyError("no fused kernel for model {!r}, available: {}".format(
+                name, ", ".join(_KERNELS)))
+        if backend == "auto":
+            backend = "numba" if numba_available() else "numpy"
+        if backend not in ("numba", "numpy"):
+            raise ValueError("unknown backend {!r}".format(backend))
+        if backend == "numba" and not numba_available():
+            raise ImportError("the numba backend requires numba, use "
+                              "backend='auto' to fall back to numpy")
+
+        spec = models._MODELS[name + "_model"]
+        reference = spec["jac"] if jacobian else spec["func"]
+        if reference is None:
+            raise ValueError("model {!r} has no jacobian".format(name))
+        numpy_func, kernel, jac_kernel = _KERNELS[name]
+
+        self.name = name
+        self.backend = backend
+        self.jacobian = jacobian
+        self.reference = reference
+        self.__name__ = reference.__name__
+        self.__doc__ = reference.__doc__
+        self.__signature__ = inspect.signature(reference)
+        parameters = list(self.__signature__.parameters.values())[1:]
+        self._names = [par.name for par in parameters]
+        self._defaults = [par.default for par in parameters]
+        self._fallback = reference if jacobian else numpy_func
+        self._loop = jac_kernel if jacobian else kernel
+        if backend == "numba" and self._loop is None:
+            warnings.warn("no numba loop for the {} of {}, the numpy backend "
+                          "is used".format("jacobian" if jacobian else "model",
+                                           name), RuntimeWarning)
+            self.backend = "numpy"
+
+    def __reduce__(self):
+        # rebuilt by name in other processes (the kernels are compiled there)
+        return (fused_function, (self.name, self.backend, self.jacobian))
+
+    def __repr__(self):
+        return "<fused {} of {} ({})>".format(
+            "jacobian" if self.jacobian else "function", self.name, self.backend)
+
+    def __call__(self, x, *args, **kwargs):
+        if args or len(kwargs) != len(self._names):
+            values = list(args) + [kwargs.get(name, default) for name, default
+                                   in zip(self._names[len(args):],
+                                          self._defaults[len(args):])]
+        else:
+            values = [kwargs[name] for name in self._names]
+        x = np.asarray(x, dtype="float")
+        if self.backend != "numba":
+            return self._fallback(x, *values)
+        for value in values:
+            if not isinstance(value, _SCALARS):
+                return self._fallback(x, *values)
+
+        loop = _compiled(self._loop)
+        flat = np.ascontiguousarray(x).reshape(-1)
+        if self.jacobian:
+            out = np.empty((len(values), flat.size))
+            loop(flat, *values, out)
+            return {name: row.reshape(x.shape)
+                    for name, row in zip(self._names, out)}
+        out = np.empty(flat.size)
+        loop(flat, *values, out)
+        return out.reshape(x.shape)
+
+
+def fused_model(name, backend="auto"):
+    """ lmfit model of a registered model evaluated by the fused kernels
+
+        Prefix, parameter hints, guess and basis are those of the registered
+        model (see :meth:`rheofit.models.register_model`).
+
+        Args:
+
+        name: model name ('HB_model') or model function name ('HB')
+
+        backend: 'numba', 'numpy' or 'auto' (numba when installed)
+
+        Returns:
+
+        rheology_model (lmfit.Model subclass)
+    """
+    from . import models
+    from ._rheology_model import rheology_model
+
+    if name.endswith("_model"):
+        name = name[:-len("_model")]
+    if name + "_model" not in models._MODELS:
+        raise KeyError("unknown model {!r}".format(name))
+    spec = models._MODELS[name + "_model"]
+    func = fused_function(name, backend)
+    jac = (fused_function(name, func.backend, jacobian=True)
+           if spec["jac"] is not None else None)
+    model = rheology_model(func, jac=jac, guess=spec["guess"],
+                           basis=spec["basis"], prefix=spec["prefix"],
+                           expression=spec["expression"])
+    for param_name, hint in spec["param_hints"].items():
+        model.set_param_hint(param_name, **hint)
+    return model
+
+
+def _output(x, *values):
+    """Empty array with the broadcast shape of the arguments"""
+    if all(isinstance(value, _SCALARS) for value in values):
+        return np.empty(np.shape(x))
+    return np.empty(np.broadcast(x, *values).shape)
+
+
+def constantstress_numpy(x, ystress=0.1):
+    """:meth:`rheofit.models.constantstress` as an array of the shape of x"""
+    out = _output(x, ystress)
+    out[...] = ystress
+    return out
+
+
+def constantstress_kernel(x, ystress, out):
+    for i in range(x.shape[0]):
+        out[i] = ystress
+
+
+def constantstress_jac_kernel(x, ystress, out):
+    for i in range(x.shape[0]):
+        out[0, i] = 1.0
+
+
+register_kernel("constantstress", constantstress_numpy, constantstress_kernel,
+                constantstress_jac_kernel)
+
+
+def Newtonian_numpy(x, eta_bg=0.1):
+    """:meth:`rheofit.models.Newtonian` with in-place operations"""
+    return np.multiply(x, eta_bg, out=_output(x, eta_bg))
+
+
+def Newtonian_kernel(x, eta_bg, out):
+    for i in range(x.shape[0]):
+        out[i] = eta_bg * x[i]
+
+
+def Newtonian_jac_kernel(x, eta_bg, out):
+    for i in range(x.shape[0]):
+        out[0, i] = x[i]
+
+
+register_kernel("Newtonian", Newtonian_numpy, Newtonian_kernel,
+                Newtonian_jac_kernel)
+
+
+def Powerlaw_numpy(x, n=0.5, K=0.1):
+    """:meth:`rheofit.models.Powerlaw` with in-place operations"""
+    out = np.power(x, n, out=_output(x, n, K))
+    out *= K
+    return out
+
+
+def Powerlaw_kernel(x, n, K, out):
+    for i in range(x.shape[0]):
+        out[i] = K * x[i] ** n
+
+
+def Powerlaw_jac_kernel(x, n, K, out):
+    for i in range(x.shape[0]):
+        xn = x[i] ** n
+        out[0, i] = K * xn * np.log(x[i])
+        out[1, i] = xn
+
+
+register_kernel("Powerlaw", Powerlaw_numpy, Powerlaw_kernel, Powerlaw_jac_kernel)
+
+
+def Bingham_numpy(x, ystress=1.0, eta_bg=0.1):
+    """:meth:`rheofit.models.Bingham` with in-place operations"""
+    out = np.multiply(x, eta_bg, out=_output(x, ystress, eta_bg))
+    out += ystress
+    return out
+
+
+def Bingham_kernel(x, ystress, eta_bg, out):
+    for i in range(x.shape[0]):
+        out[i] = ystress + eta_bg * x[i]
+
+
+def Bingham_jac_kernel(x, ystress, eta_bg, out):
+    for i in range(x.shape[0]):
+        out[0, i] = 1.0
+        out[1, i] = x[i]
+
+
+register_kernel("Bingham", Bingham_numpy, Bingham_kernel, Bingham_jac_kernel)
+
+
+def TC_numpy(x, ystress=1.0, eta_bg=0.1, gammadot_crit=0.1):
+    """:meth:`rheofit.models.TC` with in-place operations"""
+    out = np.divide(x, gammadot_crit, out=_output(x, ystress, eta_bg, gammadot_crit))
+    np.sqrt(out, out=out)
+    out += 1
+    out *= ystress
+    out += eta_bg * x
+    return out
+
+
+def TC_kernel(x, ystress, eta_bg, gammadot_crit, out):
+    for i in range(x.shape[0]):
+        out[i] = (ystress + ystress * (x[i] / gammadot_crit) ** 0.5
+                  + eta_bg * x[i])
+
+
+def TC_jac_kernel(x, ystress, eta_bg, gammadot_crit, out):
+    for i in range(x.shape[0]):
+        s = (x[i] / gammadot_crit) ** 0.5
+        out[0, i] = 1 + s
+        out[1, i] = x[i]
+        out[2, i] = -0.5 * ystress * s / gammadot_crit
+
+
+register_kernel("TC", TC_numpy, TC_kernel, TC_jac_kernel)
+
+
+def TCn_numpy(x, ystress=1.0, eta_bg=0.1, gammadot_crit=0.1, n=0.5):
+    """:meth:`rheofit.models.TCn` with in-place operations"""
+    out = np.divide(x, gammadot_crit,
+                    out=_output(x, ystress, eta_bg, gammadot_crit, n))
+    np.power(out, n, out=out)
+    out += 1
+    out *= ystress
+    out += eta_bg * x
+    return out
+
+
+def TCn_kernel(x, ystress, eta_bg, gammadot_crit, n, out):
+    for i in range(x.shape[0]):
+        out[i] = (ystress + ystress * (x[i] / gammadot_crit) ** n
+                  + eta_bg * x[i])
+
+
+def TCn_jac_kernel(x, ystress, eta_bg, gammadot_crit, n, out):
+    for i in range(x.shape[0]):
+        u = x[i] / gammadot_crit
+        s = u ** n
+        out[0, i] = 1 + s
+        out[1, i] = x[i]
+        out[2, i] = -n * ystress * s / gammadot_crit
+        out[3, i] = ystress * s * np.log(u)
+
+
+register_kernel("TCn", TCn_numpy, TCn_kernel, TCn_jac_kernel)
+
+
+def HB_numpy(x, ystress=1.0, K=1.0, n=0.5):
+    """:meth:`rheofit.models.HB` with in-place operations"""
+    out = np.power(x, n, out=_output(x, ystress, K, n))
+    out *= K
+    out += ystress
+    return out
+
+
+def HB_kernel(x, ystress, K, n, out):
+    for i in range(x.shape[0]):
+        out[i] = ystress + K * x[i] ** n
+
+
+def HB_jac_kernel(x, ystress, K, n, out):
+    for i in range(x.shape[0]):
+        xn = x[i] ** n
+        out[0, i] = 1.0
+        out[1, i] = xn
+        out[2, i] = K * xn * np.log(x[i])
+
+
+register_kernel("HB", HB_numpy, HB_kernel, HB_jac_kernel)
+
+
+def casson_numpy(x, ystress=1.0, eta_bg=0.1):
+    """:meth:`rheofit.models.casson` with in-place operations"""
+    out = np.multiply(eta_bg, x, out=_output(x, ystress, eta_bg))
+    np.sqrt(out, out=out)
+    out += np.sqrt(ystress)
+    np.square(out, out=out)
+    return out
+
+
+def casson_kernel(x, ystress, eta_bg, out):
+    root = ystress ** 0.5
+    for i in range(x.shape[0]):
+        out[i] = (root + (eta_bg * x[i]) ** 0.5) ** 2
+
+
+def casson_jac_kernel(x, ystress, eta_bg, out):
+    # derivatives capped as in rheofit.models.casson_jac
+    floor = 1e-6
+    root = ystress ** 0.5
+    for i in range(x.shape[0]):
+        root_sum = root + (eta_bg * x[i]) ** 0.5
+        out[0, i] = root_sum / max(ystress, floor * eta_bg * x[i]) ** 0.5
+        out[1, i] = root_sum * (x[i] / max(eta_bg, floor * ystress / x[i])) ** 0.5
+
+
+register_kernel("casson", casson_numpy, casson_kernel, casson_jac_kernel)
+
+
+def carreau_numpy(x, eta_0=1.0, gammadot_crit=1.0, n=0.5):
+    """:meth:`rheofit.models.carreau` with in-place operations"""
+    out = np.divide(x, gammadot_crit, out=_output(x, eta_0, gammadot_crit, n))
+    np.square(out, out=out)
+    out += 1
+    np.power(out, (n - 1) / 2, out=out)
+    out *= x
+    out *= eta_0
+    return out
+
+
+def carreau_kernel(x, eta_0, gammadot_crit, n, out):
+    m = (n - 1) / 2
+    for i in range(x.shape[0]):
+        out[i] = x[i] * eta_0 * (1 + (x[i] / gammadot_crit) ** 2) ** m
+
+
+def carreau_jac_kernel(x, eta_0, gammadot_crit, n, out):
+    m = (n - 1) / 2
+    for i in range(x.shape[0]):
+        u2 = (x[i] / gammadot_crit) ** 2
+        thinning = (1 + u2) ** m
+        out[0, i] = x[i] * thinning
+        out[1, i] = (-2 * m * x[i] * eta_0 * u2 * thinning / (1 + u2)
+                     / gammadot_crit)
+        out[2, i] = x[i] * eta_0 * thinning * 0.5 * np.log(1 + u2)
+
+
+register_kernel("carreau", carreau_numpy, carreau_kernel, carreau_jac_kernel)
+
+
+def cross_numpy(x, eta_inf=0.001, eta_0=1.0, n=0.5, gammadot_crit=1.0):
+    """:meth:`rheofit.models.cross` with in-place operations"""
+    out = np.divide(x, gammadot_crit,
+                    out=_output(x, eta_inf, eta_0, n, gammadot_crit))
+    np.power(out, n, out=out)
+    out += 1
+    np.divide(np.subtract(eta_0, eta_inf), out, out=out)
+    out += eta_inf
+    out *= x
+    return out
+
+
+def cross_kernel(x, eta_inf, eta_0, n, gammadot_crit, out):
+    for i in range(x.shape[0]):
+        out[i] = (x[i] * eta_inf
+                  + x[i] * (eta_0 - eta_inf) / (1 + (x[i] / gammadot_crit) ** n))
+
+
+def cross_jac_kernel(x, eta_inf, eta_0, n, gammadot_crit, out):
+    for i in range(x.shape[0]):
+        u = x[i] / gammadot_crit
+        v = u ** n
+        d_eta = x[i] * (eta_0 - eta_inf) / (1 + v) ** 2
+        out[0, i] = x[i] - x[i] / (1 + v)
+        out[1, i] = x[i] / (1 + v)
+        out[2, i] = -d_eta * v * np.log(u)
+        out[3, i] = d_eta * n * v / gammadot_crit
+
+
+register_kernel("cross", cross_numpy, cross_kernel, cross_jac_kernel)
@@ -12,18 +12,209 @@ Model expressions and LMfit model are provided
 Example:
 
         rheology.rheology_fit.HB -> Model expression (simple function)
+        rheology.rheology_fit.HB_jac -> Partial derivatives of the model expression
         rheology.rheology_fit.HB_model -> lmfit model object
 
+Model objects are built on first access from the registry of model
+functions (see :meth:`register_model`), so importing the module does not
+import lmfit, matplotlib or IPython.
+
 It also provides few convenience functions to rapidly see and plot the result of
 the fit.
 
 """
-import lmfit
+import copy
+
 import pandas as pd
-import matplotlib.pyplot as plt
-from IPython.display import Math
 import numpy as np
 
+# registered models: {model name: arguments of rheology_model and param hints}
+_MODELS = {}
+
+# models evaluated by fused kernels: {(model name, backend): rheology_model}
+_FUSED_MODELS = {}
+
+
+def register_model(func, jac=None, guess=None, basis=None, prefix=None,
+                   param_hints=None, expression=None, doc=None):
+    """Register a model function, <function name>_model is built on first use
+
+    Args:
+        func: model function, first argument is the shear rate
+
+        jac: partial derivatives of func (see :meth:`HB_jac`)
+
+        guess: function (shear rate, stress, transforms=None) -> dictionary
+            of starting values estimated from the data, transforms are the
+            precomputed :meth:`curve_transforms` (see :meth:`HB_guess`)
+
+        basis: function (shear rate, nonlinear parameters) -> dictionary
+            {linear parameter: stress per unit of the parameter}, used by
+            the variable projection solver (see :meth:`HB_basis`)
+
+        prefix: parameter prefix, default <function name>_
+
+        param_hints: dictionary {parameter name: dict of set_param_hint arguments}
+
+        expression: LaTeX string of the model equation
+
+        doc: docstring of the model object, default a reference to func
+            and the list of parameter hints
+
+    Returns:
+        name of the model (e.g. 'HB_model')
+    """
+    name = func.__name__ + "_model"
+    param_hints = dict(param_hints or {})
+    if doc is None:
+        doc = _model_doc(name, func, param_hints)
+    _MODELS[name] = dict(func=func, jac=jac, guess=guess, basis=basis,
+                         prefix=func.__name__ + "_" if prefix is None else prefix,
+                         param_hints=param_hints,
+                         expression=expression, doc=doc)
+    # a model registered again is rebuilt on next access
+    globals().pop(name, None)
+    for key in [key for key in _FUSED_MODELS if key[0] == name]:
+        del _FUSED_MODELS[key]
+    return name
+
+
+def _model_doc(name, func, param_hints):
+    """Docstring of a registered model object"""
+    lines = ["Lmfit model from equation :meth:`{}.{}`".format(
+        func.__module__, func.__name__), "", "Note:", ""]
+    for param_name, hint in param_hints.items():
+        lines.append("{}.set_param_hint('{}', {})".format(
+            name, param_name, ", ".join(
+                "{}={!r}".format(key, value) for key, value in hint.items())))
+        lines.append("")
+    return "\n".join(lines)
+
+
+def available_models():
+    """Names of the registered models"""
+    return list(_MODELS)
+
+
+def get_model(name, backend=None):
+    """ lmfit model of a registered model, built and cached on first use
+
+        Args:
+
+        name: model name ('HB_model') or model function name ('HB')
+
+        backend: None for the model functions of this module, or 'numba',
+        'numpy' or 'auto' for the fused kernels of :mod:`rheofit.kernels`
+
+        Returns:
+
+        rheology_model (lmfit.Model subclass)
+    """
+    if name not in _MODELS and name + "_model" in _MODELS:
+        name = name + "_model"
+    if name not in _MODELS:
+        raise KeyError("unknown model {!r}, available models: {}".format(
+            name, ", ".join(_MODELS)))
+    if backend is not None:
+        from . import kernels
+        if backend == "auto":
+            backend = "numba" if kernels.numba_available() else "numpy"
+        if (name, backend) not in _FUSED_MODELS:
+            _FUSED_MODELS[name, backend] = kernels.fused_model(name, backend)
+        return _FUSED_MODELS[name, backend]
+    model = globals().get(name)
+    if model is None:
+        from ._rheology_model import rheology_model
+        spec = _MODELS[name]
+        model = rheology_model(spec["func"], jac=spec["jac"],
+                               guess=spec["guess"], basis=spec["basis"],
+                               prefix=spec["prefix"],
+                               expression=spec["expression"])
+        for param_name, hint in spec["param_hints"].items():
+            model.set_param_hint(param_name, **hint)
+        model.__doc__ = spec["doc"]
+        globals()[name] = model
+    return model
+
+
+def __getattr__(name):
+    # module level lazy attributes (PEP 562)
+    if name in _MODELS:
+        return get_model(name)
+    if name == "rheology_model":
+        from ._rheology_model import rheology_model
+        return rheology_model
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_MODELS) | {"rheology_model"})
+
+
+def _flow_curve_arrays(x, stress):
+    """Finite and positive points of a flow curve sorted by shear rate
+
+    Raises ValueError when less than 3 points are left.
+    """
+    x = np.asarray(x, dtype="float").ravel()
+    stress = np.asarray(stress, dtype="float").ravel()
+    mask = np.isfinite(x) & np.isfinite(stress) & (x > 0) & (stress > 0)
+    if np.count_nonzero(mask) < 3:
+        raise ValueError("not enough points to estimate the parameters")
+    order = np.argsort(x[mask])
+    return x[mask][order], stress[mask][order]
+
+
+def _ends(npoints):
+    """Number of points used for the low and high shear rate estimates"""
+    return min(npoints, max(3, npoints // 5))
+
+
+def curve_transforms(x, stress):
+    """ Transforms of a flow curve used by the guess functions
+
+        :meth:`select_model` computes them once per curve and passes them to
+        the guess of every candidate model.
+
+        Args:
+
+        x: shear rate
+
+        stress: stress
+
+        Returns:
+
+        dictionary with the finite and positive points sorted by shear rate
+        (x, stress), their logarithms (log_x, log_stress) and square roots
+        (sqrt_x, sqrt_stress)
+    """
+    x, stress = _flow_curve_arrays(x, stress)
+    return {"x": x, "stress": stress,
+            "log_x": np.log(x), "log_stress": np.log(stress),
+            "sqrt_x": np.sqrt(x), "sqrt_stress": np.sqrt(stress)}
+
+
+def _loglog_fit(log_x, log_y):
+    """Exponent and prefactor of y = prefactor * x ** exponent"""
+    exponent, intercept = np.polyfit(log_x, log_y, 1)
+    return exponent, np.exp(intercept)
+
+
+def _low_rate_plateau(curve):
+    """Yield stress estimate: lowest stresses scaled down by the log-log
+    slope of the curve at low shear rate (flat curve -> plateau)"""
+    k = _ends(len(curve["x"]))
+    slope, _ = _loglog_fit(curve["log_x"][:k], curve["log_stress"][:k])
+    return curve["stress"][:k].min() * np.clip(1 - slope, 0.1, 1)
+
+
+def _high_rate_slope(x, stress):
+    """Background viscosity estimate: d stress / d shear rate at the
+    highest shear rates"""
+    k = _ends(len(x))
+    slope = np.polyfit(x[-k:], stress[-k:], 1)[0]
+    return max(slope, 1e-3 * stress[-1] / x[-1])
+
 
 def constantstress(x, ystress=0.1):
     """Constant stress model
@@ -41,18 +232,42 @@ def constantstress(x, ystress=0.1):
     return ystress
 
 
-# instantiate model class
-constantstress_model = lmfit.Model(constantstress, prefix="constantstress_")
-""" Lmfit model from equation :meth:`rheofit.models.constantstress`
+def constantstress_jac(x, ystress=0.1):
+    """Partial derivatives of :meth:`rheofit.models.constantstress`
+
+    Returns:
+        dictionary {parameter name: d stress / d parameter}
+    """
+    return {"ystress": np.ones_like(x)}
+
 
-Note:
+def constantstress_guess(x, stress, transforms=None):
+    """Starting values for :meth:`rheofit.models.constantstress`: geometric
+    mean of the stress
 
-"""
-constantstress_model.model_expression = Math("\sigma=\sigma_y")
+    Returns:
+        dictionary {parameter name: estimate}
+    """
+    curve = transforms or curve_transforms(x, stress)
+    x, stress = curve["x"], curve["stress"]
+    return {"ystress": np.exp(curve["log_stress"].mean())}
+
+
+def constantstress_basis(x):
+    """Linear form of :meth:`rheofit.models.constantstress`
+
+    Returns:
+        dictionary {linear parameter name: stress per unit of the parameter}
+    """
+    return {"ystress": np.ones_like(x)}
 
 
-# set parameters for model class
-constantstress_model.set_param_hint("ystress", min=0, vary=True)
+# lmfit model constantstress_model, built on first use
+register_model(constantstress, jac=constantstress_jac,
+               guess=constantstress_guess, basis=constantstress_basis,
+               prefix="constantstress_",
+               param_hints={"ystress": dict(min=0, vary=True)},
+               expression=r"\sigma=\sigma_y")
 
 
 def Newtonian(x, eta_bg=0.1):
@@ -73,21 +288,41 @@ def Newtonian(x, eta_bg=0.1):
     return eta_bg * x
 
 
-# instantiate model class
-Newtonian_model = lmfit.Model(Newtonian, prefix="newtonian_")
-""" Lmfit model from equation :meth:`rheofit.models.Bingham`
+def Newtonian_jac(x, eta_bg=0.1):
+    """Partial derivatives of :meth:`rheofit.models.Newtonian`
 
-Note:
+    Returns:
+        dictionary {parameter name: d stress / d parameter}
+    """
+    return {"eta_bg": x}
 
-Newtonian_model.set_param_hint('eta_bg', min=0, vary=True)
 
+def Newtonian_guess(x, stress, transforms=None):
+    """Starting values for :meth:`rheofit.models.Newtonian`: geometric mean
+    of the viscosity
 
-"""
-Newtonian_model.model_expression = Math("\sigma=\eta_{bg}\cdot\dot\gamma")
+    Returns:
+        dictionary {parameter name: estimate}
+    """
+    curve = transforms or curve_transforms(x, stress)
+    x, stress = curve["x"], curve["stress"]
+    return {"eta_bg": np.exp((curve["log_stress"] - curve["log_x"]).mean())}
+
+
+def Newtonian_basis(x):
+    """Linear form of :meth:`rheofit.models.Newtonian`
+
+    Returns:
+        dictionary {linear parameter name: stress per unit of the parameter}
+    """
+    return {"eta_bg": x}
 
 
-# set parameters for model class
-Newtonian_model.set_param_hint("eta_bg", min=0, vary=True)
+# lmfit model Newtonian_model, built on first use
+register_model(Newtonian, jac=Newtonian_jac, guess=Newtonian_guess,
+               basis=Newtonian_basis, prefix="newtonian_",
+               param_hints={"eta_bg": dict(min=0, vary=True)},
+               expression=r"\sigma=\eta_{bg}\cdot\dot\gamma")
 
 
 def Powerlaw(x, n=0.5, K=0.1):
@@ -109,23 +344,44 @@ def Powerlaw(x, n=0.5, K=0.1):
     return K * x ** n
 
 
-# instantiate model class
-Powerlaw_model = lmfit.Model(Powerlaw, prefix="PL_")
-""" Lmfit model from equation :meth:`rheofit.models.Bingham`
+def Powerlaw_jac(x, n=0.5, K=0.1):
+    """Partial derivatives of :meth:`rheofit.models.Powerlaw`
 
-Note:
+    Returns:
+        dictionary {parameter name: d stress / d parameter}
+    """
+    xn = x ** n
+    return {"n": K * xn * np.log(x), "K": xn}
 
-Powerlaw_model.set_param_hint('K', min=0, vary=True)
-Powerlaw_model.set_param_hint('n', min=0, vary=True)
 
+def Powerlaw_guess(x, stress, transforms=None):
+    """Starting values for :meth:`rheofit.models.Powerlaw`: log-log
+    regression of the stress
 
-"""
-Powerlaw_model.model_expression = Math("\sigma=K\cdot\dot\gamma^n")
+    Returns:
+        dictionary {parameter name: estimate}
+    """
+    curve = transforms or curve_transforms(x, stress)
+    x, stress = curve["x"], curve["stress"]
+    n, K = _loglog_fit(curve["log_x"], curve["log_stress"])
+    return {"n": max(n, 0.01), "K": K}
+
+
+def Powerlaw_basis(x, n=0.5):
+    """Linear form of :meth:`rheofit.models.Powerlaw` (K given n)
+
+    Returns:
+        dictionary {linear parameter name: stress per unit of the parameter}
+    """
+    return {"K": x ** n}
 
 
-# set parameters for model class
-Powerlaw_model.set_param_hint("K", min=0, vary=True)
-Powerlaw_model.set_param_hint("n", min=0, vary=True)
+# lmfit model Powerlaw_model, built on first use
+register_model(Powerlaw, jac=Powerlaw_jac, guess=Powerlaw_guess,
+               basis=Powerlaw_basis, prefix="PL_",
+               param_hints={"K": dict(min=0, vary=True),
+                            "n": dict(min=0, vary=True)},
+               expression=r"\sigma=K\cdot\dot\gamma^n")
 
 
 def Bingham(x, ystress=1.0, eta_bg=0.1):
@@ -147,25 +403,45 @@ def Bingham(x, ystress=1.0, eta_bg=0.1):
     return ystress + eta_bg * x
 
 
-# instantiate model class
-Bingham_model = lmfit.Model(Bingham, prefix="bingham_")
-""" Lmfit model from equation :meth:`rheofit.models.Bingham`
+def Bingham_jac(x, ystress=1.0, eta_bg=0.1):
+    """Partial derivatives of :meth:`rheofit.models.Bingham`
 
-Note:
+    Returns:
+        dictionary {parameter name: d stress / d parameter}
+    """
+    return {"ystress": np.ones_like(x), "eta_bg": x}
 
-Bingham_model.set_param_hint('ystress', min=0)
 
-Bingham_model.set_param_hint('eta_bg', min=0, vary=True)
+def Bingham_guess(x, stress, transforms=None):
+    """Starting values for :meth:`rheofit.models.Bingham`: linear regression
+    of the stress with relative weights
 
+    Returns:
+        dictionary {parameter name: estimate}
+    """
+    curve = transforms or curve_transforms(x, stress)
+    x, stress = curve["x"], curve["stress"]
+    eta_bg, ystress = np.polyfit(x, stress, 1, w=1 / stress)
+    if eta_bg <= 0:
+        eta_bg = _high_rate_slope(x, stress)
+    return {"ystress": max(ystress, 0.1 * stress[0]), "eta_bg": eta_bg}
 
-"""
-Bingham_model.model_expression = Math(
-    "\sigma=\sigma_y + \eta_{bg}\cdot\dot\gamma")
 
+def Bingham_basis(x):
+    """Linear form of :meth:`rheofit.models.Bingham`
 
-# set parameters for model class
-Bingham_model.set_param_hint("ystress", min=0)
-Bingham_model.set_param_hint("eta_bg", min=0, vary=True)
+    Returns:
+        dictionary {linear parameter name: stress per unit of the parameter}
+    """
+    return {"ystress": np.ones_like(x), "eta_bg": x}
+
+
+# lmfit model Bingham_model, built on first use
+register_model(Bingham, jac=Bingham_jac, guess=Bingham_guess,
+               basis=Bingham_basis, prefix="bingham_",
+               param_hints={"ystress": dict(min=0),
+                            "eta_bg": dict(min=0, vary=True)},
+               expression=r"\sigma=\sigma_y + \eta_{bg}\cdot\dot\gamma")
 
 
 def TC(x, ystress=1.0, eta_bg=0.1, gammadot_crit=0.1):
@@ -189,27 +465,55 @@ def TC(x, ystress=1.0, eta_bg=0.1, gammadot_crit=0.1):
     return ystress + ystress * (x / gammadot_crit) ** 0.5 + eta_bg * x
 
 
-# instantiate model class
-TC_model = lmfit.Model(TC, prefix="TC_")
-""" Lmfit model from equation :meth:`rheofit.models.TC`
+def TC_jac(x, ystress=1.0, eta_bg=0.1, gammadot_crit=0.1):
+    """Partial derivatives of :meth:`rheofit.models.TC`
 
-Note:
+    Returns:
+        dictionary {parameter name: d stress / d parameter}
+    """
+    s = (x / gammadot_crit) ** 0.5
+    return {"ystress": 1 + s,
+            "eta_bg": x,
+            "gammadot_crit": -0.5 * ystress * s / gammadot_crit}
 
-TC_model.set_param_hint('ystress', min=0)
 
-TC_model.set_param_hint('eta_bg', min=0, vary=True)
+def TC_guess(x, stress, transforms=None):
+    """Starting values for :meth:`rheofit.models.TC`: low shear rate plateau
+    for ystress, high shear rate slope for eta_bg and gammadot_crit from the
+    remaining stress
 
-TC_model.set_param_hint('gammadot_crit', min=0)
-"""
-TC_model.model_expression = Math(
-    "\sigma=\sigma_y+\sigma_y\cdot(\dot\gamma/\dot\gamma_c)^{0.5}+\eta_{bg}\cdot\dot\gamma"
-)
+    Returns:
+        dictionary {parameter name: estimate}
+    """
+    curve = transforms or curve_transforms(x, stress)
+    x, stress = curve["x"], curve["stress"]
+    ystress = _low_rate_plateau(curve)
+    eta_bg = _high_rate_slope(x, stress)
+    guess = {"ystress": ystress, "eta_bg": eta_bg}
+    # ystress * (x / gammadot_crit) ** 0.5 = stress - ystress - eta_bg * x
+    rest = stress - ystress - eta_bg * x
+    if np.any(rest > 0):
+        guess["gammadot_crit"] = np.median(
+            x[rest > 0] * (ystress / rest[rest > 0]) ** 2)
+    return guess
+
+
+def TC_basis(x, gammadot_crit=0.1):
+    """Linear form of :meth:`rheofit.models.TC` (ystress and eta_bg given
+    gammadot_crit)
+
+    Returns:
+        dictionary {linear parameter name: stress per unit of the parameter}
+    """
+    return {"ystress": 1 + (x / gammadot_crit) ** 0.5, "eta_bg": x}
 
 
-# set parameters for model class
-TC_model.set_param_hint("ystress", min=0)
-TC_model.set_param_hint("eta_bg", min=0, vary=True)
-TC_model.set_param_hint("gammadot_crit", min=0)
+# lmfit model TC_model, built on first use
+register_model(TC, jac=TC_jac, guess=TC_guess, basis=TC_basis, prefix="TC_",
+               param_hints={"ystress": dict(min=0),
+                            "eta_bg": dict(min=0, vary=True),
+                            "gammadot_crit": dict(min=0)},
+               expression=r"\sigma=\sigma_y+\sigma_y\cdot(\dot\gamma/\dot\gamma_c)^{0.5}+\eta_{bg}\cdot\dot\gamma")
 
 
 def TCn(x, ystress=1.0, eta_bg=0.1, gammadot_crit=0.1,n=0.5):
@@ -235,30 +539,59 @@ def TCn(x, ystress=1.0, eta_bg=0.1, gammadot_crit=0.1,n=0.5):
     return ystress + ystress * (x / gammadot_crit) ** n + eta_bg * x
 
 
-# instantiate model class
-TCn_model = lmfit.Model(TCn, prefix="TCn_")
-""" Lmfit model from equation :meth:`rheofit.models.TC`
+def TCn_jac(x, ystress=1.0, eta_bg=0.1, gammadot_crit=0.1, n=0.5):
+    """Partial derivatives of :meth:`rheofit.models.TCn`
 
-Note:
+    Returns:
+        dictionary {parameter name: d stress / d parameter}
+    """
+    s = (x / gammadot_crit) ** n
+    return {"ystress": 1 + s,
+            "eta_bg": x,
+            "gammadot_crit": -n * ystress * s / gammadot_crit,
+            "n": ystress * s * np.log(x / gammadot_crit)}
 
-TCn_model.set_param_hint('ystress', min=0)
 
-TCn_model.set_param_hint('eta_bg', min=0, vary=True)
+def TCn_guess(x, stress, transforms=None):
+    """Starting values for :meth:`rheofit.models.TCn`: as
+    :meth:`rheofit.models.TC_guess` with n from the log-log slope of the
+    remaining stress
 
-TCn_model.set_param_hint('gammadot_crit', min=0)
+    Returns:
+        dictionary {parameter name: estimate}
+    """
+    curve = transforms or curve_transforms(x, stress)
+    x, stress = curve["x"], curve["stress"]
+    ystress = _low_rate_plateau(curve)
+    eta_bg = _high_rate_slope(x, stress)
+    guess = {"ystress": ystress, "eta_bg": eta_bg}
+    rest = stress - ystress - eta_bg * x
+    if np.count_nonzero(rest > 0) >= 2:
+        n, prefactor = _loglog_fit(curve["log_x"][rest > 0],
+                                   np.log(rest[rest > 0]))
+        n = np.clip(n, 0.05, 0.95)
+        guess.update(n=n, gammadot_crit=(ystress / prefactor) ** (1 / n))
+    return guess
+
+
+def TCn_basis(x, gammadot_crit=0.1, n=0.5):
+    """Linear form of :meth:`rheofit.models.TCn` (ystress and eta_bg given
+    gammadot_crit and n)
 
-TCn_model.set_param_hint('n', min=0, max=1)
-"""
-TCn_model.model_expression = Math(
-    "\sigma=\sigma_y+\sigma_y\cdot(\dot\gamma/\dot\gamma_c)^{0.5}+\eta_{bg}\cdot\dot\gamma"
-)
+    Returns:
+        dictionary {linear parameter name: stress per unit of the parameter}
+    """
+    return {"ystress": 1 + (x / gammadot_crit) ** n, "eta_bg": x}
 
 
-# set parameters for model class
-TCn_model.set_param_hint("ystress", min=0)
-TCn_model.set_param_hint("eta_bg", min=0, vary=True)
-TCn_model.set_param_hint("gammadot_crit", min=0)
-TCn_model.set_param_hint("n", min=0, max=1)
+# lmfit model TCn_model, built on first use
+register_model(TCn, jac=TCn_jac, guess=TCn_guess, basis=TCn_basis,
+               prefix="TCn_",
+               param_hints={"ystress": dict(min=0),
+                            "eta_bg": dict(min=0, vary=True),
+                            "gammadot_crit": dict(min=0),
+                            "n": dict(min=0, max=1)},
+               expression=r"\sigma=\sigma_y+\sigma_y\cdot(\dot\gamma/\dot\gamma_c)^n+\eta_{bg}\cdot\dot\gamma")
 
 
 def HB(x, ystress=1.0, K=1.0, n=0.5):
@@ -282,22 +615,49 @@ def HB(x, ystress=1.0, K=1.0, n=0.5):
     return ystress + K * x ** n
 
 
-HB_model = lmfit.Model(HB, prefix="HB_")
-""" Lmfit model from equation :meth:`rheofit.models.HB`
+def HB_jac(x, ystress=1.0, K=1.0, n=0.5):
+    """Partial derivatives of :meth:`rheofit.models.HB`
+
+    Returns:
+        dictionary {parameter name: d stress / d parameter}
+    """
+    xn = x ** n
+    return {"ystress": np.ones_like(x), "K": xn, "n": K * xn * np.log(x)}
 
-Note:
-HB_model.set_param_hint('ystress', min=0)
 
-HB_model.set_param_hint('K', min=0, vary=True)
+def HB_guess(x, stress, transforms=None):
+    """Starting values for :meth:`rheofit.models.HB`: low shear rate plateau
+    for ystress and log-log regression of the remaining stress for K and n
 
-HB_model.set_param_hint('n', min=0.0,max=1,vary=True)
-"""
+    Returns:
+        dictionary {parameter name: estimate}
+    """
+    curve = transforms or curve_transforms(x, stress)
+    x, stress = curve["x"], curve["stress"]
+    ystress = _low_rate_plateau(curve)
+    guess = {"ystress": ystress}
+    rest = stress - ystress
+    if np.count_nonzero(rest > 0) >= 2:
+        n, K = _loglog_fit(curve["log_x"][rest > 0], np.log(rest[rest > 0]))
+        guess.update(n=np.clip(n, 0.05, 0.95), K=K)
+    return guess
+
+
+def HB_basis(x, n=0.5):
+    """Linear form of :meth:`rheofit.models.HB` (ystress and K given n)
+
+    Returns:
+        dictionary {linear parameter name: stress per unit of the parameter}
+    """
+    return {"ystress": np.ones_like(x), "K": x ** n}
 
-HB_model.model_expression = Math("\sigma=\sigma_y+K\cdot\dot\gamma^n")
 
-HB_model.set_param_hint("ystress", min=0)
-HB_model.set_param_hint("K", min=0, vary=True)
-HB_model.set_param_hint("n", min=0.0, max=1, vary=True)
+# lmfit model HB_model, built on first use
+register_model(HB, jac=HB_jac, guess=HB_guess, basis=HB_basis, prefix="HB_",
+               param_hints={"ystress": dict(min=0),
+                            "K": dict(min=0, vary=True),
+                            "n": dict(min=0.0, max=1, vary=True)},
+               expression=r"\sigma=\sigma_y+K\cdot\dot\gamma^n")
 
 
 def casson(x, ystress=1.0, eta_bg=0.1):
@@ -319,23 +679,47 @@ def casson(x, ystress=1.0, eta_bg=0.1):
     return (ystress ** 0.5 + (eta_bg * x) ** 0.5) ** 2
 
 
-casson_model = lmfit.Model(casson, prefix="casson_")
-""" Lmfit model from equation :meth:`rheofit.models.casson`
+def casson_jac(x, ystress=1.0, eta_bg=0.1):
+    """Partial derivatives of :meth:`rheofit.models.casson`
 
-Note:
-casson_model.set_param_hint('ystress', min=0)
+    Returns:
+        dictionary {parameter name: d stress / d parameter}
+    """
+    # the derivatives diverge when one of the two terms vanishes: they are
+    # capped where that term is below 1e-6 of the other one, which keeps the
+    # solver scaling sane when a parameter runs to its lower bound
+    floor = 1e-6
+    root_sum = ystress ** 0.5 + (eta_bg * x) ** 0.5
+    return {"ystress": root_sum / np.maximum(ystress, floor * eta_bg * x) ** 0.5,
+            "eta_bg": root_sum * (x / np.maximum(eta_bg, floor * ystress / x)) ** 0.5}
 
-casson_model.set_param_hint('eta_bg', min=0, vary=True)
 
-"""
-casson_model.model_expression = Math(
-    "\sigma^{0.5}=\sigma_y^{0.5}+\eta_{bg}^{0.5}")
+def casson_guess(x, stress, transforms=None):
+    """Starting values for :meth:`rheofit.models.casson`: linear regression
+    of the square root of the stress against the square root of the shear
+    rate
 
-casson_model.set_param_hint("ystress", min=0)
-casson_model.set_param_hint("eta_bg", min=0, vary=True)
+    Returns:
+        dictionary {parameter name: estimate}
+    """
+    curve = transforms or curve_transforms(x, stress)
+    x, stress = curve["x"], curve["stress"]
+    slope, intercept = np.polyfit(curve["sqrt_x"], curve["sqrt_stress"], 1,
+                                  w=1 / curve["sqrt_stress"])
+    if slope <= 0:
+        slope = _high_rate_slope(x, stress) ** 0.5
+    return {"ystress": max(intercept, (0.1 * stress[0]) ** 0.5) ** 2,
+            "eta_bg": slope ** 2}
+
+
+# lmfit model casson_model, built on first use
+register_model(casson, jac=casson_jac, guess=casson_guess, prefix="casson_",
+               param_hints={"ystress": dict(min=0),
+                            "eta_bg": dict(min=0, vary=True)},
+               expression=r"\sigma^{0.5}=\sigma_y^{0.5}+\eta_{bg}^{0.5}")
 
 
-def carreau(x, eta_0=1.0, gammadot_crit=1.0, n=0.5, prefix="carreau"):
+def carreau(x, eta_0=1.0, gammadot_crit=1.0, n=0.5):
     """carreau Model
 
     Note:
@@ -356,23 +740,60 @@ def carreau(x, eta_0=1.0, gammadot_crit=1.0, n=0.5, prefix="carreau"):
     return x * eta_0 * (1 + (x / gammadot_crit) ** 2) ** ((n - 1) / 2)
 
 
-carreau_model = lmfit.Model(carreau, prefix="carreau_")
-""" Lmfit model from equation :meth:`rheofit.models.carreau`
+def carreau_jac(x, eta_0=1.0, gammadot_crit=1.0, n=0.5):
+    """Partial derivatives of :meth:`rheofit.models.carreau`
+
+    Returns:
+        dictionary {parameter name: d stress / d parameter}
+    """
+    u2 = (x / gammadot_crit) ** 2
+    m = (n - 1) / 2
+    thinning = (1 + u2) ** m
+    return {"eta_0": x * thinning,
+            "gammadot_crit": -2 * m * x * eta_0 * u2 * thinning / (1 + u2) / gammadot_crit,
+            "n": x * eta_0 * thinning * 0.5 * np.log(1 + u2)}
+
 
-Note:
-carreau_model.set_param_hint('eta_0', min=0)
+def carreau_guess(x, stress, transforms=None):
+    """Starting values for :meth:`rheofit.models.carreau`: low shear rate
+    viscosity plateau for eta_0, high shear rate log-log slope of the
+    viscosity for n and gammadot_crit where the two asymptotes cross
+    (within the measured shear rates)
 
-carreau_model.set_param_hint('gammadot_crit_carreau', min=0, vary=True)
+    Returns:
+        dictionary {parameter name: estimate}
+    """
+    curve = transforms or curve_transforms(x, stress)
+    x, stress = curve["x"], curve["stress"]
+    viscosity = stress / x
+    k = _ends(len(x))
+    eta_0 = viscosity[:k].max()
+    slope, _ = _loglog_fit(curve["log_x"][-k:],
+                           curve["log_stress"][-k:] - curve["log_x"][-k:])
+    n = np.clip(1 + slope, 0.05, 0.95)
+    # eta_0 * (x / gammadot_crit) ** (n - 1) = viscosity at high shear rate
+    gammadot_crit = x[-1] * min(viscosity[-1] / eta_0, 1) ** (1 / (1 - n))
+    return {"eta_0": eta_0, "gammadot_crit": np.clip(gammadot_crit, x[0], x[-1]),
+            "n": n}
+
+
+def carreau_basis(x, gammadot_crit=1.0, n=0.5):
+    """Linear form of :meth:`rheofit.models.carreau` (eta_0 given
+    gammadot_crit and n)
+
+    Returns:
+        dictionary {linear parameter name: stress per unit of the parameter}
+    """
+    return {"eta_0": x * (1 + (x / gammadot_crit) ** 2) ** ((n - 1) / 2)}
 
-carreau_model.set_param_hint('n',min=0, max=1)
-"""
-carreau_model.model_expression = Math(
-    "\sigma=\dot\gamma \cdot \eta_0 \cdot (1+(\dot\gamma/\dot\gamma_{c_carreau})^2)^{(n-1)/2}"
-)
 
-carreau_model.set_param_hint("eta_0", min=0)
-carreau_model.set_param_hint("gammadot_crit", min=0, vary=True)
-carreau_model.set_param_hint("n", min=0, max=1)
+# lmfit model carreau_model, built on first use
+register_model(carreau, jac=carreau_jac, guess=carreau_guess,
+               basis=carreau_basis, prefix="carreau_",
+               param_hints={"eta_0": dict(min=0),
+                            "gammadot_crit": dict(min=0, vary=True),
+                            "n": dict(min=0, max=1)},
+               expression=r"\sigma=\dot\gamma \cdot \eta_0 \cdot (1+(\dot\gamma/\dot\gamma_c)^2)^{(n-1)/2}")
 
 
 def cross(x, eta_inf=0.001, eta_0=1.0, n=0.5, gammadot_crit=1.0):
@@ -396,28 +817,64 @@ def cross(x, eta_inf=0.001, eta_0=1.0, n=0.5, gammadot_crit=1.0):
     return x * eta_inf + x * (eta_0 - eta_inf) / (1 + (x / gammadot_crit) ** n)
 
 
-cross_model = lmfit.Model(cross, prefix="cross_")
-""" Lmfit model from equation :meth:`rheofit.models.HB`
+def cross_jac(x, eta_inf=0.001, eta_0=1.0, n=0.5, gammadot_crit=1.0):
+    """Partial derivatives of :meth:`rheofit.models.cross`
 
-Note:
-cross_model.set_param_hint('eta_0', min=0)
+    Returns:
+        dictionary {parameter name: d stress / d parameter}
+    """
+    v = (x / gammadot_crit) ** n
+    d_eta = x * (eta_0 - eta_inf) / (1 + v) ** 2
+    return {"eta_inf": x - x / (1 + v),
+            "eta_0": x / (1 + v),
+            "n": -d_eta * v * np.log(x / gammadot_crit),
+            "gammadot_crit": d_eta * n * v / gammadot_crit}
 
-cross_model.set_param_hint('eta_inf', min=0, vary=True)
 
-cross_model.set_param_hint('n', min=0.0,max=1,vary=True)
+def cross_guess(x, stress, transforms=None):
+    """Starting values for :meth:`rheofit.models.cross`: low shear rate
+    viscosity plateau for eta_0, a fraction of the lowest viscosity for
+    eta_inf, high shear rate log-log slope of the viscosity for n and
+    gammadot_crit where the two asymptotes cross (within the measured shear
+    rates)
 
-cross_model.set_param_hint('gammadot_crit', min=0.0 ,vary=True)
+    Returns:
+        dictionary {parameter name: estimate}
+    """
+    curve = transforms or curve_transforms(x, stress)
+    x, stress = curve["x"], curve["stress"]
+    viscosity = stress / x
+    k = _ends(len(x))
+    eta_0 = viscosity[:k].max()
+    eta_inf = 0.01 * viscosity.min()
+    slope, _ = _loglog_fit(curve["log_x"][-k:],
+                           np.log(viscosity[-k:] - eta_inf))
+    n = np.clip(-slope, 0.05, 0.95)
+    # (eta_0 - eta_inf) * (x / gammadot_crit) ** -n = viscosity - eta_inf
+    ratio = max((eta_0 - eta_inf) / (viscosity[-1] - eta_inf), 1)
+    return {"eta_inf": eta_inf, "eta_0": eta_0, "n": n,
+            "gammadot_crit": np.clip(x[-1] / ratio ** (1 / n), x[0], x[-1])}
+
+
+def cross_basis(x, n=0.5, gammadot_crit=1.0):
+    """Linear form of :meth:`rheofit.models.cross` (eta_inf and eta_0 given
+    n and gammadot_crit)
 
-"""
+    Returns:
+        dictionary {linear parameter name: stress per unit of the parameter}
+    """
+    thinning = 1 / (1 + (x / gammadot_crit) ** n)
+    return {"eta_inf": x * (1 - thinning), "eta_0": x * thinning}
 
-cross_model.model_expression = Math(
-    "\sigma= \dot\gamma \eta_{inf} + \dot\gamma (\eta_0 - \eta_{inf})/(1 + (\dot\gamma/\dot\gamma_c)^n)"
-)
 
-cross_model.set_param_hint("eta_0", min=0)
-cross_model.set_param_hint("eta_inf", min=0, vary=True)
-cross_model.set_param_hint("n", min=0.0, max=1, vary=True)
-cross_model.set_param_hint("gammadot_crit", min=0.0, vary=True)
+# lmfit model cross_model, built on first use
+register_model(cross, jac=cross_jac, guess=cross_guess, basis=cross_basis,
+               prefix="cross_",
+               param_hints={"eta_0": dict(min=0),
+                            "eta_inf": dict(min=0, vary=True),
+                            "n": dict(min=0.0, max=1, vary=True),
+                            "gammadot_crit": dict(min=0.0, vary=True)},
+               expression=r"\sigma= \dot\gamma \eta_{inf} + \dot\gamma (\eta_0 - \eta_{inf})/(1 + (\dot\gamma/\dot\gamma_c)^n)")
 
 
 def show_parameter_table(result):
@@ -445,7 +902,8 @@ def show_parameter_table(result):
     return table_list
 
 
-def fit_FC(model, data):
+def fit_FC(model, data, params=None, guess=True, method="leastsq",
+           residual="linear", cache=None):
     """ Convenience function to fit a flow curve
         Args:
 
@@ -453,11 +911,291 @@ def fit_FC(model, data):
 
         data: pandas DataFrame with column 'Shear rate' and 'Stress'
 
+        params: lmfit.Parameters with the starting values
+
+        guess: when params is None, start from the values estimated from the
+        data by model.guess (if the model implements it) instead of the
+        parameter hints
+
+        method: lmfit minimization method, or 'varpro' to solve the linear
+        parameters exactly by variable projection (see :mod:`rheofit.varpro`)
+        and polish the solution with 'leastsq' (which also estimates the
+        uncertainties). Models without a linear basis fall back to 'leastsq'
+
+        residual: 'linear' for (model - stress) / stress, 'log' for
+        log(model) - log(stress) (better conditioned when the curve spans
+        several decades, see :meth:`rheofit._rheology_model.fit_log_residual`).
+        Points with stress <= 0 or not finite are left out of log fits
+
+        cache: rheofit.cache.fit_cache, the result of a previous fit of the
+        same data with the same model, starting values and settings is
+        returned without fitting
+
+        Returns:
+
+        lmfit.fitresult (with the varpro_nfev attribute for method 'varpro'
+        and residual_mode 'log' for log residuals)
+    """
+    if residual not in ("linear", "log"):
+        raise ValueError("unknown residual {!r}, use 'linear' or 'log'".format(
+            residual))
+    if cache is not None:
+        from .cache import fit_key
+
+        key = fit_key(model, data["Shear rate"], data["Stress"], params,
+                      guess=guess, method=method, residual=residual)
+        result = cache.get(key)
+        if result is None:
+            result = fit_FC(model, data, params=params, guess=guess,
+                            method=method, residual=residual)
+            cache.put(key, result)
+        return result
+    x = np.asarray(data["Shear rate"], dtype="float")
+    stress = np.asarray(data["Stress"], dtype="float")
+    if residual == "log":
+        # log(stress) is only defined for positive stress, as in fit_FC_batch
+        mask = np.isfinite(x) & np.isfinite(stress) & (stress > 0)
+        if not mask.all():
+            x, stress = x[mask], stress[mask]
+            data = {"Shear rate": x, "Stress": stress}
+    if params is None and guess:
+        try:
+            params = model.guess(stress, x=x)
+        except NotImplementedError:
+            params = None
+
+    varpro_nfev = None
+    start = params
+    if method == "varpro":
+        from . import varpro
+
+        method = "leastsq"
+        try:
+            params, info = varpro.varpro_params(model, x, stress,
+                                                weights=1 / stress,
+                                                params=params)
+            varpro_nfev = info["nfev"]
+        except NotImplementedError:
+            pass
+
+    fit_kws = {}
+    if varpro_nfev is not None:
+        # the polish starts at the optimum, it only runs longer where the
+        # model is degenerate and the parameters drift to their limits
+        fit_kws["max_nfev"] = 100 * (len(params) + 1)
+    try:
+        if residual == "log":
+            from ._rheology_model import fit_log_residual
+            result = fit_log_residual(model, data["Stress"], params=params,
+                                      x=data["Shear rate"], method=method,
+                                      **fit_kws)
+        else:
+            result = model.fit(data["Stress"], params=params,
+                               x=data["Shear rate"], weights=1 / data["Stress"],
+                               method=method, **fit_kws)
+    except ValueError:
+        # the variable projection solution can sit where the model is not
+        # finite for lmfit (e.g. gammadot_crit -> 0), fit from the start
+        if varpro_nfev is None:
+            raise
+        return fit_FC(model, data, params=start, guess=guess,
+                      residual=residual)
+    if varpro_nfev is not None:
+        result.varpro_nfev = varpro_nfev
+    return result
+
+
+def warm_start_params(model, result, bound_margin=0.01, params=None):
+    """ Model parameters starting from the best fit values of a previous fit
+
+        Values that are not finite, or closer to a bound than bound_margin
+        times the distance of the default value from that bound, are left to
+        the default of the parameter hints: the bounded fit can hardly move
+        a parameter starting next to its bound.
+
+        Args:
+
+        model: rheology model
+
+        result: lmfit.fitresult of the same model
+
+        bound_margin: relative distance from the bounds (default 0.01)
+
+        params: lmfit.Parameters used as template (a copy is returned), so
+        fixed parameters, bounds and expressions are kept (default the
+        parameter hints of the model)
+
+        Returns:
+
+        lmfit.Parameters
+    """
+    params = model.make_params() if params is None else params.copy()
+    for name, par in params.items():
+        if (par.expr is not None or not par.vary
+                or name not in result.params):
+            continue
+        value = result.params[name].value
+        if not (np.isfinite(value) and par.min < value < par.max):
+            continue
+        if any(np.isfinite(bound)
+               and abs(value - bound) < bound_margin * abs(par.value - bound)
+               for bound in (par.min, par.max)):
+            continue
+        par.set(value=value)
+    return params
+
+
+def fit_FC_series(model, curves, fallback=True, fallback_ratio=10.0,
+                  residual="linear", cache=None):
+    """ Fit an ordered series of flow curves, each fit starting from the
+        best fit parameters of the previous curve
+
+        Neighbouring curves of a series (e.g. temperatures or concentrations)
+        have similar parameters, so the warm start converges in fewer
+        iterations than the default starting values.
+
+        Args:
+
+        model: rheology model (e.g. HB_model)
+
+        curves: list (or dict) of DataFrames with column 'Shear rate' and
+        'Stress', in the order of the series
+
+        fallback: refit from the default starting values when the warm
+        started fit fails or its reduced chi square is more than
+        fallback_ratio times the one of the previous curve, the best of the
+        two fits is kept
+
+        residual: 'linear' or 'log' residuals (see :meth:`fit_FC`)
+
+        cache: rheofit.cache.fit_cache of the fits (see :meth:`fit_FC`)
+
+        Returns:
+
+        list of lmfit.fitresult (dict if curves is a dict), each result has
+        a warm_start attribute, False for the fits started from the defaults
+        (with a cache the results are shallow copies of the cached ones,
+        which are left unchanged)
+    """
+    keys = list(curves) if isinstance(curves, dict) else None
+    tables = [curves[key] for key in keys] if keys is not None else list(curves)
+
+    def fit(data, params, warm_start):
+        result = fit_FC(model, data, params, residual=residual, cache=cache)
+        if cache is not None:
+            # cached results are shared, do not flag them
+            result = copy.copy(result)
+        result.warm_start = warm_start
+        return result
+
+    results = []
+    previous = None
+    for data in tables:
+        if previous is None:
+            result = fit(data, None, False)
+        else:
+            try:
+                result = fit(data, warm_start_params(model, previous), True)
+            except ValueError:
+                # the model generated NaN values from the warm start
+                if not fallback:
+                    raise
+                result = None
+            if fallback and (result is None or not result.success
+                             or not np.isfinite(result.redchi)
+                             or result.redchi > fallback_ratio * previous.redchi):
+                cold = fit(data, None, False)
+                if (result is None or not np.isfinite(result.chisqr)
+                        or cold.chisqr < result.chisqr):
+                    result = cold
+        results.append(result)
+        if result.success and np.isfinite(result.redchi):
+            previous = result
+    return dict(zip(keys, results)) if keys is not None else results
+
+
+def _fit_candidate(model, transforms, method):
+    """Worker of select_model, errors are returned instead of raised"""
+    x, stress = transforms["x"], transforms["stress"]
+    try:
+        params = None
+        if getattr(model, "guess_func", None) is not None:
+            params = model.guess(stress, x=x, transforms=transforms)
+        result = fit_FC(model, {"Shear rate": x, "Stress": stress},
+                        params=params, method=method)
+    except Exception as error:
+        return False, repr(error)
+    table = show_parameter_table(result)
+    table["aic"] = result.aic
+    table["chisqr"] = result.chisqr
+    table["nfev"] = result.nfev + getattr(result, "varpro_nfev", 0)
+    table["success"] = result.success
+    return True, table
+
+
+def select_model(data, models=None, criterion="bic", method="leastsq",
+                 n_workers=None):
+    """ Fit several candidate models to a flow curve and rank them
+
+        The data are converted, cleaned (finite, positive shear rate and
+        stress) and sorted once, and the transforms used by the starting
+        value estimates (see :meth:`curve_transforms`) are computed once and
+        shared by all the fits, which run in parallel processes.
+
+        Args:
+
+        data: pandas DataFrame with column 'Shear rate' and 'Stress'
+
+        models: list of rheology models or model names (default all the
+        registered models, see :meth:`available_models`)
+
+        criterion: column used for the ranking ('bic', 'aic' or 'redchi')
+
+        method: fitting method passed to :meth:`fit_FC` (e.g. 'varpro')
+
+        n_workers: number of processes, default is the number of cpu, 1
+        fits everything in the current process
+
         Returns:
 
-        lmfit.fitresult
+        Pandas dataframe with one row per model (index model name) sorted
+        by criterion, with bic, aic, redchi, chisqr, nfev, success, the
+        parameters of every model and the error message of the fits that
+        failed (success False, NaN criterion, ranked last)
+
+        Raises ValueError when the curve has less than 3 valid points.
     """
-    return model.fit(data["Stress"], x=data["Shear rate"], weights=1 / data["Stress"])
+    import concurrent.futures
+
+    if models is None:
+        models = available_models()
+    models = [get_model(model) if isinstance(model, str) else model
+              for model in models]
+
+    transforms = curve_transforms(data["Shear rate"], data["Stress"])
+
+    jobs = [(model, transforms, method) for model in models]
+    if n_workers == 1 or len(jobs) == 1:
+        outcomes = [_fit_candidate(*job) for job in jobs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(n_workers) as executor:
+            outcomes = list(executor.map(_fit_candidate, *zip(*jobs)))
+
+    tables = []
+    for model, (success, result) in zip(models, outcomes):
+        if not success:
+            result = pd.DataFrame({"success": [False], "error": [result]},
+                                  index=[model.name])
+        tables.append(result)
+    table = pd.concat(tables, sort=False)
+    if criterion not in table.columns:
+        table[criterion] = np.nan
+    metrics = [column for column in
+               ("bic", "aic", "redchi", "chisqr", "nfev", "success", "error")
+               if column in table.columns]
+    table = table[metrics + [column for column in table.columns
+                             if column not in metrics]]
+    return table.sort_values(criterion, na_position="last")
 
 
 def plot_fit_fc(result, show_table=True):
@@ -472,6 +1210,8 @@ def plot_fit_fc(result, show_table=True):
 
         None and display plot on current ax
     """
+    import matplotlib.pyplot as plt
+    from IPython.display import display
 
     kwarg = {"yscale": "log", "xscale": "log"}
     result.plot_fit(ax_kws=kwarg, yerr=False)
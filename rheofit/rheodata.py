@@ -1,10 +1,16 @@
 import collections
+import collections.abc
+import concurrent.futures
+import copy
+import functools
 import os
 import io
-import xmltodict
+import xml.etree.ElementTree as ElementTree
 import pandas as pd
 import numpy as np
 
+from .cache import data_cache
+
 
 def example_emulsion():
     ''' 
@@ -128,6 +134,8 @@ def get_data_dict(data_name):
     '''
     parse xml file into dicionary
     '''
+    import xmltodict
+
     with open(data_name) as xml_file:
         try:
             xml_file.seek(0)
@@ -179,6 +187,335 @@ def dicttopanda(datadict):
     return pandalist
 
 
+def iter_rheoml(data_name, chunk_size=4096):
+    '''Stream the ExperimentalData blocks of a RheoML file as pandas tables
+
+    The file is parsed incrementally, the cells of the DMA/RVM rows are
+    collected per column and converted to float in chunks into preallocated
+    arrays. Rows are released as soon as they are read, so memory is bounded
+    by the size of one experiment.
+
+    Args:
+        data_name: path or binary file-like object of the RheoML file
+        chunk_size (int): number of rows converted to float at once
+
+    Yields:
+        pandas DataFrame for each ExperimentalData block, same content as
+        the tables returned by dicttopanda(get_data_dict(data_name))
+    '''
+    def _local(tag):
+        return tag.rsplit('}', 1)[-1]
+
+    columns = collections.OrderedDict()
+    pending = collections.OrderedDict()
+    nrows = 0
+    depth = 0
+    root = None
+
+    def _flush():
+        for name, texts in pending.items():
+            if not texts:
+                continue
+            values = np.asarray(texts, dtype='float')
+            column = columns[name]
+            if len(column) < nrows:
+                grown = np.full(max(nrows, 2 * len(column)), np.nan)
+                grown[:len(column)] = column
+                columns[name] = column = grown
+            column[nrows - len(values):nrows] = values
+            del texts[:]
+
+    for event, elem in ElementTree.iterparse(data_name,
+                                             events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if root is None:
+                root = elem
+            elif depth == 2 and _local(elem.tag) == 'ExperimentalData':
+                columns.clear()
+                pending.clear()
+                nrows = 0
+            continue
+
+        depth -= 1
+        tag = _local(elem.tag)
+
+        if depth == 2 and tag in ('DMA', 'RVM'):
+            cells = {_local(cell.tag): cell.text for cell in elem}
+            for name in cells:
+                if name not in columns:
+                    # new column, earlier rows are missing this cell
+                    columns[name] = np.full(max(chunk_size, nrows), np.nan)
+                    pending[name] = ['nan'] * (nrows % chunk_size)
+            for name in columns:
+                text = cells.get(name)
+                pending[name].append('nan' if text is None else text)
+            nrows += 1
+            if nrows % chunk_size == 0:
+                _flush()
+            elem.clear()
+
+        elif depth == 1 and tag == 'ExperimentalData':
+            _flush()
+            yield pd.DataFrame({name: column[:nrows]
+                                for name, column in columns.items()})
+            root.clear()
+
+
+def read_rheoml(data_name):
+    '''Read all the ExperimentalData blocks of a RheoML file
+
+    Streaming equivalent of dicttopanda(get_data_dict(data_name))
+
+    Returns:
+        list of pandas DataFrame
+    '''
+    return list(iter_rheoml(data_name))
+
+
+def _column_names(header):
+    '''Column names as pandas reads a header row (empty and duplicated names)'''
+    names = []
+    counts = {}
+    for position, name in enumerate(header):
+        if name is None or name == '':
+            name = 'Unnamed: ' + str(position)
+        if name in counts:
+            counts[name] += 1
+            name = str(name) + '.' + str(counts[name])
+        else:
+            counts[name] = 0
+        names.append(name)
+    return names
+
+
+def _float_cell(value):
+    '''Float value of a cell, NaN for empty cells'''
+    if value is None or value == '':
+        return np.nan
+    return float(value)
+
+
+def _decode_trios_sheet(book, table_name):
+    '''Read a trios multitab step sheet directly into float64 columns
+
+    Trios sheets hold the step name, the column names, the units and the
+    data rows. The cells are read from the workbook opened by pandas (xlrd
+    for xls, openpyxl for xlsx) column by column, without the object
+    DataFrame of ExcelFile.parse.
+
+    Returns:
+        DataFrame with the 'index' column (row number from 1) and the data
+        columns, units in attrs['units'] (column name -> unit)
+    '''
+    if hasattr(book, 'sheet_by_name'):
+        import xlrd
+
+        sheet = book.sheet_by_name(table_name)
+        if sheet.nrows < 3:
+            raise ValueError('sheet ' + table_name + ' has no data')
+        header = sheet.row_values(1)
+        units = sheet.row_values(2)
+        columns = []
+        for position in range(len(header)):
+            values = sheet.col_values(position, start_rowx=3)
+            if all(cell_type == xlrd.XL_CELL_NUMBER for cell_type in
+                   sheet.col_types(position, start_rowx=3)):
+                columns.append(np.array(values, dtype='float64'))
+            else:
+                columns.append(np.array([_float_cell(value) for value in values],
+                                        dtype='float64'))
+    else:
+        rows = list(book[table_name].iter_rows(min_row=2, values_only=True))
+        if len(rows) < 2:
+            raise ValueError('sheet ' + table_name + ' has no data')
+        header, units = rows[0], rows[1]
+        columns = [np.array([_float_cell(row[position]) for row in rows[2:]],
+                            dtype='float64')
+                   for position in range(len(header))]
+
+    names = _column_names(header)
+    nrows = len(columns[0]) if columns else 0
+    table = pd.DataFrame(dict(zip(['index'] + names,
+                                  [np.arange(1, nrows + 1, dtype='float64')]
+                                  + columns)),
+                         columns=['index'] + names)
+    table.attrs['units'] = {name: (unit if unit is not None else '')
+                            for name, unit in zip(names, units)}
+    return table
+
+
+def _parse_step(data_file_object, table_name, source):
+    '''Parse one step sheet of an excel file into a float DataFrame'''
+    if source == 'pandas_export_excel':
+        return data_file_object.parse(table_name).astype('float')
+    return _decode_trios_sheet(data_file_object.book, table_name)
+
+
+class lazy_steps(collections.abc.MutableMapping):
+    '''Ordered mapping step name -> step table parsed on first access
+
+    Used as rheology_data.data in lazy mode. Tables are memoized once parsed.
+    Steps that can not be parsed are reported, keep their key (and position)
+    and raise ValueError on access, the error is recorded in errors.
+
+    Attributes:
+        errors (dict): step name -> exception raised by the parser
+    '''
+
+    def __init__(self):
+        self._tables = collections.OrderedDict()
+        self._loaders = {}
+        self.errors = {}
+
+    def add_loader(self, name, loader):
+        '''Register a step, loader() is called to parse it when needed'''
+        self._tables[name] = None
+        self._loaders[name] = loader
+        self.errors.pop(name, None)
+
+    @property
+    def loaded(self):
+        '''Names of the steps already parsed'''
+        return [name for name in self._tables
+                if name not in self._loaders and name not in self.errors]
+
+    def _load(self, name):
+        '''Parse a step, a failure is reported and recorded in errors'''
+        loader = self._loaders.pop(name)
+        try:
+            self._tables[name] = loader()
+        except Exception as error:
+            print('step ' + name + ' not loaded')
+            self.errors[name] = error
+
+    def __getitem__(self, name):
+        if name in self._loaders:
+            self._load(name)
+        if name in self.errors:
+            raise ValueError('step ' + name + ' not loaded: '
+                             + repr(self.errors[name]))
+        return self._tables[name]
+
+    def __contains__(self, name):
+        # membership does not parse the step
+        return name in self._tables
+
+    def __setitem__(self, name, table):
+        self._tables[name] = table
+        self._loaders.pop(name, None)
+        self.errors.pop(name, None)
+
+    def __delitem__(self, name):
+        del self._tables[name]
+        self._loaders.pop(name, None)
+        self.errors.pop(name, None)
+
+    def __iter__(self):
+        return iter(list(self._tables))
+
+    def __len__(self):
+        return len(self._tables)
+
+    def items(self):
+        '''List of (step name, table), steps that fail to parse are skipped'''
+        items = []
+        for name in self:
+            if name in self._loaders:
+                self._load(name)
+            if name not in self.errors:
+                items.append((name, self._tables[name]))
+        return items
+
+    def values(self):
+        return [table for _, table in self.items()]
+
+    def update(self, other):
+        '''Add the steps of other, steps not yet parsed stay lazy'''
+        if isinstance(other, lazy_steps):
+            for name in other:
+                if name in other._loaders:
+                    self.add_loader(name, other._loaders[name])
+                elif name in other.errors:
+                    self[name] = None
+                    self.errors[name] = other.errors[name]
+                else:
+                    self[name] = other._tables[name]
+        else:
+            super().update(other)
+
+    def __repr__(self):
+        return ('lazy_steps(' + str(list(self)) + ', loaded='
+                + str(self.loaded) + ')')
+
+
+class flow_curve(object):
+    '''Compact flow curve: shear rate and stress arrays and metadata
+
+    Holds only the two columns read by the fitting functions, as contiguous
+    float64 arrays, in an object without instance dictionary (__slots__),
+    so that hundreds of thousands of curves fit in memory where as many
+    DataFrames would not. The metadata object is kept by reference and is
+    usually shared by all the curves of a file.
+
+    flow_curve['Shear rate'] and flow_curve['Stress'] return the arrays, so
+    a flow_curve can be passed wherever a DataFrame with these columns is
+    expected (rheofit.models.fit_FC, rheofit.batch.fit_FC_batch, ...).
+
+    Args:
+        shear_rate: shear rate values [1/s]
+        stress: stress values [Pa]
+        name (str): step name
+        metadata: any object (e.g. dict with filename and instrument)
+    '''
+    __slots__ = ('shear_rate', 'stress', 'name', 'metadata')
+
+    columns = ('Shear rate', 'Stress')
+
+    def __init__(self, shear_rate, stress, name=None, metadata=None):
+        self.shear_rate = np.ascontiguousarray(shear_rate, dtype='float64')
+        self.stress = np.ascontiguousarray(stress, dtype='float64')
+        if self.shear_rate.shape != self.stress.shape:
+            raise ValueError('shear rate and stress have different shapes')
+        self.name = name
+        self.metadata = metadata
+
+    @classmethod
+    def from_frame(cls, table, name=None, metadata=None):
+        '''Flow curve from the 'Shear rate' and 'Stress' columns of a table
+
+        The arrays are views of the DataFrame columns when they are already
+        contiguous float64 (no copy), they keep the table data alive.
+        '''
+        return cls(table['Shear rate'].to_numpy(), table['Stress'].to_numpy(),
+                   name=name, metadata=metadata)
+
+    def to_frame(self):
+        '''DataFrame with columns 'Shear rate' and 'Stress' sharing the arrays'''
+        return pd.DataFrame({'Shear rate': self.shear_rate,
+                             'Stress': self.stress}, copy=False)
+
+    def __getitem__(self, column):
+        if column == 'Shear rate':
+            return self.shear_rate
+        if column == 'Stress':
+            return self.stress
+        raise KeyError(column)
+
+    def __len__(self):
+        return len(self.stress)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return 'flow_curve({!r}, {} points)'.format(self.name, len(self))
+
+
 class rheology_data(object):
     '''Container for rheology data from trios rheometer software.
 
@@ -197,158 +534,233 @@ class rheology_data(object):
 
     '''
 
-    def __init__(self, filename, source='trios_multitab_xls'):
+    def __init__(self, filename, source='trios_multitab_xls', cache=None,
+                 lazy=False):
         '''
         Assuming Shear stress label 'Stress' And Shear rate label 'Shear rate'
         Args:
             filename (str): name of data file
             source (str): Options 'trios_multitab_xls' (default), 'pandas_export_excel'
+            cache: None (default, no cache), True for the default
+                rheofit.cache.data_cache or a data_cache instance. Parsed
+                files are stored by content hash and loaded without Excel
+                parsing the next time.
+            lazy (bool): read only sheet names and Details at construction,
+                each step table is parsed on first access (see lazy_steps).
+                Lazy loads are not stored in the cache.
         '''
-        if source == 'trios_multitab_xls':
+        if cache is True:
+            cache = data_cache()
+        elif cache is False:
+            cache = None
+
+        if cache is not None:
+            cache_key = cache.key(filename, source)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                self.__dict__.update(cached)
+                if source != 'file_like_object':
+                    self.filename = str(filename)
+                return
+
+        self._parse(filename, source, lazy=lazy)
+
+        if cache is not None and not lazy:
+            cache.put(cache_key, self.__dict__)
+
+    def _parse(self, filename, source, lazy=False):
+        '''Load data and metadata from the file (see __init__)'''
+        if source == 'trios_multitab_xls' or source == 'pandas_export_excel':
             self.filename = str(filename)
+        elif source == 'file_like_object':
+            self.filename = 'from filelike object'
+        else:
+            raise ValueError('''data not loaded''')
 
-            data_file_object = pd.ExcelFile(filename)
-            table_name_list = data_file_object.sheet_names
+        data_file_object = pd.ExcelFile(filename)
+        table_name_list = data_file_object.sheet_names
 
+        if lazy:
+            self.data = lazy_steps()
+        else:
             self.data = collections.OrderedDict()
 
-            for table_name in table_name_list:
-                if table_name == 'Details':
+        for table_name in table_name_list:
+            if table_name == 'Details':
+                if source == 'pandas_export_excel':
                     self.Details = pd.read_excel(data_file_object,
-                                                 sheet_name='Details',
-                                                 header=None,
-                                                 names=['key', 'value']).set_index('key')
-
-                    try:
-                        sample_notes = [self.Details.loc['Sample notes'].value]
-
-                        for key, value in self.Details.iloc[self.Details.index.get_loc('Sample notes')+1:self.Details.index.get_loc('Geometry name')].iterrows():
-                            sample_notes.append(key)
-
-                        sample_notes = [
-                            x for x in sample_notes if str(x) != 'nan']
-                        self.sample_notes = sample_notes
-                    except:
-                        self.sample_notes = ''
-
-                    try:
-                        self.instrument_serial = self.Details.loc['Instrument serial number'].value
-                    except:
-                        self.instrument_serial = ''
+                                                 sheet_name=table_name)
+                else:
+                    self._parse_details(data_file_object)
 
+            else:
+                loader = functools.partial(_parse_step, data_file_object,
+                                           table_name, source)
+                if lazy:
+                    self.data.add_loader(table_name, loader)
+                else:
                     try:
-                        self.geometry_name = self.Details.loc['Geometry name'].value
+                        self.data[table_name] = loader()
                     except:
-                        self.geometry_name = ''
+                        print('step ' + table_name + ' not loaded')
 
-                    try:
-                        self.instrument_type = self.Details.loc['Instrument type'].value
-                    except:
-                        self.instrument_type = ''
+    def _parse_details(self, data_file_object):
+        '''Read the Details sheet of a trios export and the main metadata'''
+        self.Details = pd.read_excel(data_file_object,
+                                     sheet_name='Details',
+                                     header=None,
+                                     names=['key', 'value']).set_index('key')
 
-                    try:
-                        self.run_date = self.Details.loc['Run date'].value
-                    except:
-                        self.run_date = None
+        try:
+            sample_notes = [self.Details.loc['Sample notes'].value]
 
-                else:
-                    try:
-                        self.data[table_name] = data_file_object.parse(
-                            table_name, skiprows=1).drop(0).reset_index().astype('float')
-                    except:
-                        print('step ' + table_name + ' not loaded')
+            for key, value in self.Details.iloc[self.Details.index.get_loc('Sample notes')+1:self.Details.index.get_loc('Geometry name')].iterrows():
+                sample_notes.append(key)
 
-        elif source == 'pandas_export_excel':
-            self.filename = str(filename)
+            sample_notes = [
+                x for x in sample_notes if str(x) != 'nan']
+            self.sample_notes = sample_notes
+        except:
+            self.sample_notes = ''
 
-            data_file_object = pd.ExcelFile(filename)
-            table_name_list = data_file_object.sheet_names
+        try:
+            self.instrument_serial = self.Details.loc['Instrument serial number'].value
+        except:
+            self.instrument_serial = ''
 
-            self.data = collections.OrderedDict()
+        try:
+            self.geometry_name = self.Details.loc['Geometry name'].value
+        except:
+            self.geometry_name = ''
 
-            for table_name in table_name_list:
-                if table_name == 'Details':
-                    self.Details = pd.read_excel(data_file_object,
-                                                 sheet_name=table_name)
-                else:
-                    try:
-                        self.data[table_name] = data_file_object.parse(
-                            table_name).astype('float')
-                    except:
-                        print('step ' + table_name + ' not loaded')
+        try:
+            self.instrument_type = self.Details.loc['Instrument type'].value
+        except:
+            self.instrument_type = ''
 
-        elif source == 'file_like_object':
-            self.filename = 'from filelike object'
+        try:
+            self.run_date = self.Details.loc['Run date'].value
+        except:
+            self.run_date = None
 
-            data_file_object = pd.ExcelFile(filename)
-            table_name_list = data_file_object.sheet_names
+    @property
+    def units(self):
+        '''Units of the step columns, step name -> {column name: unit}
 
-            self.data = collections.OrderedDict()
+        Read from the units row of the trios sheets, empty for the other
+        sources. In lazy mode only the steps already parsed are listed, so
+        reading the units never parses a sheet.
+        '''
+        if isinstance(self.data, lazy_steps):
+            steps = [(name, self.data[name]) for name in self.data.loaded]
+        else:
+            steps = self.data.items()
+        return collections.OrderedDict(
+            (name, dict(table.attrs.get('units', {})))
+            for name, table in steps)
 
-            for table_name in table_name_list:
-                if table_name == 'Details':
-                    self.Details = pd.read_excel(data_file_object,
-                                                 sheet_name='Details',
-                                                 header=None,
-                                                 names=['key', 'value']).set_index('key')
+    @property
+    def tidy(self):
+        return self.tidy_table()
 
-                    try:
-                        sample_notes = [self.Details.loc['Sample notes'].value]
+    def tidy_table(self, categorical=False):
+        '''All steps in one long table with Stepnum, stepname and filename columns
 
-                        for key, value in self.Details.iloc[self.Details.index.get_loc('Sample notes')+1:self.Details.index.get_loc('Geometry name')].iterrows():
-                            sample_notes.append(key)
+        The step tables in self.data are not modified.
 
-                        sample_notes = [
-                            x for x in sample_notes if str(x) != 'nan']
-                        self.sample_notes = sample_notes
-                    except:
-                        self.sample_notes = ''
+        Args:
+            categorical (bool): store stepname and filename as pandas
+                Categorical (one code per row instead of one string per row)
 
-                    try:
-                        self.instrument_serial = self.Details.loc['Instrument serial number'].value
-                    except:
-                        self.instrument_serial = ''
+        Returns:
+            pandas DataFrame
+        '''
+        steps = list(self.data.items())
+        if not steps:
+            return pd.DataFrame(columns=['Stepnum', 'stepname', 'filename'])
+
+        names = [name for name, _ in steps]
+        lengths = [len(table) for _, table in steps]
+        fulldata = pd.concat([table for _, table in steps],
+                             ignore_index=True, sort=False)
+
+        stepnum = np.repeat(np.arange(len(steps)), lengths)
+        fulldata['Stepnum'] = stepnum
+        if categorical:
+            fulldata['stepname'] = pd.Categorical.from_codes(
+                stepnum, categories=names)
+            fulldata['filename'] = pd.Categorical.from_codes(
+                np.zeros(len(fulldata), dtype='int8'),
+                categories=[self.filename])
+        else:
+            fulldata['stepname'] = np.repeat(np.array(names, dtype=object),
+                                             lengths)
+            fulldata['filename'] = self.filename
+        return fulldata
 
-                    try:
-                        self.geometry_name = self.Details.loc['Geometry name'].value
-                    except:
-                        self.geometry_name = ''
+    def flow_curves(self, copy=True):
+        '''Steps with 'Shear rate' and 'Stress' columns as flow_curve
 
-                    try:
-                        self.instrument_type = self.Details.loc['Instrument type'].value
-                    except:
-                        self.instrument_type = ''
+        All the curves share one metadata dictionary (filename,
+        sample_notes, instrument_type, geometry_name, run_date).
 
-                    try:
-                        self.run_date = self.Details.loc['Run date'].value
-                    except:
-                        self.run_date = None
+        Args:
+            copy (bool): copy the two columns (default), so that the step
+                tables can be released, False for views of the tables
 
-                else:
-                    try:
-                        self.data[table_name] = data_file_object.parse(
-                            table_name, skiprows=1).drop(0).reset_index().astype('float')
-                    except:
-                        print('step ' + table_name + ' not loaded')
+        Returns:
+            OrderedDict step name -> flow_curve
+        '''
+        metadata = {'filename': self.filename}
+        for key in ('sample_notes', 'instrument_type', 'geometry_name',
+                    'run_date'):
+            if hasattr(self, key):
+                metadata[key] = getattr(self, key)
+
+        curves = collections.OrderedDict()
+        for name, table in self.data.items():
+            if 'Shear rate' not in table.columns or 'Stress' not in table.columns:
+                continue
+            curve = flow_curve.from_frame(table, name=name, metadata=metadata)
+            if copy:
+                curve.shear_rate = curve.shear_rate.copy()
+                curve.stress = curve.stress.copy()
+            curves[name] = curve
+        return curves
+
+    def fit_flow_curves(self, model, residual='linear', cache=None):
+        '''Fit every step with 'Shear rate' and 'Stress' columns
+
+        With a fit cache, fitting again after adding steps (see __add__)
+        only fits the new steps. Steps that can not be fitted are reported
+        and their result is None.
 
-        else:
-            raise ValueError('''data not loaded''')
+        Args:
+            model: rheology model (e.g. rheofit.models.HB_model)
+            residual: 'linear' or 'log' residuals (see
+                rheofit.models.fit_FC)
+            cache: rheofit.cache.fit_cache or None
 
-    @property
-    def tidy(self):
-        for (stepnum, stepdata) in enumerate(self):
-            stepdata[1]['Stepnum'] = stepnum
-            stepdata[1]['stepname'] = stepdata[0]
-            stepdata[1]['filename'] = self.filename
-            if stepnum == 0:
-                fulldata = stepdata[1]
-            else:
-                fulldata = pd.concat(
-                    [fulldata, stepdata[1]], ignore_index=True, sort=False)
-        return fulldata
+        Returns:
+            OrderedDict step name -> lmfit.fitresult
+        '''
+        from . import models
+
+        results = collections.OrderedDict()
+        for name, curve in self.flow_curves(copy=False).items():
+            try:
+                results[name] = models.fit_FC(model, curve, residual=residual,
+                                              cache=cache)
+            except Exception as error:
+                print('step ' + str(name) + ' not fitted: ' + repr(error))
+                results[name] = None
+        return results
 
     def __getitem__(self, i):
-        return list(self.data.items())[i]
+        names = list(self.data.keys())[i]
+        if isinstance(i, slice):
+            return [(name, self.data[name]) for name in names]
+        return names, self.data[names]
 
     def __repr__(self):
         if self.filename is None:
@@ -358,26 +770,106 @@ class rheology_data(object):
         return ret_string
 
     def __add__(self, other):
+        if (isinstance(other.data, lazy_steps)
+                and not isinstance(self.data, lazy_steps)):
+            # keep the steps of other unparsed
+            data = lazy_steps()
+            data.update(self.data)
+            self.data = data
         self.data.update(other.data)
         return self
 
 
-class data_package(object):
-    def __init__(self, data_path, exp_files_dict=None, procedure=None):
+def _concat_rheology_data(data_list):
+    '''Append the steps of a list of rheology_data to the first one'''
+    result = data_list[0]
+    for item in data_list[1:]:
+        result += item
+    return result
+
+
+def _load_package_item(source, filepath):
+    '''Load one item of a data_package
+
+    Args:
+        source (str): 'Trios' (one file per item) or 'Advantage' (list of
+            files per item, steps are concatenated)
+        filepath: file path or list of file paths
+    '''
+    if source == 'Advantage':
+        return _concat_rheology_data(
+            [rheology_data(item) for item in filepath])
+    return rheology_data(filepath)
+
+
+def _select_step(data, step=None):
+    '''Return (step name, step table) from a rheology_data
+
+    Args:
+        data (rheology_data)
+        step: step name (str), step index (int) or None for the first flow
+            step ('Flow' in the step name) with 'Shear rate' and 'Stress'
+            columns
+    '''
+    if step is None:
+        for name, table in data.data.items():
+            if ('flow' in name.lower() and 'Shear rate' in table.columns
+                    and 'Stress' in table.columns):
+                return name, table
+        raise ValueError('no flow curve step in ' + str(data))
+    if isinstance(step, str):
+        return step, data.data[step]
+    return data[step]
+
 
+def _apply_procedure(procedure, source, filepath):
+    '''Worker for data_package.map, errors are returned instead of raised'''
+    try:
+        return True, procedure(_load_package_item(source, filepath))
+    except Exception as error:
+        return False, repr(error)
+
+
+def _fit_step(model, step, data, residual='linear', cache=None):
+    '''Procedure used by data_package.fit_all'''
+    from . import models
+
+    step_name, table = _select_step(data, step)
+    result = models.show_parameter_table(
+        models.fit_FC(model, table, residual=residual, cache=cache))
+    result['step'] = step_name
+    return result
+
+
+def _step_table(step, data):
+    '''Procedure used by data_package.fit_series'''
+    return _select_step(data, step)
+
+
+class data_package(object):
+    def __init__(self, data_path, exp_files_dict=None, procedure=None,
+                 recursive=False):
+        '''
+        Args:
+            data_path (str): folder of the trios multitab exports
+            exp_files_dict (dict): {name: list of file paths} of Advantage
+                experiments exported as several files (data_path is unused)
+            procedure: function applied to each loaded item by __getitem__
+            recursive (bool): include the files in the subfolders of
+                data_path (names are the paths relative to data_path)
+        '''
         self.procedure = procedure
 
         if exp_files_dict is None:
             self.source = 'Trios'
-            filelist = [item for item in os.listdir(
-                data_path) if '.xls' in item]
+            from .catalog import find_files
 
             data_dict = {}
-            for file in filelist:
-                data_dict[file] = data_path + file
+            for filepath in find_files(data_path, recursive=recursive,
+                                       extensions=('.xls', '.xlsx')):
+                data_dict[os.path.relpath(filepath, data_path)] = filepath
 
             self.data_dict = data_dict
-            self._len = len(data_dict)
 
         elif isinstance(exp_files_dict, dict):
             self.source = 'Advantage'
@@ -391,36 +883,441 @@ class data_package(object):
 
     def __getitem__(self, index):
 
-        def _concat_rheology_data(list):
-            result = list[0]
-            for item in list[1:]:
-                result += item
-            return result
-
         if isinstance(index, slice):
             return [self[ii] for ii in range(*index.indices(len(self)))]
 
         elif isinstance(index, int):
-            if self.procedure is not None:
-                if self.source == 'Trios':
-                    return self.procedure(
-                        rheology_data(self.data_table.iloc[index]['filepath']))
-                if self.source == 'Advantage':
-                    return self.procedure(
-                        _concat_rheology_data(
-                            [rheology_data(item) for item in
-                             self.data_table.iloc[index]['filepath']]))
+            return self._load_item(list(self.data_dict.values())[index])
+
+    def _load_item(self, filepath):
+        '''Load one item and apply procedure'''
+        data = _load_package_item(self.source, filepath)
+        if self.procedure is not None:
+            return self.procedure(data)
+        return data
 
+    def __len__(self):
+        return len(self.data_dict)
+
+    def __iter__(self):
+        return self.iterate()
+
+    def iterate(self, prefetch=2, n_threads=None):
+        '''Iterate over the items, loading the next ones in background threads
+
+        While the current item is processed, up to prefetch following items
+        are loaded (and procedure applied) in threads, so parsing and
+        processing overlap. At most prefetch items are held in memory
+        besides the current one.
+
+        Args:
+            prefetch (int): number of items loaded ahead, 0 loads every item
+                when it is reached (no threads)
+            n_threads (int): number of loading threads, default prefetch
+
+        Yields:
+            items in the order of data_table (as __getitem__), the error of
+            an item that can not be loaded is raised when it is reached
+        '''
+        # one pass over data_dict, indexing items one by one is O(n) each
+        filepaths = list(self.data_dict.values())
+        if prefetch < 1:
+            for filepath in filepaths:
+                yield self._load_item(filepath)
+            return
+
+        executor = concurrent.futures.ThreadPoolExecutor(n_threads or prefetch)
+        pending = collections.deque()
+        try:
+            for filepath in filepaths:
+                pending.append(executor.submit(self._load_item, filepath))
+                if len(pending) > prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def _filepaths(self, name):
+        '''List of the file paths of an item'''
+        filepath = self.data_dict[name]
+        return list(filepath) if self.source == 'Advantage' else [filepath]
+
+    def metadata_table(self, catalog=None):
+        '''Metadata of the files from the catalog, without parsing Excel
+
+        The catalog is updated first (only new or modified files are read).
+
+        Args:
+            catalog: rheofit.catalog.data_catalog, default the catalog in
+                the cache folder
+
+        Returns:
+            Pandas dataframe with one row per file (index filename) and the
+            columns of the catalog files table
+        '''
+        from .catalog import data_catalog
+
+        catalog = catalog if catalog is not None else data_catalog()
+        paths = [os.path.abspath(path) for name in self.data_dict
+                 for path in self._filepaths(name)]
+        catalog.update(paths, prune=False)
+        table = catalog.select(paths=paths).set_index('path')
+        names = {os.path.abspath(path): name for name in self.data_dict
+                 for path in self._filepaths(name)}
+        table.index = [names[path] for path in table.index]
+        table.index.name = 'filename'
+        return table
+
+    def select(self, catalog=None, **conditions):
+        '''New data_package with the files matching conditions
+
+        The selection uses the metadata catalog (see
+        rheofit.catalog.data_catalog.select for the conditions, e.g.
+        geometry_name, after, before, step, sample_notes). An Advantage
+        experiment is selected when one of its files matches.
+
+        Args:
+            catalog: rheofit.catalog.data_catalog, default the catalog in
+                the cache folder
+
+        Returns:
+            data_package
+        '''
+        from .catalog import data_catalog
+
+        catalog = catalog if catalog is not None else data_catalog()
+        paths = [os.path.abspath(path) for name in self.data_dict
+                 for path in self._filepaths(name)]
+        catalog.update(paths, prune=False)
+        selected = set(catalog.select(paths=paths, **conditions)['path'])
+
+        package = copy.copy(self)
+        package.data_dict = {
+            name: filepath for name, filepath in self.data_dict.items()
+            if any(os.path.abspath(path) in selected
+                   for path in self._filepaths(name))}
+        return package
+
+    def map(self, procedure, n_workers=None):
+        '''Load every item and apply procedure, in parallel processes
+
+        Files that can not be loaded or processed are reported and
+        the corresponding result is None, the other items are not affected.
+
+        Args:
+            procedure: function accepting a rheology_data, it must be
+                picklable (defined at module level)
+            n_workers (int): number of processes, default is the number of
+                cpu, 1 runs everything in the current process
+
+        Returns:
+            list of procedure results in the order of data_table
+        '''
+        filepaths = list(self.data_table['filepath'])
+        jobs = [(procedure, self.source, filepath) for filepath in filepaths]
+
+        if n_workers == 1:
+            outcomes = [_apply_procedure(*job) for job in jobs]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(n_workers) as executor:
+                outcomes = list(executor.map(_apply_procedure, *zip(*jobs)))
+
+        self.errors = {}
+        results = []
+        for filename, (success, result) in zip(self.data_table['filename'],
+                                               outcomes):
+            if success:
+                results.append(result)
             else:
-                if self.source == 'Trios':
-                    return rheology_data(self.data_table.iloc[index]['filepath'])
-                if self.source == 'Advantage':
-                    return self._concat_rheology_data(
-                        [rheology_data(item) for item in
-                         self.data_table.iloc[index]['filepath']])
+                print('file ' + str(filename) + ' not processed: ' + result)
+                self.errors[filename] = result
+                results.append(None)
+        return results
+
+    def fit_all(self, model, step=None, n_workers=None, residual='linear',
+                cache=None):
+        '''Fit the same flow curve step of every file with model
+
+        Args:
+            model: rheology model (e.g. rheofit.models.HB_model)
+            step: step name (str), step index (int) or None for the first
+                flow step with 'Shear rate' and 'Stress' columns
+            n_workers (int): number of processes (see map)
+            residual: 'linear' or 'log' residuals (see
+                rheofit.models.fit_FC)
+            cache: rheofit.cache.fit_cache, only the files not fitted before
+                are fitted again (the worker processes share the disk
+                entries of the cache only, use n_workers=1 with a memory
+                cache)
+
+        Returns:
+            Pandas dataframe with one row per file (index filename), the
+            columns of rheofit.models.show_parameter_table, the fitted step
+            and the error message for the files that failed
+        '''
+        results = self.map(functools.partial(_fit_step, model, step,
+                                             residual=residual, cache=cache),
+                           n_workers=n_workers)
+
+        tables = []
+        for filename, result in zip(self.data_table['filename'], results):
+            if result is None:
+                result = pd.DataFrame({'error': [self.errors[filename]]})
+            tables.append(result.assign(filename=filename))
+        return pd.concat(tables, sort=False).set_index('filename')
+
+    def fit_series(self, model, step=None, order=None, fallback=True,
+                   n_workers=None, residual='linear', cache=None):
+        '''Fit the files as an ordered series, warm starting every fit
+
+        Each flow curve fit starts from the best fit parameters of the
+        previous file (see rheofit.models.fit_FC_series), files are loaded
+        in parallel (see map).
+
+        Args:
+            model: rheology model (e.g. rheofit.models.HB_model)
+            step: step name (str), step index (int) or None for the first
+                flow step with 'Shear rate' and 'Stress' columns
+            order: list of filenames or key function of the filename giving
+                the order of the series, default sorted filenames
+            fallback (bool): refit from the default starting values when the
+                warm started fit diverges
+            n_workers (int): number of processes used to load the files
+            residual: 'linear' or 'log' residuals (see
+                rheofit.models.fit_FC)
+            cache: rheofit.cache.fit_cache of the fits
+
+        Returns:
+            Pandas dataframe with one row per file (index filename) in the
+            series order, the columns of rheofit.models.show_parameter_table,
+            the fitted step, the number of function evaluations, whether the
+            fit was warm started and the error message for the files that
+            failed
+        '''
+        from . import models
+
+        filenames = list(self.data_table['filename'])
+        if order is None:
+            filenames = sorted(filenames)
+        elif callable(order):
+            filenames = sorted(filenames, key=order)
+        else:
+            filenames = list(order)
+
+        steps = dict(zip(self.data_table['filename'],
+                         self.map(functools.partial(_step_table, step),
+                                  n_workers=n_workers)))
+        loaded = [filename for filename in filenames
+                  if steps[filename] is not None]
+        results = models.fit_FC_series(
+            model, {filename: steps[filename][1] for filename in loaded},
+            fallback=fallback, residual=residual, cache=cache)
+
+        tables = []
+        for filename in filenames:
+            if steps[filename] is None:
+                tables.append(pd.DataFrame({'error': [self.errors[filename]],
+                                            'filename': [filename]}))
+                continue
+            result = results[filename]
+            tables.append(models.show_parameter_table(result).assign(
+                step=steps[filename][0], nfev=result.nfev,
+                warm_start=result.warm_start, filename=filename))
+        return pd.concat(tables, sort=False).set_index('filename')
+
+
+# factor converting a unit of the digitized data files to s-1 or Pa,
+# scaled units ('0.158s-1') are the reduced units of a publication
+unit_factors = {
+    's-1': 1.0,
+    '1/s': 1.0,
+    'Pa': 1.0,
+    'kPa': 1e3,
+    'mPa': 1e-3,
+    'dynes/cm2': 0.1,
+    'dyn/cm2': 0.1,
+    '0.158s-1': 1 / 0.158,
+    '0.0825Pa': 0.0825,
+}
+
+
+def _read_paired_csv(filename):
+    '''Labels and (points, 2 * curves) values of a digitized csv file
+
+    The first line holds one label per x, y pair of columns, an optional
+    second line the 'X,Y' column names (WebPlotDigitizer export). Shorter
+    columns are padded with NaN.
+    '''
+    with open(filename, encoding='utf-8-sig') as file:
+        lines = file.read().splitlines()
+    labels = lines[0].split(',')[::2]
+    start = 1
+    if len(lines) > 1 and lines[1].split(',')[0].strip().upper() == 'X':
+        start = 2
+    rows = [line.split(',') for line in lines[start:] if line.strip()]
+    width = max((len(row) for row in rows), default=0)
+    values = np.array([[float(value) if value.strip() else np.nan
+                        for value in row] + [np.nan] * (width - len(row))
+                       for row in rows], dtype='float64')
+    values = values.reshape(len(rows), width)
+    ncurves = min(values.shape[1] // 2, len(labels))
+    return [label.strip() for label in labels[:ncurves]], values[:, :2 * ncurves]
+
+
+def _filename_units(stem):
+    '''(x label, y label, x unit, y unit) of the digitized data naming
+    convention DOI_fig#_xlabel_ylabel_xunits_yunits, None if not followed'''
+    parts = stem.split('_')
+    if len(parts) < 6:
+        return None
+    return tuple(parts[-4:])
+
+
+def _read_yaml_metadata(directories):
+    '''Entries of the yml files of the directories, by dataset name'''
+    metadata = {}
+    for directory in directories:
+        filenames = sorted(item for item in os.listdir(directory)
+                           if item.endswith(('.yml', '.yaml')))
+        if not filenames:
+            continue
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError(
+                'reading the metadata file ' + filenames[0] + ' of '
+                + directory + ' requires PyYAML (pip install pyyaml)') from None
+
+        for filename in filenames:
+            with open(os.path.join(directory, filename)) as file:
+                content = yaml.load(file, Loader=getattr(
+                    yaml, 'CSafeLoader', yaml.SafeLoader)) or {}
+            metadata.update({str(key): value for key, value in content.items()
+                             if isinstance(value, dict)})
+    return metadata
+
+
+class digitized_data(object):
+    '''Flow curves digitized from publications, in long form
+
+    Attributes:
+        table: Pandas dataframe with one row per point, columns 'dataset'
+            (file name without extension), 'curve' (column label, e.g. the
+            volume fraction), 'Shear rate' [1/s] and 'Stress' [Pa], ready
+            for rheofit.batch.fit_FC_batch(model, table, by=['dataset',
+            'curve'])
+        datasets: Pandas dataframe with one row per file (index dataset),
+            path, units, conversion factors and the entries of the yml
+            metadata files
+    '''
+
+    def __init__(self, table, datasets, counts):
+        self.table = table
+        self.datasets = datasets
+        self._counts = counts
+
+    def flow_curves(self):
+        '''OrderedDict (dataset, curve) -> flow_curve (views of the table)'''
+        bounds = np.cumsum(self._counts)[:-1]
+        xs = np.split(self.table['Shear rate'].to_numpy(), bounds)
+        ys = np.split(self.table['Stress'].to_numpy(), bounds)
+        starts = np.concatenate([[0], bounds]).astype(int)
+        datasets = self.table['dataset'].to_numpy()[starts]
+        curves = self.table['curve'].to_numpy()[starts]
+        return collections.OrderedDict(
+            ((dataset, curve),
+             flow_curve(x, y, name=curve, metadata={'dataset': dataset}))
+            for dataset, curve, x, y in zip(datasets, curves, xs, ys))
 
     def __len__(self):
-        return self._len
+        return len(self._counts)
+
+    def __repr__(self):
+        return 'digitized_data({} datasets, {} curves, {} points)'.format(
+            len(self.datasets), len(self), len(self.table))
+
+
+def read_digitized(paths, recursive=True, unit_x=None, unit_y=None,
+                   units=None):
+    '''Load csv files of digitized flow curves with paired x, y columns
+
+    Units come from (in order of priority) the unit_x and unit_y arguments,
+    the unit_x and unit_y entries of the dataset in a yml file of the same
+    folder (e.g. data/Manon/data_from_litterature.yml), the file name
+    convention DOI_fig#_xlabel_ylabel_xunits_yunits.csv, or default to s-1
+    and Pa. All the files are converted together after reading. Reading yml
+    files requires PyYAML (optional dependency, pip install rheofit[digitized]).
+
+    Args:
+        paths: csv file, folder or list of files and folders
+        recursive (bool): include the files of the subfolders
+        unit_x, unit_y (str): units of all the files
+        units (dict): additional unit conversion factors (see
+            unit_factors)
+
+    Returns:
+        digitized_data
+    '''
+    from .catalog import find_files
+
+    factors = dict(unit_factors, **(units or {}))
+    filenames = find_files(paths, recursive=recursive, extensions=('.csv',))
+    metadata = _read_yaml_metadata(sorted({os.path.dirname(filename)
+                                          for filename in filenames}))
+
+    rows, blocks, counts, labels = [], [], [], []
+    for filename in filenames:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        entry = dict(metadata.get(name, {}))
+        from_name = _filename_units(name)
+        if from_name is not None:
+            entry.setdefault('x_label', from_name[0])
+            entry.setdefault('y_label', from_name[1])
+        row = dict(entry, dataset=name, path=filename,
+                   unit_x=unit_x or entry.get('unit_x')
+                   or (from_name[2] if from_name else 's-1'),
+                   unit_y=unit_y or entry.get('unit_y')
+                   or (from_name[3] if from_name else 'Pa'))
+        for axis in ('unit_x', 'unit_y'):
+            if row[axis] not in factors:
+                raise ValueError('unknown unit ' + repr(row[axis]) + ' in '
+                                 + filename + ', add it to units')
+        row['factor_x'] = factors[row['unit_x']]
+        row['factor_y'] = factors[row['unit_y']]
+
+        curve_labels, values = _read_paired_csv(filename)
+        # (curves, points, 2): x and y of every curve
+        pairs = values.reshape(len(values), -1, 2).transpose(1, 0, 2)
+        mask = np.isfinite(pairs).all(axis=2)
+        blocks.append(pairs[mask])
+        counts.append(mask.sum(axis=1))
+        labels.extend(curve_labels)
+        row['curves'] = len(curve_labels)
+        rows.append(row)
+
+    columns = ['dataset', 'curve', 'Shear rate', 'Stress']
+    if not rows:
+        return digitized_data(pd.DataFrame(columns=columns),
+                              pd.DataFrame(index=pd.Index([], name='dataset')),
+                              np.zeros(0, dtype=int))
+    datasets = pd.DataFrame(rows).set_index('dataset')
+    counts = np.concatenate(counts)
+    points = np.concatenate(blocks)
+
+    # file of every point, then a single multiplication converts all units
+    point_file = np.repeat(np.repeat(np.arange(len(rows)), datasets['curves']),
+                           counts)
+    points = points * datasets[['factor_x', 'factor_y']].to_numpy()[point_file]
+
+    table = pd.DataFrame({
+        'dataset': datasets.index.to_numpy()[point_file],
+        'curve': np.repeat(np.array(labels, dtype=object), counts),
+        'Shear rate': points[:, 0],
+        'Stress': points[:, 1]}, columns=columns)
+    return digitized_data(table, datasets, counts)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+Module for storing fit results on disk
+--------------------------------------
+
+Collecting the results of a measurement campaign by reading the whole
+results table, appending a row and writing it back costs a full rewrite per
+sample and loses rows when two processes do it at the same time.
+
+:class:`rheofit.store.results_store` is a folder of immutable part files.
+Every append writes a new part (a small header with the number of rows and
+the range or the values of each column, followed by the table) to a
+temporary file and renames it in place, so appends never touch existing
+data and any number of processes can append concurrently. Reads only load
+the parts whose header can match the requested values.
+
+:meth:`results_store.compact` and :meth:`results_store.delete` rewrite
+parts: they hold a lock file, and the new part lists the parts it replaces
+in its header, so readers never see both the old and the new rows.
+
+Example:
+
+        store = rheofit.store.results_store('fits')
+        store.append(result, sample_ID=12, temperature=20)
+        store.read(sample_ID=12, temperature=[20, 25])
+
+"""
+import contextlib
+import os
+import pickle
+import tempfile
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# bump when the layout of the part files changes
+_STORE_VERSION = 1
+
+# columns with more distinct values only store their range in the header
+_MAX_HEADER_VALUES = 64
+
+# seconds compact and delete wait for the lock of another process
+_LOCK_TIMEOUT = 60
+
+
+def result_row(result, **metadata):
+    """ Flat dictionary of a fit result, one row of a results_store
+
+        Args:
+
+        result: lmfit.fitresult
+
+        metadata: additional columns (e.g. sample_ID, temperature)
+
+        Returns:
+
+        dict with the model name, the parameter values, their standard errors
+        (<name>_stderr), the fit statistics and the metadata
+    """
+    row = {"model": result.model.name}
+    for name, par in result.params.items():
+        row[name] = par.value
+        row[name + "_stderr"] = np.nan if par.stderr is None else par.stderr
+    for name in ("chisqr", "redchi", "aic", "bic", "ndata", "nfev", "success"):
+        row[name] = getattr(result, name, None)
+    row.update(metadata)
+    return row
+
+
+def _table(rows, metadata):
+    """DataFrame of fit results, dictionaries or a DataFrame"""
+    if isinstance(rows, pd.DataFrame):
+        return rows.assign(**metadata).reset_index(drop=True)
+    if isinstance(rows, dict) or hasattr(rows, "params"):
+        rows = [rows]
+    return pd.DataFrame([result_row(row, **metadata) if hasattr(row, "params")
+                         else dict(row, **metadata) for row in rows])
+
+
+def _summary(values):
+    """Header entry of a column: set of values, (min, max) range or None"""
+    if values.dtype.kind in "biuf":
+        if values.dtype.kind == "f":
+            values = values[~np.isnan(values)]
+        unique = np.unique(values)
+        if len(unique) <= _MAX_HEADER_VALUES:
+            return ("values", set(unique.tolist()))
+        return ("range", (unique[0].item(), unique[-1].item()))
+    if values.dtype.kind != "O":
+        return None
+    try:
+        # value == value drops NaN
+        unique = {value for value in values.tolist()
+                  if value is not None and value == value}
+    except TypeError:
+        return None
+    return ("values", unique) if len(unique) <= _MAX_HEADER_VALUES else None
+
+
+def _may_match(summary, wanted):
+    """False when the header shows that no row of a part has a wanted value"""
+    if summary is None:
+        return True
+    kind, content = summary
+    if kind == "values":
+        return not content.isdisjoint(wanted)
+    low, high = content
+    return any(low <= value <= high for value in wanted
+               if isinstance(value, (int, float, np.number)))
+
+
+class results_store(object):
+    '''Append-only store of fit results in a folder of part files
+
+    Attributes:
+        directory (str): folder containing the part files
+    '''
+
+    def __init__(self, directory):
+        '''
+        Args:
+            directory (str): folder of the store, created if needed
+        '''
+        self.directory = str(directory)
+        self._headers = {}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _part_files(self):
+        '''Paths of all the part files, including replaced ones'''
+        return [os.path.join(self.directory, item)
+                for item in sorted(os.listdir(self.directory))
+                if item.startswith('part-') and item.endswith('.pkl')]
+
+    def parts(self):
+        '''Paths of the part files, oldest first
+
+        Parts replaced by a compacted or rewritten part are left out, they
+        are only on disk until the process rewriting them removes them.
+        '''
+        return self._visible(self._part_files())
+
+    def _visible(self, paths):
+        '''Paths not replaced by another part'''
+        replaced = set()
+        for path in paths:
+            try:
+                replaced.update(self._header(path).get('replaces', ()))
+            except FileNotFoundError:
+                pass
+        return [path for path in paths if os.path.basename(path) not in replaced
+                and os.path.exists(path)]
+
+    @contextlib.contextmanager
+    def _lock(self):
+        '''Exclusive lock file of the store, held while parts are rewritten'''
+        path = os.path.join(self.directory, 'store.lock')
+        deadline = time.monotonic() + _LOCK_TIMEOUT
+        while True:
+            try:
+                handle = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(
+                        'results_store ' + self.directory + ' is locked, '
+                        'remove ' + path + ' if no other process uses it')
+                time.sleep(0.05)
+        try:
+            os.write(handle, str(os.getpid()).encode())
+            os.close(handle)
+            yield
+        finally:
+            os.remove(path)
+
+    def append(self, rows, **metadata):
+        '''Write rows as a new part file
+
+        Args:
+            rows: lmfit.fitresult, list of fit results, dict, list of dicts
+                or pandas DataFrame (fit results are converted with
+                :meth:`result_row`)
+            metadata: columns added to every row (e.g. sample_ID=12)
+
+        Returns:
+            path of the new part file, None if there are no rows
+        '''
+        table = _table(rows, metadata)
+        if len(table) == 0:
+            return None
+        return self._write(table, time.time_ns())
+
+    def _write(self, table, timestamp, replaces=()):
+        '''Write a part file atomically, parts are sorted by timestamp
+
+        replaces: paths of the parts whose rows are in table, hidden from
+        parts() as soon as the new part is in place
+        '''
+        header = {'version': _STORE_VERSION, 'rows': len(table),
+                  'columns': {name: _summary(column.to_numpy())
+                              for name, column in table.items()},
+                  'replaces': [os.path.basename(path) for path in replaces]}
+        name = 'part-{:020d}-{}-{}.pkl'.format(timestamp, os.getpid(),
+                                               uuid.uuid4().hex[:8])
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                pickle.dump(header, file, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(table, file, protocol=pickle.HIGHEST_PROTOCOL)
+            path = os.path.join(self.directory, name)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._headers[path] = header
+        return path
+
+    def _header(self, path):
+        '''Header of a part file, read once (parts are never modified)'''
+        if path not in self._headers:
+            with open(path, 'rb') as file:
+                self._headers[path] = pickle.load(file)
+        return self._headers[path]
+
+    def _matching_parts(self, conditions):
+        wanted = {name: (set(value) if isinstance(value, (list, tuple, set))
+                         else {value})
+                  for name, value in conditions.items()}
+        parts = []
+        for path in self.parts():
+            columns = self._header(path)['columns']
+            if all(name in columns and _may_match(columns[name], values)
+                   for name, values in wanted.items()):
+                parts.append(path)
+        return parts, wanted
+
+    def _load(self, path):
+        '''Table of a part file'''
+        with open(path, 'rb') as file:
+            pickle.load(file)
+            return pickle.load(file)
+
+    def read(self, columns=None, **conditions):
+        '''Rows matching conditions, reading only the parts that can match
+
+        Args:
+            columns: list of columns to return, default all
+            conditions: column=value or column=list of accepted values
+                (e.g. sample_ID=12, temperature=[20, 25])
+
+        Returns:
+            Pandas dataframe with the matching rows in the order of the appends
+        '''
+        while True:
+            parts, wanted = self._matching_parts(conditions)
+            try:
+                loaded = [self._load(path) for path in parts]
+                break
+            except FileNotFoundError:
+                # a part was replaced while reading, list the parts again
+                continue
+        tables = []
+        for table in loaded:
+            for name, values in wanted.items():
+                table = table[table[name].isin(values)]
+            if columns is not None:
+                table = table[[name for name in columns if name in table.columns]]
+            tables.append(table)
+        if not tables:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(tables, ignore_index=True, sort=False)
+
+    def _replace_parts(self, parts, table):
+        '''Write table in place of parts, then remove them'''
+        timestamp = int(os.path.basename(parts[0]).split('-')[1])
+        merged = self._write(table, timestamp, replaces=parts)
+        for path in parts:
+            os.remove(path)
+            self._headers.pop(path, None)
+        return merged
+
+    def compact(self):
+        '''Merge all the current parts in one part file
+
+        Parts appended by other processes while compacting are kept, the
+        merged part takes the place of the oldest part in the append order.
+        Compactions and deletions of several processes are serialized by a
+        lock file.
+
+        Returns:
+            path of the merged part file, None if the store is empty
+        '''
+        with self._lock():
+            paths = self._part_files()
+            parts = self._visible(paths)
+            # replaced parts left by a process stopped before removing them
+            for path in set(paths) - set(parts):
+                if os.path.exists(path):
+                    os.remove(path)
+                self._headers.pop(path, None)
+            if len(parts) < 2:
+                return parts[0] if parts else None
+            table = pd.concat([self._load(path) for path in parts],
+                              ignore_index=True, sort=False)
+            return self._replace_parts(parts, table)
+
+    def delete(self, **conditions):
+        '''Remove the rows matching conditions
+
+        The parts holding matching rows are rewritten without them, in one
+        part that replaces them atomically (under the lock file, see
+        compact). Used to replace the results of a sample before appending
+        the new ones.
+
+        Args:
+            conditions: column=value or column=list of accepted values, at
+                least one (e.g. sample_ID=12, temperature=20)
+
+        Returns:
+            number of rows removed
+        '''
+        if not conditions:
+            raise ValueError('no conditions, use clear() to remove all the rows')
+        with self._lock():
+            parts, wanted = self._matching_parts(conditions)
+            changed, tables = [], []
+            for path in parts:
+                table = self._load(path)
+                matching = np.ones(len(table), dtype=bool)
+                for name, values in wanted.items():
+                    matching &= table[name].isin(values).to_numpy()
+                if matching.any():
+                    changed.append(path)
+                    tables.append(table[~matching])
+            if not changed:
+                return 0
+            removed = sum(self._header(path)['rows'] for path in changed)
+            table = pd.concat(tables, ignore_index=True, sort=False)
+            self._replace_parts(changed, table)
+            return removed - len(table)
+
+    def clear(self):
+        '''Remove all the part files
+
+        Destructive: the rows appended by every process are deleted, use
+        delete() to remove only some rows.
+        '''
+        with self._lock():
+            for path in self._part_files():
+                os.remove(path)
+            self._headers = {}
+
+    def __len__(self):
+        return sum(self._header(path)['rows'] for path in self.parts())
+
+    def __repr__(self):
+        return 'results_store(' + self.directory + ')'
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Module for variable projection fits
+-----------------------------------
+
+Most flow curve models are linear in some of their parameters: HB is linear
+in ystress and K once n is given, TC in ystress and eta_bg once
+gammadot_crit is given, Bingham and Newtonian are linear in all of them.
+For given values of the nonlinear parameters, the best linear parameters are
+the solution of a (bounded) weighted linear least squares problem. The
+nonlinear search then runs only over the remaining one or two parameters,
+which is faster and far less sensitive to the starting values.
+
+The linear structure of a model is given by its basis function (e.g.
+:meth:`rheofit.models.HB_basis`), registered with
+:meth:`rheofit.models.register_model`.
+
+Example:
+
+        params, info = rheofit.varpro.varpro_params(
+            rheofit.models.HB_model, shear_rate, stress, weights=1 / stress)
+
+        rheofit.models.fit_FC(rheofit.models.HB_model, data, method='varpro')
+
+"""
+import inspect
+import itertools
+
+import numpy as np
+
+# residual used when the model can not be evaluated (e.g. overflow)
+_PENALTY = 1e10
+
+# relative distance of the nonlinear search from the parameter bounds
+_BOUND_MARGIN = 1e-10
+
+
+def nonlinear_names(model):
+    """Root names of the nonlinear parameters of a model with a basis"""
+    return list(inspect.signature(model.basis).parameters)[1:]
+
+
+def _interior(values, lower, upper):
+    """Move values that are not strictly inside the bounds just inside"""
+    span = np.where(np.isfinite(upper - lower), upper - lower,
+                    np.abs(values) + 1)
+    inside = np.clip(values, lower + 1e-6 * span, upper - 1e-6 * span)
+    return np.where((values > lower) & (values < upper), values, inside)
+
+
+def _bounded_lstsq(matrix, target, lower, upper):
+    """Linear least squares solution of matrix @ coef = target within bounds
+
+    With up to 3 coefficients the bounded solution is found by enumerating
+    the faces of the box (each coefficient free, on its lower or on its upper
+    bound), which is much cheaper than scipy.optimize.lsq_linear for the
+    small problems of the flow curve models.
+    """
+    coef = np.linalg.lstsq(matrix, target, rcond=None)[0]
+    if np.all((coef >= lower) & (coef <= upper)):
+        return coef
+    if len(coef) > 3:
+        from scipy.optimize import lsq_linear
+        return lsq_linear(matrix, target, bounds=(lower, upper)).x
+
+    best, best_cost = None, np.inf
+    choices = [[None] + [bound for bound in (low, up) if np.isfinite(bound)]
+               for low, up in zip(lower, upper)]
+    for face in itertools.product(*choices):
+        clamped = np.array([bound is not None for bound in face])
+        if not clamped.any():
+            continue
+        candidate = np.array([0.0 if bound is None else bound
+                              for bound in face])
+        rest = target - matrix[:, clamped] @ candidate[clamped]
+        if not clamped.all():
+            candidate[~clamped] = np.linalg.lstsq(matrix[:, ~clamped], rest,
+                                                  rcond=None)[0]
+            if not np.all((candidate >= lower) & (candidate <= upper)):
+                continue
+        residual = matrix @ candidate - target
+        cost = residual @ residual
+        if cost < best_cost:
+            best, best_cost = candidate, cost
+    return best
+
+
+def varpro_params(model, x, data, weights=None, params=None, max_nfev=None):
+    """ Least squares fit by variable projection
+
+        The linear parameters are solved exactly for every value of the
+        nonlinear ones tried by a bounded trust region search
+        (scipy.optimize.least_squares). Bounds and fixed parameters (vary
+        False) are respected.
+
+        Args:
+
+        model: rheology model with a basis (e.g. HB_model)
+
+        x: shear rate
+
+        data: stress
+
+        weights: residual weights (default 1)
+
+        params: lmfit.Parameters with starting values of the nonlinear
+            parameters and the bounds (default model.make_params())
+
+        max_nfev: maximum number of evaluations of the nonlinear search
+
+        Returns:
+
+        (lmfit.Parameters at the optimum, dictionary with the number of
+        model evaluations 'nfev', the weighted sum of squares 'chisqr' and
+        the convergence flag 'success')
+
+        Raises:
+
+        NotImplementedError if the model has no basis or some parameter is
+        constrained by an expression
+    """
+    basis = getattr(model, "basis", None)
+    if basis is None:
+        raise NotImplementedError(
+            "no linear basis for model {}".format(model.name))
+    params = (params if params is not None else model.make_params()).copy()
+    if any(par.expr is not None for par in params.values()):
+        raise NotImplementedError("constrained parameters are not supported")
+
+    prefix = model.prefix
+    x = np.asarray(x, dtype="float")
+    data = np.asarray(data, dtype="float")
+    weights = (np.ones_like(data) if weights is None
+               else np.asarray(weights, dtype="float"))
+
+    nonlinear = [prefix + name for name in nonlinear_names(model)]
+    linear = [name for name in params if name not in nonlinear]
+    free = [name for name in nonlinear if params[name].vary]
+    free_linear = [name for name in linear if params[name].vary]
+    linear_lower = np.array([params[name].min for name in free_linear])
+    linear_upper = np.array([params[name].max for name in free_linear])
+    values = {name: par.value for name, par in params.items()}
+
+    def project(theta):
+        # residual (model - data) * weights with the best linear parameters
+        values.update(zip(free, theta))
+        with np.errstate(all="ignore"):
+            columns = basis(x, **{name[len(prefix):]: values[name]
+                                  for name in nonlinear})
+            columns = {prefix + name: np.broadcast_to(column, x.shape)
+                       for name, column in columns.items()}
+            target = data - sum((values[name] * columns[name]
+                                 for name in linear if name not in free_linear),
+                                np.zeros_like(data))
+            matrix = np.stack([columns[name] for name in free_linear]
+                              + [np.zeros_like(data)], axis=1)[:, :-1]
+            matrix = matrix * weights[:, None]
+            target = target * weights
+        if not (np.all(np.isfinite(matrix)) and np.all(np.isfinite(target))):
+            return np.full_like(data, _PENALTY)
+        coef = _bounded_lstsq(matrix, target, linear_lower, linear_upper)
+        values.update(zip(free_linear, coef))
+        return matrix @ coef - target
+
+    if free:
+        from scipy.optimize import least_squares
+
+        # keep the search slightly inside the bounds: lmfit maps values
+        # closer than ~1e-16 to a bound onto the bound itself, where models
+        # such as TC (gammadot_crit -> 0) are not finite
+        lower = np.array([params[name].min for name in free])
+        upper = np.array([params[name].max for name in free])
+        with np.errstate(invalid="ignore"):
+            lower = np.where(np.isfinite(lower), lower + _BOUND_MARGIN
+                             * np.maximum(np.abs(lower), 1), lower)
+            upper = np.where(np.isfinite(upper), upper - _BOUND_MARGIN
+                             * np.maximum(np.abs(upper), 1), upper)
+        start = _interior(np.array([params[name].value for name in free]),
+                          lower, upper)
+        solution = least_squares(project, start, bounds=(lower, upper),
+                                 x_scale="jac", max_nfev=max_nfev)
+        residual = project(solution.x)
+        # finite difference jacobian: one evaluation per nonlinear parameter
+        nfev = solution.nfev + solution.njev * len(free) + 1
+        success = bool(solution.success)
+    else:
+        residual = project(np.zeros(0))
+        nfev = 1
+        success = True
+
+    for name in free + free_linear:
+        params[name].set(value=float(values[name]))
+    return params, {"nfev": nfev, "chisqr": float(residual @ residual),
+                    "success": success}
@@ -1,10 +1,14 @@
-import ipywidgets as widgets
 import numpy as np
 import matplotlib.pyplot as plt
 import lmfit
 
+from .bands import confidence_band
+
 def make_par_widget(model,data=None):
     ''' '''
+    import ipywidgets as widgets
+    from IPython.display import display
+
     if data is not None:
         res_fit=model.fit(data['Stress'],x=data['Shear rate'],weights=1/(0.05*data['Stress']))
         params=res_fit.params
@@ -98,7 +102,7 @@ def plot_fit_res(fit_res, show_par_values=False,exp_err=0.05):
     return fig
 
 def plot_confidence(res_fit,expand=1):
-    dely = res_fit.eval_uncertainty(x=res_fit.userkws['x'],sigma=3)*expand
+    dely = confidence_band(res_fit,sigma=3)[0]*expand
 
     plt.plot(res_fit.userkws['x'], res_fit.data,'o',color='black',label='Data',markersize=5)
     plt.plot(res_fit.userkws['x'], res_fit.best_fit,label='Best fit TC model',color='red')
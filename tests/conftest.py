@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from rheofit import models
+
+# parameters of the default synthetic flow curve
+HB_VALUES = dict(ystress=8.0, K=2.5, n=0.45)
+
+
+def make_flow_curve(model="HB", values=None, npoints=30, rates=(-2, 3),
+                    noise=0.02, seed=0):
+    """Synthetic flow curve with relative normal noise
+
+    Args:
+        model (str): name of the model function of rheofit.models
+        values (dict): model parameters, default HB_VALUES for 'HB'
+        npoints (int): number of shear rates, log spaced
+        rates: decades of the lowest and highest shear rate
+        noise (float): standard deviation of the relative noise, 0 for
+            exact model values
+        seed (int): seed of the noise
+
+    Returns:
+        pandas DataFrame with columns 'Shear rate' and 'Stress'
+    """
+    x = np.logspace(*rates, npoints)
+    if values is None:
+        values = HB_VALUES
+    stress = getattr(models, model)(x, **values)
+    stress = stress * (1 + noise * np.random.default_rng(seed).normal(size=npoints))
+    return pd.DataFrame({"Shear rate": x, "Stress": stress})
+
+
+@pytest.fixture
+def flow_curve_factory():
+    """make_flow_curve, synthetic flow curves for the fitting tests"""
+    return make_flow_curve
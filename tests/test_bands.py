@@ -0,0 +1,76 @@
+import copy
+
+import numpy as np
+import pytest
+
+from rheofit import bands, models
+
+
+@pytest.fixture
+def fit(flow_curve_factory):
+    """Fit of a synthetic HB curve with 40 points"""
+    def fit(model, seed=0, noise=0.05, **kwargs):
+        return models.fit_FC(model, flow_curve_factory(npoints=40, noise=noise,
+                                                       seed=seed), **kwargs)
+    return fit
+
+
+@pytest.mark.parametrize("sigma", [1, 2, 0.95])
+def test_confidence_band_matches_eval_uncertainty(fit, sigma):
+    result = fit(models.HB_model)
+    dely, dely_predicted = bands.confidence_band(result, sigma=sigma)
+
+    reference = fit(models.HB_model)
+    expected = reference.eval_uncertainty(sigma=sigma)
+
+    np.testing.assert_allclose(dely, expected, rtol=1e-4)
+    assert np.all(dely_predicted > dely)
+    np.testing.assert_array_equal(result.dely, dely)
+
+
+def test_band_width_grows_with_confidence_and_noise(fit):
+    result = fit(models.HB_model)
+    narrow, _ = bands.confidence_band(result, sigma=1)
+    wide, _ = bands.confidence_band(result, sigma=3)
+    assert np.all(wide > narrow)
+
+    noisy = fit(models.HB_model, noise=0.2)
+    relative = np.median(narrow / result.best_fit)
+    assert np.median(bands.confidence_band(noisy)[0] / noisy.best_fit) > relative
+
+
+def test_band_on_a_new_grid(fit):
+    result = fit(models.HB_model)
+    grid = np.logspace(-1, 2, 7)
+    dely, dely_predicted = bands.confidence_band(result, x=grid)
+
+    np.testing.assert_allclose(dely, result.eval_uncertainty(x=grid),
+                               rtol=1e-4)
+    assert dely.shape == dely_predicted.shape == grid.shape
+
+
+def test_bands_of_several_results_match_single_results(fit):
+    results = {seed: fit(models.HB_model, seed=seed) for seed in range(3)}
+    together = bands.confidence_bands(results, sigma=2)
+
+    for seed, (dely, dely_predicted) in together.items():
+        single = bands.confidence_band(fit(models.HB_model, seed=seed),
+                                       sigma=2)
+        np.testing.assert_allclose(dely, single[0])
+        np.testing.assert_allclose(dely_predicted, single[1])
+
+
+def test_band_without_closed_form_derivatives(fit):
+    model = copy.copy(models.HB_model)
+    model.jac = None
+    result = fit(model)
+    np.testing.assert_allclose(bands.confidence_band(result)[0],
+                               result.eval_uncertainty(), rtol=1e-3)
+
+
+def test_log_residual_prediction_band_is_relative(fit):
+    result = fit(models.HB_model, residual="log")
+    dely, dely_predicted = bands.confidence_band(result)
+    relative_noise = np.sqrt(dely_predicted ** 2 - dely ** 2) / result.best_fit
+    np.testing.assert_allclose(relative_noise,
+                               bands._scale(result, 1) * np.sqrt(result.redchi))
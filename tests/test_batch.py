@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from rheofit import batch, models
+
+
+@pytest.fixture
+def curves(flow_curve_factory):
+    rng = np.random.default_rng(0)
+    return [flow_curve_factory(values=dict(ystress=ystress, K=K, n=0.4),
+                               npoints=25, noise=0.01, seed=seed)
+            for seed, (ystress, K) in enumerate(zip(rng.uniform(1, 20, 6),
+                                                    rng.uniform(0.5, 5, 6)))]
+
+
+def test_batch_matches_single_fits(curves):
+    table = batch.fit_FC_batch(models.HB_model, curves)
+
+    assert table["success"].all()
+    for index, curve in enumerate(curves):
+        result = models.fit_FC(models.HB_model, curve)
+        for name in ("HB_ystress", "HB_K", "HB_n"):
+            assert table[name].iloc[index] == pytest.approx(
+                result.params[name].value, rel=1e-4)
+        assert table["redchi"].iloc[index] == pytest.approx(result.redchi,
+                                                             rel=1e-4)
+
+
+def test_batch_keeps_fixed_parameters(curves):
+    params = models.HB_model.make_params()
+    params["HB_n"].set(value=0.4, vary=False)
+
+    table = batch.fit_FC_batch(models.HB_model, curves, params=params)
+
+    assert (table["HB_n"] == 0.4).all()
+
+
+def test_batch_rejects_constrained_parameters(curves):
+    params = models.HB_model.make_params()
+    params["HB_K"].set(expr="2 * HB_ystress")
+
+    with pytest.raises(NotImplementedError):
+        batch.fit_FC_batch(models.HB_model, curves, params=params)
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from rheofit import bootstrap, models
+
+
+@pytest.fixture
+def data(flow_curve_factory):
+    return flow_curve_factory(values=dict(ystress=5.0, K=2.0, n=0.45),
+                              noise=0.03)
+
+
+def test_fixed_parameter_stays_constant_across_replicates(data):
+    params = models.HB_model.make_params()
+    params["HB_n"].set(value=0.4, vary=False)
+    params["HB_K"].set(max=10)
+
+    boot = bootstrap.bootstrap_FC(models.HB_model, data,
+                                  n_replicates=50, seed=0, params=params,
+                                  n_workers=1)
+
+    assert np.all(boot.samples["HB_n"] == 0.4)
+    assert boot.samples["HB_K"].max() <= 10
+    assert boot.var_names == ["HB_ystress", "HB_K"]
+
+
+def test_replicates_do_not_depend_on_chunks(data):
+    one = bootstrap.bootstrap_FC(models.HB_model, data, n_replicates=40,
+                                 seed=1, n_workers=1)
+    chunked = bootstrap.bootstrap_FC(models.HB_model, data, n_replicates=40,
+                                     seed=1, n_workers=1, chunk_size=10)
+    np.testing.assert_allclose(one.samples["HB_n"], chunked.samples["HB_n"],
+                               rtol=1e-6)
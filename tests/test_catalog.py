@@ -0,0 +1,91 @@
+import glob
+import os
+import shutil
+
+import pytest
+
+from rheofit import catalog, rheodata
+
+FILES = sorted(glob.glob("notebooks/data/*.xls"))
+
+
+@pytest.fixture
+def folder(tmp_path):
+    data = tmp_path / "data"
+    (data / "las").mkdir(parents=True)
+    for filename in FILES:
+        target = data / "las" if "las10" in filename else data
+        shutil.copy2(filename, target)
+    return data
+
+
+def test_index_matches_the_parsed_files(folder, tmp_path):
+    index = catalog.data_catalog(tmp_path / "catalog.sqlite")
+    assert index.update(folder) == len(FILES)
+    assert len(index) == len(FILES)
+
+    files = index.select().set_index("filename")
+    steps = index.steps()
+    assert files["error"].isna().all()
+    for path in files["path"]:
+        data = rheodata.rheology_data(path)
+        entry = files.loc[os.path.basename(path)]
+        # missing Details fields are NULL in the catalog
+        assert (entry["geometry_name"] if isinstance(entry["geometry_name"], str)
+                else "") == data.geometry_name
+        if data.run_date is not None:
+            # the catalog also reads the 'rundate' key of older exports
+            assert entry["run_date"] == data.run_date.isoformat()
+        names = steps.loc[steps["path"] == path, "name"].tolist()
+        assert names == list(data.data.keys())
+
+
+def test_update_is_incremental(folder, tmp_path):
+    index = catalog.data_catalog(tmp_path / "catalog.sqlite")
+    index.update(folder)
+    assert catalog.data_catalog(tmp_path / "catalog.sqlite").update(folder) == 0
+
+    touched = folder / os.path.basename(FILES[0])
+    os.utime(touched, (1e9, 1e9))
+    assert index.update(folder) == 0
+
+    os.remove(touched)
+    assert index.update(folder) == 0
+    assert len(index) == len(FILES) - 1
+
+    assert index.update(folder, recursive=False) == 0
+    assert len(index) == len(FILES) - 1
+
+
+def test_select(folder, tmp_path):
+    index = catalog.data_catalog(tmp_path / "catalog.sqlite")
+    index.update(folder)
+    files = index.select()
+
+    geometry = files["geometry_name"].dropna().iloc[-1]
+    selected = index.select(geometry_name=geometry)
+    assert len(selected) == (files["geometry_name"] == geometry).sum()
+
+    assert len(index.select(after="2019-01-01")) == \
+        (files["run_date"] >= "2019").sum()
+    assert len(index.select(paths=folder / "las")) == \
+        sum("las10" in filename for filename in FILES)
+    assert len(index.select(step="no such step")) == 0
+    with pytest.raises(ValueError):
+        index.select(colour="red")
+
+    path = files["path"].iloc[0]
+    details = index.details(path)
+    assert details["Filename"] == os.path.splitext(os.path.basename(path))[0]
+
+
+def test_data_package_select(folder, tmp_path):
+    index = catalog.data_catalog(tmp_path / "catalog.sqlite")
+    package = rheodata.data_package(str(folder))
+
+    table = package.metadata_table(catalog=index)
+    assert sorted(table.index) == sorted(package.data_dict)
+
+    selected = package.select(catalog=index, step="Flow sweep")
+    expected = index.select(step="Flow sweep")
+    assert len(selected.data_dict) == len(expected)
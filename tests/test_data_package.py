@@ -0,0 +1,31 @@
+import os
+
+from rheofit import rheodata
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         "notebooks", "data")
+
+
+def _step_names(data):
+    return (data.filename, list(data.data))
+
+
+def test_iterate_matches_indexing():
+    package = rheodata.data_package(DATA_PATH, procedure=_step_names)
+
+    expected = [package[index] for index in range(len(package))]
+
+    assert len(package) == 11
+    assert list(package) == expected
+    assert list(package.iterate(prefetch=0)) == expected
+    assert list(package.iterate(prefetch=3, n_threads=2)) == expected
+
+
+def test_iterate_does_not_index_items(monkeypatch):
+    package = rheodata.data_package(DATA_PATH, procedure=_step_names)
+
+    def fail(self, index):
+        raise AssertionError("iterate called __getitem__")
+
+    monkeypatch.setattr(rheodata.data_package, "__getitem__", fail)
+    assert len(list(package.iterate(prefetch=2))) == len(package)
@@ -0,0 +1,83 @@
+import glob
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from rheofit import rheodata
+
+MANON = "data/Manon"
+
+
+def _write(path, text):
+    path.write_text(text)
+    return path
+
+
+def test_manon_files_match_the_committed_tables():
+    pytest.importorskip("yaml")
+    data = rheodata.read_digitized(MANON, recursive=False)
+    curves = data.flow_curves()
+
+    pickles = sorted(glob.glob(MANON + "/df_*.pkl"))
+    assert sorted(data.datasets.index) == sorted(
+        path.split("df_")[-1][:-len(".pkl")] for path in pickles)
+    for path in pickles:
+        expected = pd.read_pickle(path)
+        name = expected["ID"].iloc[0]
+        loaded = [curve for (dataset, _), curve in curves.items()
+                  if dataset == name]
+        assert [float(curve.name) for curve in loaded] == \
+            expected["phi"].tolist()
+        for curve, (_, row) in zip(loaded, expected.iterrows()):
+            np.testing.assert_allclose(curve.shear_rate,
+                                       np.asarray(row["shear_rate"], float))
+            np.testing.assert_allclose(curve.stress,
+                                       np.asarray(row["stress"], float))
+
+
+def test_webplotdigitizer_layout_and_filename_units(tmp_path):
+    _write(tmp_path / "10.1000_fig1_rate_stress_s-1_kPa.csv",
+           "a,,b,\nX,Y,X,Y\n1,2,1,4\n10,20,,\n")
+
+    data = rheodata.read_digitized(tmp_path)
+
+    assert len(data) == 2
+    assert data.datasets.loc["10.1000_fig1_rate_stress_s-1_kPa", "unit_y"] \
+        == "kPa"
+    assert data.table["curve"].tolist() == ["a", "a", "b"]
+    np.testing.assert_array_equal(data.table["Stress"], [2e3, 2e4, 4e3])
+    curves = data.flow_curves()
+    assert len(curves[("10.1000_fig1_rate_stress_s-1_kPa", "b")]) == 1
+
+
+def test_unit_arguments(tmp_path):
+    _write(tmp_path / "plain.csv", "a,\n1,2\n")
+
+    assert rheodata.read_digitized(tmp_path).table["Stress"].tolist() == [2]
+    data = rheodata.read_digitized(tmp_path, unit_y="dyn/cm2")
+    assert data.table["Stress"].tolist() == [pytest.approx(0.2)]
+    data = rheodata.read_digitized(tmp_path, unit_x="min-1",
+                                   units={"min-1": 1 / 60})
+    assert data.table["Shear rate"].tolist() == [pytest.approx(1 / 60)]
+    with pytest.raises(ValueError):
+        rheodata.read_digitized(tmp_path, unit_x="min-1")
+
+
+def test_empty_folder(tmp_path):
+    data = rheodata.read_digitized(tmp_path)
+    assert len(data) == 0
+    assert len(data.table) == 0
+    assert list(data.table.columns) == ["dataset", "curve", "Shear rate",
+                                        "Stress"]
+
+
+def test_yml_metadata_without_pyyaml(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "yaml", None)
+    _write(tmp_path / "plain.csv", "a,\n1,2\n")
+
+    assert len(rheodata.read_digitized(tmp_path)) == 1
+    _write(tmp_path / "metadata.yml", "plain:\n  unit_y: kPa\n")
+    with pytest.raises(ImportError, match="PyYAML"):
+        rheodata.read_digitized(tmp_path)
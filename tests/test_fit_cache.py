@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from rheofit import cache, models
+
+
+@pytest.fixture
+def data(flow_curve_factory):
+    return flow_curve_factory()
+
+
+def test_second_fit_is_a_hit(data):
+    fits = cache.fit_cache()
+    first = models.fit_FC(models.HB_model, data, cache=fits)
+    second = models.fit_FC(models.HB_model, data, cache=fits)
+
+    assert second is first
+    assert (fits.hits, fits.misses, len(fits)) == (1, 1, 1)
+    reference = models.fit_FC(models.HB_model, data)
+    assert first.params.valuesdict() == reference.params.valuesdict()
+
+
+def test_changes_invalidate_the_key(data):
+    x, stress = data["Shear rate"].to_numpy(), data["Stress"].to_numpy()
+    key = cache.fit_key(models.HB_model, x, stress)
+    assert cache.fit_key(models.HB_model, x.copy(), stress.copy()) == key
+
+    changed_stress = stress.copy()
+    changed_stress[3] *= 1 + 1e-12
+    params = models.HB_model.make_params()
+    fixed = models.HB_model.make_params()
+    fixed["HB_n"].set(vary=False)
+    changed = [
+        cache.fit_key(models.HB_model, x, changed_stress),
+        cache.fit_key(models.HB_model, x[:-1], stress[:-1]),
+        cache.fit_key(models.TC_model, x, stress),
+        cache.fit_key(models.HB_model, x, stress, params),
+        cache.fit_key(models.HB_model, x, stress, fixed),
+        cache.fit_key(models.HB_model, x, stress, residual="log"),
+        cache.fit_key(models.HB_model, x, stress, method="varpro"),
+    ]
+    assert len(set(changed + [key])) == len(changed) + 1
+
+
+def test_fit_with_other_settings_is_a_miss(data):
+    fits = cache.fit_cache()
+    linear = models.fit_FC(models.HB_model, data, cache=fits)
+    log = models.fit_FC(models.HB_model, data, residual="log", cache=fits)
+
+    assert log is not linear
+    assert log.residual_mode == "log"
+    assert (fits.hits, fits.misses) == (0, 2)
+
+
+def test_least_recently_used_entries_are_evicted():
+    fits = cache.fit_cache(max_entries=2)
+    fits.put("a", 1)
+    fits.put("b", 2)
+    assert fits.get("a") == 1
+    fits.put("c", 3)
+
+    assert "b" not in fits
+    assert "a" in fits and "c" in fits
+    assert fits.get("b") is None
+    assert len(fits) == 2
+
+
+def test_disk_entries_survive_a_new_cache(data, tmp_path):
+    disk = cache.data_cache(tmp_path)
+    result = models.fit_FC(models.HB_model, data,
+                           cache=cache.fit_cache(disk=disk))
+
+    fits = cache.fit_cache(disk=cache.data_cache(tmp_path))
+    reloaded = models.fit_FC(models.HB_model, data, cache=fits)
+
+    assert fits.hits == 1
+    assert reloaded.params.valuesdict() == result.params.valuesdict()
+    np.testing.assert_array_equal(reloaded.best_fit, result.best_fit)
+
+    fits.clear()
+    assert len(fits) == 0 and disk.entries() == []
+
+
+def test_series_does_not_flag_cached_results(flow_curve_factory):
+    fits = cache.fit_cache()
+    curves = [flow_curve_factory(seed=seed) for seed in range(3)]
+    first = models.fit_FC(models.HB_model, curves[0], cache=fits)
+
+    results = models.fit_FC_series(models.HB_model, curves, cache=fits)
+
+    assert [result.warm_start for result in results] == [False, True, True]
+    assert results[0] is not first
+    assert results[0].params is first.params
+    assert len(fits) == 3
+    assert not any(hasattr(result, "warm_start")
+                   for result in fits._entries.values())
@@ -0,0 +1,77 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from rheofit import batch, models, rheodata
+
+EXAMPLE = "notebooks/data/Flow_curve_example.xls"
+
+
+@pytest.fixture
+def table(flow_curve_factory):
+    table = flow_curve_factory(noise=0)
+    table["Viscosity"] = 1.0
+    return table
+
+
+def test_from_frame_shares_the_columns(table):
+    curve = rheodata.flow_curve.from_frame(table, name="step", metadata={})
+
+    assert np.shares_memory(curve["Shear rate"], table["Shear rate"].to_numpy())
+    np.testing.assert_array_equal(curve["Stress"], table["Stress"])
+    assert len(curve) == 30
+    with pytest.raises(KeyError):
+        curve["Viscosity"]
+    pd.testing.assert_frame_equal(curve.to_frame(),
+                                  table[["Shear rate", "Stress"]])
+
+
+def test_flow_curve_has_no_instance_dictionary():
+    curve = rheodata.flow_curve([1, 2], [3, 4])
+    assert not hasattr(curve, "__dict__")
+    assert curve.shear_rate.dtype == np.float64
+    with pytest.raises(ValueError):
+        rheodata.flow_curve([1, 2], [3, 4, 5])
+
+
+def test_pickle_round_trip():
+    metadata = {"filename": "a.xls"}
+    curve = rheodata.flow_curve([1, 2], [3, 4], name="step", metadata=metadata)
+    copy = pickle.loads(pickle.dumps(curve))
+
+    np.testing.assert_array_equal(copy.stress, curve.stress)
+    assert (copy.name, copy.metadata) == ("step", metadata)
+
+
+def test_fits_accept_flow_curves(table):
+    curve = rheodata.flow_curve.from_frame(table)
+
+    result = models.fit_FC(models.HB_model, curve)
+    reference = models.fit_FC(models.HB_model, table)
+    assert result.params.valuesdict() == pytest.approx(
+        reference.params.valuesdict())
+
+    fits = batch.fit_FC_batch(models.HB_model, [curve, curve])
+    assert fits["HB_n"].to_numpy() == pytest.approx([0.45, 0.45], rel=1e-6)
+
+
+def test_flow_curves_of_a_data_file():
+    data = rheodata.rheology_data(EXAMPLE)
+    curves = data.flow_curves()
+
+    assert curves
+    metadata = next(iter(curves.values())).metadata
+    assert metadata["filename"] == data.filename
+    for name, curve in curves.items():
+        table = data.data[name]
+        assert curve.name == name
+        assert curve.metadata is metadata
+        np.testing.assert_array_equal(curve["Stress"], table["Stress"])
+        assert not np.shares_memory(curve["Stress"], table["Stress"].to_numpy())
+
+    views = data.flow_curves(copy=False)
+    for name, curve in views.items():
+        assert np.shares_memory(curve["Stress"],
+                                data.data[name]["Stress"].to_numpy())
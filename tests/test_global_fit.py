@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from rheofit import batch, models
+
+
+@pytest.fixture
+def series(flow_curve_factory):
+    return [flow_curve_factory(values=dict(ystress=ystress, K=K, n=0.37),
+                               noise=0.005, seed=seed)
+            for seed, (ystress, K) in enumerate(zip(np.linspace(2, 40, 8),
+                                                    np.linspace(0.5, 6, 8)))]
+
+
+@pytest.mark.parametrize("residual", ["linear", "log"])
+def test_global_fit_recovers_shared_flow_index(series, residual):
+    result = batch.fit_FC_global(models.HB_model, series, shared=["n"],
+                                 residual=residual)
+
+    assert result.success
+    assert result.shared == ["HB_n"]
+    assert result.table["HB_n"].nunique() == 1
+    n = result.table["HB_n"].iloc[0]
+    assert n == pytest.approx(0.37, abs=3 * result.table["HB_n_stderr"].iloc[0])
+    np.testing.assert_allclose(result.table["HB_ystress"],
+                               np.linspace(2, 40, 8), rtol=0.05)
+    assert result.nvarys == 1 + 2 * len(series)
+
+
+def test_global_fit_rejects_constrained_parameters(series):
+    params = models.HB_model.make_params()
+    params["HB_K"].set(expr="2 * HB_ystress")
+
+    with pytest.raises(NotImplementedError):
+        batch.fit_FC_global(models.HB_model, series, shared=["n"],
+                            params=params)
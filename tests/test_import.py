@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["lmfit", "matplotlib", "IPython", "ipywidgets"]
+
+
+def _loaded(module, names):
+    script = ("import sys\n"
+              "import {}\n"
+              "print(' '.join(name for name in {!r} if name in sys.modules))"
+              ).format(module, names)
+    return subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True,
+                          capture_output=True, text=True).stdout.split()
+
+
+@pytest.mark.parametrize("module", ["rheofit.models", "rheofit"])
+def test_import_does_not_load_heavy_modules(module):
+    assert _loaded(module, HEAVY_MODULES) == []
+
+
+def test_package_import_does_not_load_the_submodules():
+    submodules = ["rheofit." + name for name in (
+        "rheodata", "batch", "cache", "varpro", "kernels", "bands",
+        "bootstrap", "catalog", "store", "visualization")]
+    assert _loaded("rheofit", submodules + ["xlrd", "sqlite3", "scipy"]) == []
+    assert _loaded("rheofit.rheodata", ["xlrd"]) == []
+
+
+def test_submodules_are_imported_on_access():
+    import rheofit
+
+    assert rheofit.catalog.data_catalog is not None
+    assert "store" in dir(rheofit)
+    with pytest.raises(AttributeError):
+        rheofit.missing
+
+
+def test_models_are_built_on_first_access():
+    from rheofit import models
+
+    model = models.get_model("HB")
+    assert model is models.HB_model
+    assert model.prefix == "HB_"
+    assert model.param_hints["n"]["max"] == 1
+    assert ":meth:`rheofit.models.HB`" in model.__doc__
+    assert "HB_model" in dir(models)
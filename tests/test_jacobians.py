@@ -0,0 +1,76 @@
+import inspect
+
+import numpy as np
+import pytest
+
+from rheofit import models
+
+SHEAR_RATE = np.logspace(-3, 3, 41)
+
+# parameter points (root names) on top of the defaults of each function
+POINTS = [
+    {},
+    {"ystress": 12.0, "eta_bg": 0.02, "K": 3.5, "n": 0.3,
+     "gammadot_crit": 0.05, "eta_0": 40.0, "eta_inf": 0.01},
+    {"ystress": 0.4, "eta_bg": 1.5, "K": 0.2, "n": 0.85,
+     "gammadot_crit": 20.0, "eta_0": 2.0, "eta_inf": 0.1},
+]
+
+
+def _defaults(func):
+    return {name: par.default
+            for name, par in inspect.signature(func).parameters.items()
+            if par.default is not inspect.Parameter.empty}
+
+
+def _central_differences(func, values, name, step=1e-6):
+    h = step * max(abs(values[name]), 1.0)
+    up = dict(values, **{name: values[name] + h})
+    down = dict(values, **{name: values[name] - h})
+    difference = (np.broadcast_to(func(SHEAR_RATE, **up), SHEAR_RATE.shape)
+                  - np.broadcast_to(func(SHEAR_RATE, **down), SHEAR_RATE.shape))
+    return difference / (2 * h)
+
+
+@pytest.mark.parametrize("point", range(len(POINTS)))
+@pytest.mark.parametrize("name", models.available_models())
+def test_jacobian_matches_central_differences(name, point):
+    spec = models._MODELS[name]
+    func, jac = spec["func"], spec["jac"]
+    defaults = _defaults(func)
+    values = dict(defaults, **{key: value for key, value in POINTS[point].items()
+                               if key in defaults})
+
+    derivatives = jac(SHEAR_RATE, **values)
+
+    assert set(derivatives) == set(defaults)
+    for parameter in defaults:
+        np.testing.assert_allclose(
+            np.broadcast_to(derivatives[parameter], SHEAR_RATE.shape),
+            _central_differences(func, values, parameter),
+            rtol=1e-5, atol=1e-8, err_msg=name + " " + parameter)
+
+
+@pytest.mark.parametrize("name", models.available_models())
+def test_residual_jacobian_matches_central_differences(name):
+    model = models.get_model(name)
+    params = model.make_params()
+    stress = np.broadcast_to(model.eval(params, x=SHEAR_RATE), SHEAR_RATE.shape)
+    data = stress * 1.1
+    weights = 1 / data
+
+    jacobian = model._residual_jacobian(params, data, weights, x=SHEAR_RATE)
+
+    for column, (parameter, par) in enumerate(
+            (item for item in params.items() if item[1].vary)):
+        h = 1e-6 * max(abs(par.value), 1.0)
+        residuals = []
+        for value in (par.value + h, par.value - h):
+            shifted = params.copy()
+            shifted[parameter].set(value=value)
+            residuals.append(model._residual(shifted, data, weights,
+                                             x=SHEAR_RATE))
+        np.testing.assert_allclose(jacobian[:, column],
+                                   (residuals[0] - residuals[1]) / (2 * h),
+                                   rtol=1e-5, atol=1e-8,
+                                   err_msg=name + " " + parameter)
@@ -0,0 +1,106 @@
+import inspect
+
+import numpy as np
+import pytest
+
+from rheofit import kernels, models
+
+SHEAR_RATE = np.logspace(-3, 3, 37)
+
+BACKENDS = [pytest.param("numba", marks=pytest.mark.skipif(
+    not kernels.numba_available(), reason="numba is not installed")), "numpy"]
+
+
+def _values(name):
+    func = models._MODELS[name]["func"]
+    return {key: par.default
+            for key, par in inspect.signature(func).parameters.items()
+            if par.default is not inspect.Parameter.empty}
+
+
+def test_every_model_has_a_kernel():
+    assert sorted(kernels.available_kernels()) == sorted(models.available_models())
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("name", models.available_models())
+def test_kernels_match_reference(name, backend):
+    spec = models._MODELS[name]
+    values = _values(name)
+    func = kernels.fused_function(name[:-len("_model")], backend)
+    jac = kernels.fused_function(name[:-len("_model")], backend, jacobian=True)
+
+    np.testing.assert_allclose(
+        func(SHEAR_RATE, **values),
+        np.broadcast_to(spec["func"](SHEAR_RATE, **values), SHEAR_RATE.shape),
+        rtol=1e-12)
+    expected = spec["jac"](SHEAR_RATE, **values)
+    derivatives = jac(SHEAR_RATE, **values)
+    assert list(derivatives) == list(expected)
+    for key in expected:
+        np.testing.assert_allclose(
+            derivatives[key], np.broadcast_to(expected[key], SHEAR_RATE.shape),
+            rtol=1e-12, err_msg=key)
+
+
+@pytest.mark.parametrize("name", models.available_models())
+def test_kernels_with_array_parameters(name):
+    spec = models._MODELS[name]
+    # one parameter set per point, as evaluated by rheofit.batch
+    values = {key: value * np.linspace(0.5, 1.5, SHEAR_RATE.size)
+              for key, value in _values(name).items()}
+    if "n" in values:
+        values["n"] = np.clip(values["n"], 0.1, 0.9)
+    func = kernels.fused_function(name[:-len("_model")], "numpy")
+    jac = kernels.fused_function(name[:-len("_model")], "numpy", jacobian=True)
+
+    np.testing.assert_allclose(func(SHEAR_RATE, **values),
+                               spec["func"](SHEAR_RATE, **values), rtol=1e-12)
+    expected = spec["jac"](SHEAR_RATE, **values)
+    for key, derivative in jac(SHEAR_RATE, **values).items():
+        np.testing.assert_allclose(
+            derivative, np.broadcast_to(expected[key], SHEAR_RATE.shape),
+            rtol=1e-12, err_msg=key)
+
+
+def test_fused_model_fit_matches_reference():
+    x = SHEAR_RATE
+    data = {"Shear rate": x, "Stress": models.TCn(x, ystress=3.0, eta_bg=0.05,
+                                                  gammadot_crit=0.2, n=0.4)}
+    reference = models.fit_FC(models.TCn_model, data)
+    fused = models.fit_FC(models.get_model("TCn", backend="numpy"), data)
+
+    for key, par in reference.params.items():
+        assert fused.params[key].value == pytest.approx(par.value, rel=1e-6)
+
+
+def test_missing_numba_loop_warns(monkeypatch):
+    if not kernels.numba_available():
+        pytest.skip("numba is not installed")
+    monkeypatch.setitem(kernels._KERNELS, "HB",
+                        kernels._KERNELS["HB"][:1] + (None, None))
+    with pytest.warns(RuntimeWarning):
+        function = kernels.fused_function("HB", "numba")
+    assert function.backend == "numpy"
+
+
+@pytest.mark.parametrize("name", models.available_models())
+def test_numba_loops_in_python(name):
+    # the loops are plain python: check them without compiling with numba
+    spec = models._MODELS[name]
+    values = _values(name)
+    _, kernel, jac_kernel = kernels._KERNELS[name[:-len("_model")]]
+
+    out = np.empty(SHEAR_RATE.size)
+    kernel(SHEAR_RATE, *values.values(), out)
+    np.testing.assert_allclose(
+        out, np.broadcast_to(spec["func"](SHEAR_RATE, **values), out.shape),
+        rtol=1e-12)
+
+    out = np.empty((len(values), SHEAR_RATE.size))
+    jac_kernel(SHEAR_RATE, *values.values(), out)
+    expected = spec["jac"](SHEAR_RATE, **values)
+    for row, key in zip(out, values):
+        np.testing.assert_allclose(
+            row, np.broadcast_to(expected[key], row.shape), rtol=1e-12,
+            err_msg=key)
@@ -0,0 +1,81 @@
+import os
+
+import pandas as pd
+import pytest
+
+from rheofit import rheodata
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       "notebooks", "data", "Flow_curve_example.xls")
+
+
+def _steps(calls):
+    def loader(name):
+        def load():
+            calls.append(name)
+            if name == "broken":
+                raise ValueError("bad sheet")
+            return pd.DataFrame({"Stress": [1.0, 2.0]})
+        return load
+
+    steps = rheodata.lazy_steps()
+    for name in ("first", "broken", "last"):
+        steps.add_loader(name, loader(name))
+    return steps
+
+
+def test_membership_does_not_parse():
+    calls = []
+    steps = _steps(calls)
+
+    assert "first" in steps
+    assert "missing" not in steps
+    assert calls == []
+    assert steps.get("missing") is None
+
+
+def test_failed_step_keeps_its_key_and_position():
+    calls = []
+    steps = _steps(calls)
+
+    with pytest.raises(ValueError):
+        steps["broken"]
+    with pytest.raises(ValueError):
+        steps["broken"]
+
+    assert calls == ["broken"]
+    assert list(steps) == ["first", "broken", "last"]
+    assert "broken" in steps
+    assert isinstance(steps.errors["broken"], ValueError)
+    assert [name for name, _ in steps.items()] == ["first", "last"]
+    assert steps.loaded == ["first", "last"]
+
+
+def test_lazy_file_matches_eager_file():
+    eager = rheodata.rheology_data(EXAMPLE)
+    lazy = rheodata.rheology_data(EXAMPLE, lazy=True)
+
+    assert list(lazy.data) == list(eager.data)
+    assert lazy.data.loaded == []
+    name, table = lazy[1]
+    assert name == list(eager.data)[1]
+    pd.testing.assert_frame_equal(table, eager.data[name])
+    assert lazy.data.loaded == [name]
+
+
+def test_adding_lazy_data_does_not_parse():
+    calls = []
+    eager = rheodata.rheology_data(EXAMPLE)
+    lazy = rheodata.rheology_data(EXAMPLE, lazy=True)
+    lazy.data = _steps(calls)
+    names = list(eager.data)
+
+    combined = eager + lazy
+
+    assert calls == []
+    assert list(combined.data) == names + ["first", "broken", "last"]
+    assert combined.data.loaded == names
+    assert [name for name, _ in combined.data.items()] == names + ["first",
+                                                                    "last"]
+    assert calls == ["first", "broken", "last"]
+    assert "broken" in combined.data.errors
@@ -0,0 +1,87 @@
+import threading
+
+import numpy as np
+import pytest
+
+from rheofit import models
+from rheofit._rheology_model import _jacobian_fit_kws, fit_log_residual
+
+
+@pytest.fixture
+def data(flow_curve_factory):
+    return flow_curve_factory(values=dict(ystress=5.0, K=2.0, n=0.45),
+                              npoints=25, noise=0)
+
+
+def test_log_fit_drops_non_positive_stress(data):
+    data.loc[3, "Stress"] = 0.0
+    data.loc[7, "Stress"] = -1.0
+
+    result = models.fit_FC(models.HB_model, data, residual="log")
+
+    assert result.residual_mode == "log"
+    assert result.ndata == len(data) - 2
+    assert abs(result.params["HB_n"].value - 0.45) < 1e-4
+
+
+def test_log_fit_does_not_modify_the_model(data):
+    model = models.HB_model
+    seen = []
+
+    def check(params, iteration, resid, *args, **kwargs):
+        seen.append("_residual" in vars(model))
+
+    fit_log_residual(model, data["Stress"], x=data["Shear rate"],
+                     params=model.guess(data["Stress"], x=data["Shear rate"]),
+                     iter_cb=check)
+
+    assert seen and not any(seen)
+    assert "_residual" not in vars(model)
+
+
+def test_log_and_linear_fits_in_threads(data):
+    results = {}
+
+    def fit(residual):
+        results[residual] = [models.fit_FC(models.HB_model, data,
+                                           residual=residual)
+                             for _ in range(5)]
+
+    threads = [threading.Thread(target=fit, args=(residual,))
+               for residual in ("linear", "log")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for result in results["linear"]:
+        assert not hasattr(result, "residual_mode")
+        np.testing.assert_allclose(result.residual, 0, atol=1e-6)
+    assert all(result.residual_mode == "log" for result in results["log"])
+
+
+def test_linear_and_log_fits_pass_the_jacobian_in_the_same_cases():
+    model = models.HB_model
+    constrained = model.make_params()
+    constrained["HB_K"].set(expr="2 * HB_ystress")
+
+    assert "Dfun" in _jacobian_fit_kws(model, "leastsq", None, None, len)
+    assert "Dfun" in _jacobian_fit_kws(model, "least_squares", {}, None, len)
+    assert "Dfun" not in _jacobian_fit_kws(model, "nelder", None, None, len)
+    assert "Dfun" not in _jacobian_fit_kws(model, "leastsq", None,
+                                           constrained, len)
+    assert _jacobian_fit_kws(model, "leastsq", {"Dfun": abs}, None,
+                             len)["Dfun"] is abs
+
+
+def test_log_fit_uses_the_analytic_jacobian(data):
+    result = models.fit_FC(models.HB_model, data, residual="log")
+    numeric = fit_log_residual(models.HB_model, data["Stress"],
+                               x=data["Shear rate"],
+                               params=models.HB_model.guess(
+                                   data["Stress"], x=data["Shear rate"]),
+                               fit_kws={"Dfun": None})
+
+    assert result.nfev < numeric.nfev
+    assert result.params["HB_n"].value == pytest.approx(
+        numeric.params["HB_n"].value, rel=1e-6)
@@ -0,0 +1,47 @@
+import lmfit
+import numpy as np
+import pytest
+
+from rheofit import models
+
+
+def _broken(x, a=1.0):
+    raise ValueError("broken model")
+
+
+def test_best_model_ranks_first(flow_curve_factory):
+    data = flow_curve_factory(noise=0.01)
+
+    table = models.select_model(data, models=["HB", "Bingham", "Powerlaw"],
+                                n_workers=1)
+
+    assert table.index[0] == models.HB_model.name
+    assert table["success"].all()
+    assert table["bic"].is_monotonic_increasing
+
+
+def test_failed_fits_are_recorded(flow_curve_factory, capsys):
+    broken = lmfit.Model(_broken, name="broken")
+
+    table = models.select_model(flow_curve_factory(),
+                                models=[broken, "HB"], n_workers=1)
+
+    assert capsys.readouterr().out == ""
+    failed = table.loc[broken.name]
+    assert table.index[-1] == broken.name
+    assert "broken model" in failed["error"]
+    assert not failed["success"]
+    assert np.isnan(failed["bic"])
+
+
+@pytest.mark.parametrize("name", models.available_models())
+def test_guess_with_shared_transforms(flow_curve_factory, name):
+    data = flow_curve_factory(noise=0.05)
+    x, stress = data["Shear rate"], data["Stress"]
+    model = models.get_model(name)
+
+    shared = model.guess(stress, x=x,
+                         transforms=models.curve_transforms(x, stress))
+
+    expected = model.guess(stress, x=x)
+    assert shared.valuesdict() == pytest.approx(expected.valuesdict())
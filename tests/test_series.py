@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from rheofit import models
+
+
+@pytest.fixture
+def series(flow_curve_factory):
+    """Six curves of a temperature series, slowly changing parameters"""
+    def make(count=6):
+        return {temperature: flow_curve_factory(
+                    values=dict(ystress=10.0 - i, K=3.0 - 0.3 * i,
+                                n=0.4 + 0.03 * i), seed=i)
+                for i, temperature in enumerate(np.linspace(20, 70, count))}
+    return make
+
+
+def test_series_matches_independent_fits(series):
+    curves = series()
+    results = models.fit_FC_series(models.HB_model, curves)
+
+    assert list(results) == list(curves)
+    assert [result.warm_start for result in results.values()] == \
+        [False] + [True] * (len(curves) - 1)
+    for key, result in results.items():
+        reference = models.fit_FC(models.HB_model, curves[key])
+        assert result.chisqr == pytest.approx(reference.chisqr, rel=1e-6)
+        for name, par in reference.params.items():
+            assert result.params[name].value == pytest.approx(par.value,
+                                                              rel=1e-3)
+
+
+def test_each_fit_starts_from_the_previous_best_fit(series, monkeypatch):
+    starts = []
+    fit_FC = models.fit_FC
+
+    def recording_fit_FC(model, data, params=None, **kwargs):
+        starts.append(None if params is None else params.valuesdict())
+        return fit_FC(model, data, params=params, **kwargs)
+
+    monkeypatch.setattr(models, "fit_FC", recording_fit_FC)
+    results = models.fit_FC_series(models.HB_model,
+                                   list(series(3).values()))
+
+    assert len(starts) == 3
+    assert starts[0] is None
+    for start, previous in zip(starts[1:], results):
+        assert start == pytest.approx(previous.params.valuesdict())
+
+
+def test_fallback_keeps_the_better_fit(series):
+    curves = list(series(3).values())
+    results = models.fit_FC_series(models.HB_model, curves,
+                                   fallback_ratio=0)
+
+    for data, result in zip(curves, results):
+        reference = models.fit_FC(models.HB_model, data)
+        assert result.chisqr <= reference.chisqr * (1 + 1e-9)
+
+
+def test_log_residual_series(series):
+    curves = list(series(3).values())
+    results = models.fit_FC_series(models.HB_model, curves, residual="log")
+
+    for data, result in zip(curves, results):
+        reference = models.fit_FC(models.HB_model, data, residual="log")
+        assert result.residual_mode == "log"
+        assert result.chisqr == pytest.approx(reference.chisqr, rel=1e-6)
@@ -0,0 +1,105 @@
+import concurrent.futures
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from rheofit import store
+
+
+def _rows(sample_ID, n=3):
+    return [{"sample_ID": sample_ID, "temperature": 20 + 5 * i,
+             "HB_n": 0.1 * sample_ID + 0.01 * i} for i in range(n)]
+
+
+def _filled(directory, nsamples=5):
+    results = store.results_store(directory)
+    for sample_ID in range(nsamples):
+        results.append(_rows(sample_ID), operator="A")
+    return results
+
+
+def test_append_read_round_trip(tmp_path):
+    results = _filled(tmp_path / "fits")
+
+    assert len(results) == 15
+    assert len(results.parts()) == 5
+    table = results.read()
+    assert list(table["sample_ID"]) == [i for i in range(5) for _ in range(3)]
+    assert (table["operator"] == "A").all()
+
+    selected = results.read(columns=["HB_n"], sample_ID=[1, 3], temperature=25)
+    assert list(selected.columns) == ["HB_n"]
+    np.testing.assert_allclose(selected["HB_n"], [0.11, 0.31])
+
+
+def test_compact_round_trip(tmp_path):
+    results = _filled(tmp_path / "fits")
+    before = results.read()
+
+    merged = results.compact()
+
+    assert results.parts() == [merged]
+    pd.testing.assert_frame_equal(results.read(), before)
+    # a new store object reads the same rows from disk
+    pd.testing.assert_frame_equal(
+        store.results_store(tmp_path / "fits").read(), before)
+    assert not os.path.exists(os.path.join(results.directory, "store.lock"))
+
+
+def test_delete_replaces_only_matching_rows(tmp_path):
+    results = _filled(tmp_path / "fits")
+
+    removed = results.delete(sample_ID=2, temperature=[20, 25])
+    results.append({"sample_ID": 2, "temperature": 20, "HB_n": 0.5})
+
+    assert removed == 2
+    assert len(results) == 14
+    table = results.read(sample_ID=2)
+    assert sorted(zip(table["temperature"], table["HB_n"])) == [(20, 0.5),
+                                                                (30, 0.22)]
+    assert len(results.read(sample_ID=[0, 1, 3, 4])) == 12
+    with pytest.raises(ValueError):
+        results.delete()
+
+
+def test_replaced_parts_are_hidden(tmp_path):
+    results = _filled(tmp_path / "fits")
+    parts = results.parts()
+    before = results.read()
+
+    # merged part written, old parts not removed yet (stopped process)
+    results._write(before, 0, replaces=parts)
+
+    assert len(results.parts()) == 1
+    pd.testing.assert_frame_equal(results.read(), before)
+    results.compact()
+    assert len(os.listdir(results.directory)) == 1
+
+
+def _compact(directory):
+    return store.results_store(directory).compact()
+
+
+def test_concurrent_compactions_keep_all_rows(tmp_path):
+    directory = str(tmp_path / "fits")
+    results = _filled(directory, nsamples=20)
+    before = results.read()
+
+    with concurrent.futures.ProcessPoolExecutor(2) as executor:
+        list(executor.map(_compact, [directory] * 4))
+
+    after = store.results_store(directory).read()
+    pd.testing.assert_frame_equal(after, before)
+    assert len(store.results_store(directory).parts()) == 1
+
+
+def test_lock_timeout(tmp_path, monkeypatch):
+    results = _filled(tmp_path / "fits", nsamples=2)
+    open(os.path.join(results.directory, "store.lock"), "w").close()
+    monkeypatch.setattr(store, "_LOCK_TIMEOUT", 0.1)
+
+    with pytest.raises(TimeoutError):
+        results.compact()
+    assert len(results.parts()) == 2
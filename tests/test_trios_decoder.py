@@ -0,0 +1,47 @@
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+from rheofit import rheodata
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+XLS_FILES = sorted(glob.glob(os.path.join(ROOT, "data", "**", "*.xls"),
+                             recursive=True)
+                   + glob.glob(os.path.join(ROOT, "notebooks", "data", "*.xls")))
+
+
+@pytest.mark.parametrize("filename", XLS_FILES,
+                         ids=[os.path.basename(name) for name in XLS_FILES])
+def test_decoder_matches_pandas_parse(filename):
+    excel = pd.ExcelFile(filename)
+    steps = [name for name in excel.sheet_names if name != "Details"]
+    assert steps
+
+    for name in steps:
+        try:
+            expected = (excel.parse(name, skiprows=1).drop(0).reset_index()
+                        .astype(float))
+        except KeyError:
+            # empty sheet, not loaded by either parser
+            with pytest.raises(ValueError):
+                rheodata._decode_trios_sheet(excel.book, name)
+            continue
+
+        table = rheodata._decode_trios_sheet(excel.book, name)
+
+        pd.testing.assert_frame_equal(table, expected, check_flags=False)
+        assert set(table.attrs["units"]) == set(expected.columns) - {"index"}
+
+
+def test_units_do_not_parse_lazy_steps():
+    data = rheodata.rheology_data(
+        os.path.join(ROOT, "data", "emulsion", "10sle1s_85castoroil-3.xls"),
+        lazy=True)
+    assert data.units == {}
+    assert data.data.loaded == []
+
+    name, _ = data[0]
+    assert list(data.units) == [name]
+    assert data.units[name]["Storage modulus"] == "Pa"
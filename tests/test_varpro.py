@@ -0,0 +1,54 @@
+import pytest
+
+from rheofit import models, varpro
+
+CASES = [
+    ("HB", dict(ystress=8.0, K=2.5, n=0.45)),
+    ("TC", dict(ystress=5.0, eta_bg=0.05, gammadot_crit=0.3)),
+    ("Bingham", dict(ystress=3.0, eta_bg=0.2)),
+    ("carreau", dict(eta_0=20.0, gammadot_crit=0.5, n=0.3)),
+]
+
+
+@pytest.mark.parametrize("name, values", CASES)
+def test_varpro_and_leastsq_reach_the_same_optimum(flow_curve_factory, name,
+                                                   values):
+    model = models.get_model(name)
+    data = flow_curve_factory(name, values, npoints=40)
+    x, stress = data["Shear rate"].to_numpy(), data["Stress"].to_numpy()
+
+    params, info = varpro.varpro_params(model, x, stress, weights=1 / stress)
+    reference = models.fit_FC(model, data)
+
+    assert info["success"]
+    assert info["chisqr"] == pytest.approx(reference.chisqr, rel=1e-6)
+    for key, par in reference.params.items():
+        assert params[key].value == pytest.approx(par.value, rel=1e-4)
+
+    polished = models.fit_FC(model, data, method="varpro")
+    assert polished.chisqr == pytest.approx(reference.chisqr, rel=1e-8)
+    assert polished.varpro_nfev > 0
+
+
+def test_varpro_respects_fixed_parameters(flow_curve_factory):
+    data = flow_curve_factory(npoints=40)
+    x, stress = data["Shear rate"].to_numpy(), data["Stress"].to_numpy()
+    params = models.HB_model.make_params()
+    params["HB_n"].set(value=0.5, vary=False)
+
+    result, _ = varpro.varpro_params(models.HB_model, x, stress,
+                                     weights=1 / stress, params=params)
+
+    assert result["HB_n"].value == 0.5
+    reference = models.fit_FC(models.HB_model, data, params=params)
+    assert result["HB_K"].value == pytest.approx(reference.params["HB_K"].value,
+                                                 rel=1e-5)
+
+
+def test_varpro_rejects_constrained_parameters(flow_curve_factory):
+    data = flow_curve_factory()
+    params = models.HB_model.make_params()
+    params["HB_K"].set(expr="2 * HB_ystress")
+    with pytest.raises(NotImplementedError):
+        varpro.varpro_params(models.HB_model, data["Shear rate"],
+                             data["Stress"], params=params)